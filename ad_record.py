@@ -0,0 +1,297 @@
+"""
+Record compatto degli annunci usato lungo tutta la pipeline
+(estrazione -> filtri -> deduplicazione -> salvataggio -> notifiche)
+"""
+import logging
+from collections.abc import MutableMapping
+from datetime import datetime
+
+from page_parser import is_ad_sold
+
+logger = logging.getLogger("SnipeDeal.AdRecord")
+
+# Valori di default quando un campo non è disponibile nell'annuncio
+DEFAULT_LUOGO = "Città non specificata"
+DEFAULT_DATA = "Data non disponibile"
+DEFAULT_URL = "#"
+
+# Marcatore dei campi derivati non ancora decodificati
+_UNSET = object()
+
+
+def decode_price(ad_item):
+    """
+    Estrae il prezzo dall'elemento annuncio
+    """
+    try:
+        if 'features' in ad_item and '/price' in ad_item['features']:
+            price_feature = ad_item['features']['/price']
+            if 'values' in price_feature and len(price_feature['values']) > 0:
+                return float(price_feature['values'][0]['key'].replace(',', '.'))
+    except (ValueError, KeyError, IndexError) as e:
+        logger.warning(f"Errore nell'estrazione del prezzo: {str(e)}")
+
+    return 0
+
+
+def decode_id(ad_item):
+    """
+    Estrae l'ID dell'annuncio dall'URN
+    """
+    try:
+        if 'urn' in ad_item:
+            # urn format: "id:ad:61451886-7fac-477b-8896-a782e83a7821:list:600534176"
+            urn_parts = ad_item['urn'].split(':')
+            if len(urn_parts) >= 5:
+                return urn_parts[4]  # Ultimo elemento
+    except (KeyError, IndexError) as e:
+        logger.warning(f"Errore nell'estrazione dell'ID: {str(e)}")
+
+    return "unknown"
+
+
+def decode_location(ad_item):
+    """
+    Estrae solo la città dall'elemento annuncio
+    """
+    try:
+        if 'geo' in ad_item:
+            geo_data = ad_item['geo']
+            city = geo_data.get('city', {}).get('value', '')
+
+            # Se non c'è la città, prova con il comune
+            if not city:
+                city = geo_data.get('town', {}).get('value', '')
+
+            return city if city else DEFAULT_LUOGO
+    except Exception as e:
+        logger.warning(f"Errore nell'estrazione della località: {str(e)}")
+
+    return DEFAULT_LUOGO
+
+
+def decode_date(ad_item):
+    """
+    Estrae la data dall'elemento annuncio nel formato gg/mm/aaaa hh:mm
+    """
+    try:
+        if 'date' in ad_item:
+            date_str = ad_item['date']
+            # Converti la stringa di data in un oggetto datetime
+            date_obj = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
+            return date_obj.strftime('%d/%m/%Y %H:%M')
+    except Exception as e:
+        logger.warning(f"Errore nell'estrazione della data: {str(e)}")
+
+    return DEFAULT_DATA
+
+
+def decode_url(ad_item):
+    """
+    Estrae l'URL dall'elemento annuncio
+    """
+    try:
+        if 'urls' in ad_item and 'default' in ad_item['urls']:
+            return ad_item['urls']['default']
+    except (KeyError, IndexError, TypeError) as e:
+        logger.warning(f"Errore nell'estrazione dell'URL: {str(e)}")
+
+    return DEFAULT_URL
+
+
+class Ad(MutableMapping):
+    """
+    Annuncio di Subito.it con attributi a slot fissi.
+
+    Viene creato una sola volta dall'estrattore e passato per riferimento.
+    I campi derivati (data formattata, località, URL) vengono decodificati
+    dall'elemento JSON originale solo al primo accesso e poi memorizzati:
+    gli annunci scartati dalla deduplicazione non ne pagano mai il costo.
+
+    Per retrocompatibilità si comporta anche come un dizionario con le chiavi
+    storiche ('titolo', 'prezzo', 'luogo', 'data', 'url', 'id', 'venduto'):
+    le chiavi aggiuntive (es. i dati raw dell'HTML) finiscono in un dizionario
+    separato creato solo quando serve.
+    """
+
+    __slots__ = ('titolo', 'prezzo', '_luogo', '_data', '_url', 'id', 'venduto', '_raw', '_extra')
+
+    FIELDS = ('titolo', 'prezzo', 'luogo', 'data', 'url', 'id', 'venduto')
+
+    # Chiavi alternative usate dall'adapter e dagli scraper legacy
+    ALIASES = {
+        'data_annuncio': 'data',
+        'title': 'titolo',
+        'price': 'prezzo',
+        'link': 'url',
+        'location': 'luogo',
+        'sold': 'venduto',
+    }
+
+    def __init__(self, titolo, prezzo, luogo=_UNSET, data=_UNSET, url=_UNSET, id='unknown', venduto=False, raw=None):
+        """
+        Args:
+            raw: Elemento annuncio del JSON di Subito.it da cui decodificare in modo
+                 lazy luogo, data e URL non passati esplicitamente
+        """
+        self.titolo = titolo
+        self.prezzo = prezzo
+        self.id = id
+        self.venduto = venduto
+        self._extra = None
+        self._raw = raw
+        if raw is None:
+            luogo = DEFAULT_LUOGO if luogo is _UNSET else luogo
+            data = DEFAULT_DATA if data is _UNSET else data
+            url = DEFAULT_URL if url is _UNSET else url
+        self._luogo = luogo
+        self._data = data
+        self._url = url
+        self._release_raw()
+
+    @classmethod
+    def from_ad_item(cls, ad_item):
+        """
+        Crea un Ad da un elemento annuncio del JSON di Subito.it: titolo, prezzo,
+        ID e stato di vendita subito, gli altri campi al primo accesso
+        """
+        return cls(
+            titolo=ad_item.get('subject', 'Titolo non disponibile'),
+            prezzo=decode_price(ad_item),
+            id=decode_id(ad_item),
+            venduto=is_ad_sold(ad_item),
+            raw=ad_item
+        )
+
+    @classmethod
+    def from_dict(cls, values):
+        """Crea un Ad da un dizionario di risultato (chiavi storiche o alternative)"""
+        normalized = {cls.ALIASES.get(key, key): value for key, value in values.items()}
+        ad = cls(
+            titolo=normalized.pop('titolo', 'Titolo non disponibile'),
+            prezzo=normalized.pop('prezzo', 0),
+            luogo=normalized.pop('luogo', ''),
+            data=normalized.pop('data', ''),
+            url=normalized.pop('url', DEFAULT_URL),
+            id=normalized.pop('id', 'unknown'),
+            venduto=normalized.pop('venduto', False),
+        )
+        for key, value in normalized.items():
+            ad[key] = value
+        return ad
+
+    # --- Campi derivati con decodifica lazy ---
+
+    def _release_raw(self):
+        """Rilascia l'elemento JSON originale quando tutti i campi derivati sono decodificati"""
+        if self._raw is not None and _UNSET not in (self._luogo, self._data, self._url):
+            self._raw = None
+
+    @property
+    def luogo(self):
+        if self._luogo is _UNSET:
+            self._luogo = decode_location(self._raw)
+            self._release_raw()
+        return self._luogo
+
+    @luogo.setter
+    def luogo(self, value):
+        self._luogo = value
+        self._release_raw()
+
+    @property
+    def data(self):
+        if self._data is _UNSET:
+            self._data = decode_date(self._raw)
+            self._release_raw()
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self._release_raw()
+
+    @property
+    def url(self):
+        if self._url is _UNSET:
+            self._url = decode_url(self._raw)
+            self._release_raw()
+        return self._url
+
+    @url.setter
+    def url(self, value):
+        self._url = value
+        self._release_raw()
+
+    def materialize(self):
+        """Decodifica subito tutti i campi derivati e rilascia l'elemento JSON originale"""
+        self.luogo, self.data, self.url
+        return self
+
+    def to_dict(self):
+        """Restituisce una copia del record come dizionario (es. per json.dumps)"""
+        values = {field: getattr(self, field) for field in self.FIELDS}
+        if self._extra:
+            values.update(self._extra)
+        return values
+
+    # --- Serializzazione (pickle) ---
+
+    def __getstate__(self):
+        # Il record serializzato è compatto: niente elemento JSON originale
+        self.materialize()
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            object.__setattr__(self, slot, value)
+
+    # --- Vista dizionario per retrocompatibilità ---
+
+    def __getitem__(self, key):
+        key = self.ALIASES.get(key, key)
+        if key in self.FIELDS:
+            return getattr(self, key)
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        key = self.ALIASES.get(key, key)
+        if key in self.FIELDS:
+            setattr(self, key, value)
+            return
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.FIELDS or key in self.ALIASES:
+            raise KeyError(f"Il campo '{key}' non può essere rimosso da un Ad")
+        if self._extra is None or key not in self._extra:
+            raise KeyError(key)
+        del self._extra[key]
+
+    def __contains__(self, key):
+        key = self.ALIASES.get(key, key)
+        return key in self.FIELDS or (self._extra is not None and key in self._extra)
+
+    def __iter__(self):
+        yield from self.FIELDS
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return len(self.FIELDS) + (len(self._extra) if self._extra else 0)
+
+    def copy(self):
+        """Copia superficiale del record, senza forzare la decodifica dei campi lazy"""
+        ad = Ad.__new__(Ad)
+        for slot in self.__slots__:
+            object.__setattr__(ad, slot, getattr(self, slot))
+        if self._extra:
+            ad._extra = dict(self._extra)
+        return ad
+
+    def __repr__(self):
+        return f"Ad(id={self.id!r}, titolo={self.titolo!r}, prezzo={self.prezzo!r}, venduto={self.venduto!r})"
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Benchmark del parser sulle pagine reali salvate in data/debug.
+
+Riproduce page_N.html e data_N.json attraverso le fasi di parsing dello scraper
+e della Market Research e misura pagine/sec, annunci/sec, latenza per pagina
+(p50/p99) e picco di memoria allocata. I risultati sono salvati in JSON per
+confrontare esecuzioni su commit diversi.
+
+Uso:
+    python benchmark_parser.py
+    python benchmark_parser.py --iterations 50 --output risultati.json
+    python benchmark_parser.py --compare data/benchmarks/benchmark_precedente.json
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import platform
+import re
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from page_parser import CARD_FIELDS, parse_page
+from subito_scraper import SubitoScraper
+
+try:
+    import market_research
+except ImportError:
+    market_research = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger("SnipeDeal.Benchmark")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PAGES_DIR = os.path.join(BASE_DIR, "data", "debug")
+DEFAULT_OUTPUT_DIR = os.path.join(BASE_DIR, "data", "benchmarks")
+
+
+def load_fixtures(pages_dir):
+    """
+    Carica le coppie page_N.html / data_N.json presenti nella directory
+
+    Returns:
+        list: Dizionari con nome, HTML e stato JSON registrato (None se assente)
+    """
+    fixtures = []
+    for html_path in glob.glob(os.path.join(pages_dir, "page_*.html")):
+        match = re.search(r"page_(\d+)\.html$", html_path)
+        if not match:
+            continue
+        number = int(match.group(1))
+        # Come SubitoScraper.search, le pagine vengono elaborate come bytes
+        with open(html_path, "rb") as f:
+            html = f.read()
+
+        state = None
+        json_path = os.path.join(pages_dir, f"data_{number}.json")
+        if os.path.exists(json_path):
+            with open(json_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+
+        fixtures.append({"name": f"page_{number}", "number": number, "html": html, "state": state})
+
+    fixtures.sort(key=lambda fixture: fixture["number"])
+    return fixtures
+
+
+def percentile(values, pct):
+    """Percentile con interpolazione lineare (values non vuoto)"""
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def build_stages(scraper, fixtures):
+    """
+    Costruisce le fasi da misurare. Ogni fase ha una funzione di preparazione
+    (esclusa dal tempo misurato) e una funzione eseguita per ogni pagina che
+    restituisce il numero di annunci elaborati.
+    """
+    # Le card servono alla fase di merge indipendentemente dalla modalità json_only
+    cards_by_page = {}
+    for fixture in fixtures:
+        _, cards, _ = parse_page(fixture["html"], parser=scraper.html_parser, json_only=False)
+        cards_by_page[fixture["name"]] = cards
+
+    def state_of(fixture):
+        return fixture["state"] if fixture["state"] is not None else scraper._extract_json_from_html(fixture["html"])
+
+    def run_extract_json(fixture, _):
+        state = scraper._extract_json_from_html(fixture["html"])
+        return len(state["items"]["list"]) if state else 0
+
+    def run_results(fixture, state):
+        return len(scraper._get_results_from_json(state))
+
+    def prepare_merge(fixture):
+        return scraper._get_results_from_json(state_of(fixture)), cards_by_page[fixture["name"]]
+
+    def run_merge(fixture, prepared):
+        results, cards = prepared
+        scraper._merge_card_data(results, cards, CARD_FIELDS)
+        return len(results)
+
+    def run_pipeline(fixture, _):
+        # Percorso effettivo di SubitoScraper.search per una pagina già scaricata
+        ads, _ = scraper._parse_listing(fixture["html"], fixture["number"])
+        return len(scraper._filter_ads([ad.copy() for ad in ads]))
+
+    stages = [
+        ("extract_json_from_html", None, run_extract_json),
+        ("get_results_from_json", state_of, run_results),
+        ("card_merge", prepare_merge, run_merge),
+    ]
+
+    if market_research is not None:
+        def run_market_results(fixture, state):
+            return len(market_research._get_results_from_json(state))
+
+        stages.append(("market_research_get_results_from_json", state_of, run_market_results))
+    else:
+        logger.warning("market_research non importabile: fase Market Research saltata")
+
+    stages.append(("search_page_pipeline", None, run_pipeline))
+    return stages
+
+
+def measure_stage(fixtures, prepare, run, iterations, warmup):
+    """
+    Esegue una fase su tutte le pagine e ne misura tempi e memoria.
+
+    Il picco di memoria viene misurato in un passaggio separato, perché
+    tracemalloc rallenterebbe le misure di tempo.
+    """
+    def one_pass(record):
+        ads = 0
+        for fixture in fixtures:
+            prepared = prepare(fixture) if prepare else None
+            start = time.perf_counter()
+            ads += run(fixture, prepared)
+            elapsed = time.perf_counter() - start
+            if record is not None:
+                record.append(elapsed)
+        return ads
+
+    for _ in range(warmup):
+        one_pass(None)
+
+    latencies = []
+    total_ads = 0
+    for _ in range(iterations):
+        total_ads += one_pass(latencies)
+
+    # Passaggio separato per il picco di memoria allocata
+    peak_bytes = 0
+    for fixture in fixtures:
+        prepared = prepare(fixture) if prepare else None
+        tracemalloc.start()
+        try:
+            run(fixture, prepared)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peak_bytes = max(peak_bytes, peak)
+
+    total_time = sum(latencies)
+    pages = len(latencies)
+    return {
+        "pages": pages,
+        "ads": total_ads,
+        "total_seconds": round(total_time, 6),
+        "pages_per_sec": round(pages / total_time, 2) if total_time else None,
+        "ads_per_sec": round(total_ads / total_time, 2) if total_time else None,
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies) * 1000, 4),
+            "p50": round(percentile(latencies, 50) * 1000, 4),
+            "p99": round(percentile(latencies, 99) * 1000, 4),
+            "max": round(max(latencies) * 1000, 4),
+        },
+        "peak_alloc_kb": round(peak_bytes / 1024, 1),
+    }
+
+
+def git_revision():
+    """Commit corrente del repository, se disponibile"""
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR, capture_output=True, text=True, timeout=10,
+        )
+        return output.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_benchmark(pages_dir=DEFAULT_PAGES_DIR, iterations=20, warmup=2, html_parser=None,
+                  json_only=True, partial_json=True, parse_workers=0, stage_filter=None):
+    """
+    Esegue il benchmark completo e restituisce il report come dizionario
+    """
+    fixtures = load_fixtures(pages_dir)
+    if not fixtures:
+        raise FileNotFoundError(f"Nessuna pagina page_*.html trovata in {pages_dir}")
+
+    # Directory temporanea: lo scraper non deve toccare cache e log reali
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scraper = SubitoScraper(base_dir=tmp_dir, html_parser=html_parser,
+                                json_only=json_only, partial_json=partial_json,
+                                parse_workers=parse_workers)
+        # I log per annuncio falserebbero le misure
+        scraper.logger.setLevel(logging.WARNING)
+
+        report = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {
+                "pages_dir": os.path.relpath(pages_dir, BASE_DIR),
+                "fixtures": [fixture["name"] for fixture in fixtures],
+                "iterations": iterations,
+                "warmup": warmup,
+                "html_parser": scraper.html_parser,
+                "json_only": json_only,
+                "partial_json": partial_json,
+                "parse_workers": scraper.parse_workers,
+                "orjson": orjson is not None,
+            },
+            "stages": {},
+        }
+
+        for name, prepare, run in build_stages(scraper, fixtures):
+            if stage_filter and name not in stage_filter:
+                continue
+            logger.info(f"Misurazione fase {name}...")
+            report["stages"][name] = measure_stage(fixtures, prepare, run, iterations, warmup)
+
+        for handler in list(scraper.logger.handlers):
+            if isinstance(handler, logging.FileHandler):
+                scraper.logger.removeHandler(handler)
+                handler.close()
+
+    return report
+
+
+def compare_reports(current, previous):
+    """
+    Confronta due report e restituisce le variazioni percentuali per fase
+    (positivo = più veloce / meno memoria rispetto al report precedente)
+    """
+    comparison = {}
+    for name, stage in current["stages"].items():
+        old = previous.get("stages", {}).get(name)
+        if not old:
+            continue
+        delta = {}
+        if old.get("pages_per_sec") and stage.get("pages_per_sec"):
+            delta["pages_per_sec_pct"] = round((stage["pages_per_sec"] / old["pages_per_sec"] - 1) * 100, 1)
+        if old["latency_ms"].get("p50"):
+            delta["p50_pct"] = round((1 - stage["latency_ms"]["p50"] / old["latency_ms"]["p50"]) * 100, 1)
+        if old["latency_ms"].get("p99"):
+            delta["p99_pct"] = round((1 - stage["latency_ms"]["p99"] / old["latency_ms"]["p99"]) * 100, 1)
+        if old.get("peak_alloc_kb"):
+            delta["peak_alloc_pct"] = round((1 - stage["peak_alloc_kb"] / old["peak_alloc_kb"]) * 100, 1)
+        comparison[name] = delta
+    return {"against": previous.get("git_revision"), "stages": comparison}
+
+
+def print_report(report):
+    """Stampa un riepilogo leggibile del report"""
+    config = report["config"]
+    print(f"Benchmark parser - commit {report['git_revision'] or 'n/d'} - "
+          f"parser {config['html_parser']}, json_only={config['json_only']}, "
+          f"partial_json={config['partial_json']}, parse_workers={config['parse_workers']}, "
+          f"orjson={config['orjson']}")
+    print(f"{'fase':<40} {'pag/s':>10} {'annunci/s':>12} {'p50 ms':>9} {'p99 ms':>9} {'picco KB':>10}")
+    for name, stage in report["stages"].items():
+        print(f"{name:<40} {stage['pages_per_sec']:>10} {stage['ads_per_sec']:>12} "
+              f"{stage['latency_ms']['p50']:>9} {stage['latency_ms']['p99']:>9} {stage['peak_alloc_kb']:>10}")
+
+    comparison = report.get("comparison")
+    if comparison:
+        print(f"\nConfronto con il commit {comparison['against'] or 'n/d'} (positivo = miglioramento):")
+        for name, delta in comparison["stages"].items():
+            details = ", ".join(f"{key} {value:+}%" for key, value in delta.items())
+            print(f"  {name:<38} {details}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del parser sulle pagine di debug registrate")
+    parser.add_argument("--pages-dir", default=DEFAULT_PAGES_DIR, help="Directory con page_N.html e data_N.json")
+    parser.add_argument("--iterations", type=int, default=20, help="Passaggi misurati su tutte le pagine")
+    parser.add_argument("--warmup", type=int, default=2, help="Passaggi di riscaldamento non misurati")
+    parser.add_argument("--html-parser", default=None, help="Backend HTML (selectolax, lxml, html.parser, auto)")
+    parser.add_argument("--with-cards", action="store_true", help="Esegue sempre il passaggio sulle card HTML (json_only=False)")
+    parser.add_argument("--full-json", action="store_true", help="Decodifica l'intero __NEXT_DATA__ (partial_json=False)")
+    parser.add_argument("--parse-workers", default="0", help="Processi del pool di parsing per la fase search_page_pipeline (0 = processo corrente)")
+    parser.add_argument("--stage", action="append", help="Misura solo la fase indicata (ripetibile)")
+    parser.add_argument("--output", help="File JSON di output (default: data/benchmarks/benchmark_<timestamp>.json)")
+    parser.add_argument("--compare", help="Report JSON precedente con cui confrontare i risultati")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    report = run_benchmark(
+        pages_dir=args.pages_dir,
+        iterations=args.iterations,
+        warmup=args.warmup,
+        html_parser=args.html_parser,
+        json_only=not args.with_cards,
+        partial_json=not args.full_json,
+        parse_workers=args.parse_workers,
+        stage_filter=args.stage,
+    )
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            report["comparison"] = compare_reports(report, json.load(f))
+
+    output = args.output
+    if not output:
+        os.makedirs(DEFAULT_OUTPUT_DIR, exist_ok=True)
+        output = os.path.join(DEFAULT_OUTPUT_DIR, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print_report(report)
+    print(f"\nReport salvato in {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, Float, DateTime, ForeignKey, Text
+from sqlalchemy import create_engine, inspect, text, Column, Integer, String, Boolean, Float, DateTime, ForeignKey, Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 import datetime
@@ -24,6 +24,7 @@ class Keyword(Base):
     applica_limite_prezzo = Column(Boolean, default=False)
     limite_pagine = Column(Integer, default=1)
     intervallo_minuti = Column(Integer, default=2)
+    regioni = Column(String, nullable=True)  # Regioni separate da virgola, una ricerca per regione (None = tutta Italia)
     attivo = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
@@ -83,9 +84,29 @@ class SeenAds(Base):
     # Relationship con Keyword
     keyword = relationship("Keyword", backref="seen_ads")
 
+# Colonne aggiunte dopo la creazione delle tabelle: create_all non modifica le
+# tabelle esistenti, quindi init_db le aggiunge ai database creati in precedenza
+# (vedi anche migrate_db.py)
+ADDED_COLUMNS = {
+    "keywords": {"regioni": "TEXT"},
+}
+
+def add_missing_columns():
+    """Aggiunge alle tabelle esistenti le colonne di ADDED_COLUMNS che mancano"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table, columns in ADDED_COLUMNS.items():
+            if not inspector.has_table(table):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table)}
+            for name, column_type in columns.items():
+                if name not in existing:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}"))
+
 # Creazione delle tabelle nel database
 def init_db():
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
 
 # Funzione per ottenere una sessione del database
 def get_db():
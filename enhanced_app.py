@@ -30,6 +30,12 @@ logger = logging.getLogger("SnipeDeal")
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from database_schema import init_db, Keyword, Risultato, Statistiche, SessionLocal, SeenAds
 from scraper_adapter import scraper_adapter
+from rate_limiter import DEFAULT_HOST, rate_limiter_metrics
+from fetch_dedup import fetch_dedup_metrics
+from proxy_pool import proxy_pool_metrics
+from fetch_engine import circuit_breaker_metrics
+from page_cache import page_cache_metrics
+from search_query import REGIONS, parse_regions, split_regions
 
 try:
     # Inizializza il database
@@ -250,6 +256,16 @@ if menu == "Dashboard":
             col3.metric("Annunci Totali", num_results)
             col4.metric("Annunci Venduti", num_sold)
             
+            # Ritmo delle richieste verso Subito.it, regolato dal controllo AIMD condiviso
+            subito_limiter = rate_limiter_metrics().get(DEFAULT_HOST)
+            if subito_limiter:
+                congestion = subito_limiter['congestion']
+                rate_col1, rate_col2, rate_col3, rate_col4 = st.columns(4)
+                rate_col1.metric("Tasso Consentito", f"{congestion['rate']:.2f} req/s")
+                rate_col2.metric("Tasso Effettivo", f"{subito_limiter['current_rate']:.2f} req/s")
+                rate_col3.metric("Rallentamenti", congestion['congestion_events'])
+                rate_col4.metric("Pausa Server", f"{congestion['paused_for']:.0f}s")
+            
             # Risultati più recenti
             st.subheader("Ultimi Annunci Trovati")
             latest_results = session.query(Risultato).order_by(Risultato.created_at.desc()).limit(10).all()
@@ -431,6 +447,7 @@ elif menu == "Gestione Campagne":
                 applica_limite_prezzo = st.checkbox("APPLICA LIMITE PREZZO", value=False)
                 limite_pagine = st.number_input("LIMITE PAGINE", min_value=1, max_value=10, value=2, step=1)
                 intervallo_minuti = st.number_input("INTERVALLO MINUTI", min_value=1, max_value=60, value=2, step=1)
+                regioni = st.multiselect("REGIONI (vuoto = tutta Italia)", options=list(REGIONS))
                 
                 # Pulsante di submit
                 submit_button = st.form_submit_button(label="AGGIUNGI KEYWORD")
@@ -446,6 +463,7 @@ elif menu == "Gestione Campagne":
                             applica_limite_prezzo=applica_limite_prezzo,
                             limite_pagine=limite_pagine,
                             intervallo_minuti=intervallo_minuti,
+                            regioni=",".join(regioni) or None,
                             attivo=True
                         )
                         session.add(new_keyword)
@@ -499,6 +517,8 @@ elif menu == "Gestione Campagne":
                         if kw.attivo:
                             if adapter.is_job_running(kw.id):
                                 job_status = "🔄 In esecuzione"
+                            elif adapter.is_run_stalled(kw.id):
+                                job_status = "🛑 Bloccato"
                             else:
                                 job_status = "⚠️ Non in esecuzione"
                         else:
@@ -511,6 +531,7 @@ elif menu == "Gestione Campagne":
                             "Job": job_status,
                             "Limite Prezzo": prezzo_txt,
                             "Max Pages": kw.limite_pagine,
+                            "Regioni": kw.regioni or "Tutta Italia",
                             "Intervallo": kw.intervallo_minuti,
                             "Risultati": count
                         })
@@ -530,6 +551,9 @@ elif menu == "Gestione Campagne":
                         if selected_kw:
                             # Modifica dei parametri della campagna
                             with st.expander("Modifica parametri"):
+                                _, regioni_non_valide = split_regions(selected_kw.regioni)
+                                if regioni_non_valide:
+                                    st.warning(f"Regioni non valide ignorate: {', '.join(regioni_non_valide)}")
                                 # Creo un form per la modifica
                                 with st.form(key=f"edit_campaign_{selected_id}"):
                                     st.subheader(f"Modifica campagna: {selected_kw.keyword}")
@@ -558,6 +582,9 @@ elif menu == "Gestione Campagne":
                                                              max_value=60, 
                                                              value=selected_kw.intervallo_minuti, 
                                                              step=1)
+                                    edit_regioni = st.multiselect("Regioni (vuoto = tutta Italia)", 
+                                                             options=list(REGIONS), 
+                                                             default=parse_regions(selected_kw.regioni))
                                     
                                     # Pulsante di salvataggio
                                     save_button = st.form_submit_button("Salva Modifiche")
@@ -570,6 +597,7 @@ elif menu == "Gestione Campagne":
                                         selected_kw.applica_limite_prezzo = edit_applica_limite
                                         selected_kw.limite_pagine = edit_limite_pagine
                                         selected_kw.intervallo_minuti = edit_intervallo
+                                        selected_kw.regioni = ",".join(edit_regioni) or None
                                         session.commit()
                                         
                                         logger.info(f"Modificata campagna ID {selected_id}: {edit_keyword}")
@@ -802,6 +830,7 @@ elif menu == "Impostazioni":
                             "applica_limite_prezzo": kw.applica_limite_prezzo,
                             "limite_pagine": kw.limite_pagine,
                             "intervallo_minuti": kw.intervallo_minuti,
+                            "regioni": kw.regioni,
                             "attivo": kw.attivo,
                             "created_at": kw.created_at.isoformat() if kw.created_at else None,
                             "updated_at": kw.updated_at.isoformat() if kw.updated_at else None
@@ -1016,6 +1045,70 @@ elif menu == "Log Scraper":
         # Visualizza i log dello scraper
         show_scraper_logs()
         
+        # Utilizzo del rate limiter globale verso Subito.it
+        st.subheader("Rate Limiter")
+        limiter_metrics = rate_limiter_metrics()
+        if limiter_metrics:
+            for host, metrics in limiter_metrics.items():
+                congestion = metrics['congestion']
+                st.write(f"**{host}** ({metrics['backend']}) - tasso {metrics['rate']:.2f} richieste/s "
+                         f"(AIMD {congestion['min_rate']:g}-{congestion['max_rate']:g}), burst {metrics['burst']:g}, "
+                         f"rallentamenti: {congestion['congestion_events']}")
+                col1, col2, col3, col4 = st.columns(4)
+                col1.metric("Richieste/s (ultimo minuto)", f"{metrics['current_rate']:.2f}")
+                col2.metric("Utilizzo", f"{metrics['utilization_pct']:.0f}%")
+                col3.metric("In coda", metrics['queued'])
+                col4.metric("Attesa media", f"{metrics['avg_wait']:.2f}s")
+        else:
+            st.info("Nessuna richiesta effettuata finora in questo processo.")
+        
+        # Circuit breaker per host e uscita: aperto = richieste sospese su quell'uscita per tutte le campagne
+        for host, breaker in circuit_breaker_metrics().items():
+            if breaker['state'] == "chiuso":
+                st.write(f"Circuit breaker **{host}**: chiuso (aperture: {breaker['trips']})")
+            else:
+                st.error(f"Circuit breaker **{host}**: {breaker['state']}, nuove richieste tra {breaker['retry_in']:.0f}s "
+                         f"(ultimo errore: {breaker['last_error']}, aperture: {breaker['trips']})")
+        
+        # Ricerche interrotte dal watchdog perché oltre la durata massima
+        for keyword_id, run_metrics in scraper_adapter.get_run_metrics().items():
+            if run_metrics.get('stalls'):
+                st.warning(f"Campagna {keyword_id}: {run_metrics['stalls']} ricerche bloccate interrotte dal watchdog "
+                           f"(ultima: {run_metrics['last_stall']})")
+        
+        # Pagine condivise tra campagne e Ricerca di Mercato sulla stessa parola chiave
+        dedup_metrics = fetch_dedup_metrics()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Download eseguiti", dedup_metrics.get('misses', 0))
+        col2.metric("Pagine riusate", dedup_metrics.get('hits', 0))
+        col3.metric("Richieste unite", dedup_metrics.get('coalesced', 0))
+        
+        # Polling con la prima pagina invariata: ricerca chiusa senza elaborazione
+        page_metrics = page_cache_metrics()
+        col1, col2 = st.columns(2)
+        col1.metric("Polling invariati", page_metrics.get('unchanged', 0))
+        col2.metric("Risposte 304", page_metrics.get('not_modified', 0))
+        
+        # Stato delle uscite del pool di proxy
+        st.subheader("Pool di Proxy")
+        proxy_metrics = proxy_pool_metrics()
+        if proxy_metrics:
+            proxy_rows = [{
+                "Uscita": proxy['label'],
+                "Stato": f"Quarantena ({proxy['quarantined_for']:.0f}s)" if proxy['quarantined_for'] else "Attiva",
+                "Punteggio": proxy['score'],
+                "Latenza (ms)": proxy['latency_ms'],
+                "Errori %": proxy['error_pct'],
+                "429 %": proxy['throttle_pct'],
+                "Blocchi %": proxy['block_pct'],
+                "Richieste": proxy['requests'],
+                "In corso": proxy['inflight'],
+                "Ultimo problema": proxy['last_reason'] or "-",
+            } for proxy in proxy_metrics]
+            st.dataframe(pd.DataFrame(proxy_rows))
+        else:
+            st.info("Nessun proxy configurato (SNIPEDEAL_PROXIES): le richieste usano la connessione diretta.")
+        
         # Verifica dello stato di importazione dello scraper
         st.subheader("Stato del Core Scraper")
         
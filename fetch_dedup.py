@@ -0,0 +1,248 @@
+"""
+Deduplicazione dei download tra campagne e Ricerca di Mercato.
+
+Più campagne sulla stessa parola chiave (diverse solo per i limiti di prezzo)
+e la Ricerca di Mercato richiedono spesso le stesse pagine a pochi secondi di
+distanza. Le richieste per lo stesso URL normalizzato vengono unite: se un
+download è già in corso gli altri richiedenti ne attendono l'esito, e una
+pagina scaricata da poco (entro il TTL) viene riusata senza nuove richieste.
+
+Il risultato condiviso è una SharedPage, che memorizza anche gli annunci
+estratti per ciascuna modalità di parsing: ogni richiedente riceve una copia
+degli annunci e applica i propri filtri (es. la finestra di prezzo).
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+logger = logging.getLogger("SnipeDeal.FetchDedup")
+
+# Secondi per cui una pagina scaricata viene riusata (0 = solo richieste in corso)
+FETCH_DEDUP_TTL_ENV = "SNIPEDEAL_FETCH_DEDUP_TTL"
+DEFAULT_FETCH_DEDUP_TTL = 30.0
+
+# Numero massimo di pagine recenti conservate
+MAX_SHARED_PAGES = 256
+
+
+def normalize_url(url):
+    """
+    Normalizza un URL per riconoscere le richieste equivalenti: schema e host
+    minuscoli, parametri ordinati, parola chiave senza spazi superflui e in
+    minuscolo, senza frammento
+    """
+    parts = urlsplit(url.strip())
+    params = []
+    for key, value in parse_qsl(parts.query, keep_blank_values=True):
+        if key == "q":
+            value = " ".join(value.split()).lower()
+        params.append((key, value))
+    params.sort()
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", urlencode(params), ""))
+
+
+class SharedPage:
+    """
+    Pagina scaricata e condivisa tra i richiedenti dello stesso URL
+    """
+
+    def __init__(self, url, content, status_code=200, headers=None):
+        self.url = url
+        self.content = content
+        self.status_code = status_code
+        self.headers = dict(headers or {})
+        self.fetched_at = time.time()
+        self._parsed = {}
+        self._lock = threading.Lock()
+
+    def parsed(self, key, parse):
+        """
+        Restituisce il risultato del parsing per la modalità key, calcolandolo
+        con parse(content) una sola volta per tutti i richiedenti
+        """
+        with self._lock:
+            if key not in self._parsed:
+                self._parsed[key] = parse(self.content)
+            return self._parsed[key]
+
+
+def _consume_result(future):
+    # Il risultato di un'attesa abbandonata non viene letto da nessuno
+    if not future.cancelled():
+        future.exception()
+
+
+class FetchCoalescer:
+    """
+    Unisce le richieste in corso e riusa quelle recenti per chiave, thread-safe.
+
+    I download falliti non vengono memorizzati: l'errore viene propagato a tutti
+    i richiedenti in attesa e la richiesta successiva riprova.
+    """
+
+    def __init__(self, ttl=None, max_entries=MAX_SHARED_PAGES):
+        if ttl is None:
+            ttl = float(os.environ.get(FETCH_DEDUP_TTL_ENV, DEFAULT_FETCH_DEDUP_TTL))
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._recent = {}
+        self._stats = {}
+
+    def configure(self, ttl=None):
+        """Aggiorna il TTL; con 0 le pagine recenti vengono scartate"""
+        with self._lock:
+            if ttl is not None:
+                self.ttl = ttl
+                if not ttl:
+                    self._recent.clear()
+
+    def clear(self):
+        """Scarta le pagine recenti (le richieste in corso proseguono)"""
+        with self._lock:
+            self._recent.clear()
+
+    def _count(self, name):
+        self._stats[name] = self._stats.get(name, 0) + 1
+
+    def _claim(self, key):
+        """
+        Returns:
+            tuple: (valore recente o None, future da attendere o None, future da completare o None)
+        """
+        with self._lock:
+            now = time.monotonic()
+            entry = self._recent.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > now:
+                    self._count("hits")
+                    return value, None, None
+                del self._recent[key]
+
+            future = self._inflight.get(key)
+            if future is not None and future.cancelled():
+                # Richiesta abbandonata: la scarica il prossimo richiedente
+                del self._inflight[key]
+                future = None
+            if future is not None:
+                self._count("coalesced")
+                return None, future, None
+
+            self._count("misses")
+            future = Future()
+            self._inflight[key] = future
+            return None, None, future
+
+    def _resolve(self, key, future, value=None, error=None, cancelled=False):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+            if error is None and not cancelled and self.ttl > 0:
+                now = time.monotonic()
+                if len(self._recent) >= self.max_entries:
+                    for stale in [k for k, (expires, _) in self._recent.items() if expires <= now]:
+                        del self._recent[stale]
+                    while len(self._recent) >= self.max_entries:
+                        del self._recent[next(iter(self._recent))]
+                self._recent[key] = (now + self.ttl, value)
+        if future.cancelled():
+            # Nessun richiedente in attesa di questo future
+            return
+        if cancelled:
+            future.cancel()
+        elif error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(value)
+
+    def get(self, key, loader):
+        """
+        Restituisce il valore per key, eseguendo loader() solo se nessuna richiesta
+        equivalente è in corso o recente
+
+        Returns:
+            tuple: (valore, shared) con shared True se il valore non è stato caricato da questa chiamata
+        """
+        while True:
+            value, waiting, owned = self._claim(key)
+            if owned is None and waiting is None:
+                return value, True
+            if waiting is not None:
+                try:
+                    return waiting.result(), True
+                except CancelledError:
+                    # Il richiedente che scaricava la pagina ha rinunciato: si riprova
+                    continue
+
+            try:
+                value = loader()
+            except BaseException as e:
+                self._resolve(key, owned, error=e)
+                raise
+            self._resolve(key, owned, value)
+            return value, False
+
+    async def get_async(self, key, loader):
+        """
+        Versione asincrona di get: loader è una funzione senza argomenti che
+        restituisce una coroutine. Funziona anche tra loop di thread diversi.
+        """
+        while True:
+            value, waiting, owned = self._claim(key)
+            if owned is None and waiting is None:
+                return value, True
+            if waiting is not None:
+                # shield: la cancellazione di questo task non deve cancellare il future
+                # condiviso, atteso anche dagli altri richiedenti
+                shared = asyncio.wrap_future(waiting)
+                shared.add_done_callback(_consume_result)
+                try:
+                    return await asyncio.shield(shared), True
+                except asyncio.CancelledError:
+                    # Si riprova solo se ha rinunciato chi scaricava, non questo task
+                    if waiting.cancelled() and not asyncio.current_task().cancelling():
+                        continue
+                    raise
+
+            try:
+                value = await loader()
+            except asyncio.CancelledError:
+                self._resolve(key, owned, cancelled=True)
+                raise
+            except BaseException as e:
+                self._resolve(key, owned, error=e)
+                raise
+            self._resolve(key, owned, value)
+            return value, False
+
+    def metrics(self):
+        """Conteggi di richieste riusate (hits), unite a una in corso (coalesced) ed eseguite (misses)"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["recent"] = len(self._recent)
+            stats["inflight"] = len(self._inflight)
+        return stats
+
+
+_coalescer = FetchCoalescer()
+
+
+def get_fetch_coalescer():
+    """Restituisce il deduplicatore condiviso dal processo"""
+    return _coalescer
+
+
+def configure_fetch_dedup(ttl=None):
+    """Configura il TTL delle pagine condivise tra campagne"""
+    _coalescer.configure(ttl)
+
+
+def fetch_dedup_metrics():
+    """Metriche del deduplicatore condiviso"""
+    return _coalescer.metrics()
@@ -0,0 +1,519 @@
+"""
+Motore di download asincrono per SubitoScraper.
+
+Le pagine di una ricerca e le keyword di un'esecuzione vengono scaricate in
+modo concorrente con asyncio. Le richieste HTTP restano quelle della sessione
+requests dello scraper (adapter, retry, proxy, header), eseguite in thread
+tramite asyncio.to_thread.
+
+La cortesia verso il sito non è più affidata a sleep bloccanti prima di ogni
+richiesta: uno scheduler per host, condiviso da tutti i thread del processo
+(campagne, app Streamlit), limita le richieste contemporanee e attende senza
+bloccare il loop il token del rate limiter globale dell'host.
+
+Ogni richiesta ha un timeout di connessione, uno di lettura (tra due blocchi
+ricevuti) e una scadenza complessiva: il corpo viene sempre letto a blocchi,
+così una connessione che trasmette a singhiozzo non blocca il thread oltre la
+scadenza. Le richieste in corso di un motore si possono annullare da un altro
+thread con AsyncFetchEngine.cancel (vedi il watchdog dello ScraperAdapter).
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from urllib3.exceptions import DecodeError, ProtocolError, ReadTimeoutError
+
+from page_parser import next_data_end
+from rate_limiter import get_rate_limiter, limiter_key, observe_failure, observe_response, parse_retry_after
+
+logger = logging.getLogger("SnipeDeal.FetchEngine")
+
+# Richieste contemporanee massime verso lo stesso host
+DEFAULT_MAX_CONCURRENCY = 3
+
+# Dimensione dei blocchi letti in streaming (dopo la decompressione)
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Backoff tra i tentativi di una richiesta fallita (secondi): esponenziale con jitter
+RETRY_BACKOFF_BASE = 1.0
+RETRY_BACKOFF_MAX = 30.0
+
+# Circuit breaker per host e uscita del pool di proxy (come i rate limiter, vedi
+# rate_limiter.limiter_key): errori consecutivi (5xx o di rete, da tutte le campagne)
+# che lo aprono, e pausa iniziale (raddoppia a ogni riapertura fino al massimo)
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+BREAKER_MAX_COOLDOWN = 600.0
+
+# Byte che si continuano a leggere dopo lo stato della pagina: se la risposta finisce
+# entro questo limite la connessione torna nel pool, altrimenti viene chiusa
+STREAM_DRAIN_LIMIT = 64 * 1024
+
+# Timeout di ogni richiesta (secondi): connessione, lettura tra due blocchi e
+# scadenza complessiva dall'invio alla fine del corpo
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 20.0
+DEFAULT_TOTAL_TIMEOUT = 45.0
+
+_timeouts = {
+    'connect': float(os.environ.get("SNIPEDEAL_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)),
+    'read': float(os.environ.get("SNIPEDEAL_READ_TIMEOUT", DEFAULT_READ_TIMEOUT)),
+    'total': float(os.environ.get("SNIPEDEAL_TOTAL_TIMEOUT", DEFAULT_TOTAL_TIMEOUT)),
+}
+
+
+def configure_fetch_timeouts(connect=None, read=None, total=None):
+    """Configura i timeout di default delle richieste (anche dei motori già creati)"""
+    if connect is not None:
+        _timeouts['connect'] = connect
+    if read is not None:
+        _timeouts['read'] = read
+    if total is not None:
+        _timeouts['total'] = total
+
+
+def fetch_timeouts():
+    """Timeout di default correnti: {'connect', 'read', 'total'}"""
+    return dict(_timeouts)
+
+
+class FetchDeadlineError(requests.exceptions.Timeout):
+    """La richiesta ha superato la scadenza complessiva"""
+
+    def __init__(self, url, elapsed):
+        super().__init__(f"Scadenza superata dopo {elapsed:.1f}s: {url}")
+        self.url = url
+        self.elapsed = elapsed
+
+
+class FetchCancelledError(Exception):
+    """La richiesta è stata annullata (AsyncFetchEngine.cancel)"""
+
+    def __init__(self, url, reason=None):
+        super().__init__(f"Richiesta annullata{f' ({reason})' if reason else ''}: {url}")
+        self.url = url
+        self.reason = reason
+
+
+def iter_body(response, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Blocchi decompressi del corpo di una risposta aperta con stream=True, restituiti
+    appena arrivano (read1) invece che a blocchi pieni: così la scadenza viene
+    controllata anche su una connessione che trasmette pochi byte alla volta.
+    Con urllib3 senza read1 si usa iter_content. Gli errori sono tradotti come
+    in iter_content.
+    """
+    read1 = getattr(response.raw, 'read1', None)
+    if read1 is None:
+        yield from response.iter_content(chunk_size)
+        return
+    try:
+        while True:
+            chunk = read1(chunk_size, decode_content=True)
+            if not chunk:
+                break
+            yield chunk
+    except ProtocolError as e:
+        raise requests.exceptions.ChunkedEncodingError(e)
+    except DecodeError as e:
+        raise requests.exceptions.ContentDecodingError(e)
+    except ReadTimeoutError as e:
+        raise requests.exceptions.ConnectionError(e)
+
+
+def read_body(response, until_next_data=False, deadline=None, cancelled=None,
+              chunk_size=STREAM_CHUNK_SIZE, drain_limit=STREAM_DRAIN_LIMIT):
+    """
+    Legge a blocchi il corpo di una risposta aperta con stream=True e lo imposta
+    come contenuto della risposta. La decompressione gzip/br avviene blocco per
+    blocco (vedi iter_body).
+
+    Args:
+        until_next_data: Si ferma dopo lo script __NEXT_DATA__
+        deadline: Istante (time.monotonic) oltre il quale la lettura viene interrotta
+        cancelled: threading.Event che, se impostato, interrompe la lettura
+
+    Returns:
+        bool: True se il download è stato interrotto prima della fine
+
+    Raises:
+        FetchDeadlineError: Se la scadenza viene superata
+        FetchCancelledError: Se cancelled viene impostato durante la lettura
+    """
+    def check():
+        if cancelled is not None and cancelled.is_set():
+            raise FetchCancelledError(response.url)
+        if deadline is not None and time.monotonic() > deadline:
+            # Durata dall'invio: attesa degli header più lettura del corpo
+            raise FetchDeadlineError(response.url, response.elapsed.total_seconds() + time.monotonic() - started)
+
+    started = time.monotonic()
+    body = bytearray()
+    chunks = iter_body(response, chunk_size)
+    truncated = False
+    check()
+    for chunk in chunks:
+        body += chunk
+        check()
+        if until_next_data and next_data_end(body) != -1:
+            # Il resto della pagina (footer, script finali) non serve
+            drained = 0
+            for chunk in chunks:
+                body += chunk
+                check()
+                drained += len(chunk)
+                if drained >= drain_limit:
+                    truncated = True
+                    response.close()
+                    break
+            break
+
+    response._content = bytes(body)
+    response._content_consumed = True
+    return truncated
+
+
+def backoff_delay(attempt, base=RETRY_BACKOFF_BASE, cap=RETRY_BACKOFF_MAX):
+    """
+    Attesa prima del nuovo tentativo numero attempt (1 = primo nuovo tentativo):
+    esponenziale con jitter, così le campagne fallite insieme non riprovano insieme
+    """
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class CircuitOpenError(Exception):
+    """Il circuit breaker dell'host è aperto: la richiesta non viene inviata"""
+
+    def __init__(self, host, retry_in):
+        super().__init__(f"Circuit breaker aperto per {host}: nuove richieste tra {retry_in:.0f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker di un host raggiunto da un'uscita (host = limiter key, es.
+    "www.subito.it via proxy-1"), condiviso da tutte le campagne, thread-safe.
+    Gli errori di un proxy guasto non sospendono le altre uscite.
+
+    Dopo BREAKER_THRESHOLD errori consecutivi (5xx o errori di rete) il circuito
+    si apre e le richieste falliscono subito con CircuitOpenError. Trascorsa la
+    pausa passa una sola richiesta di prova: se va a buon fine il circuito si
+    chiude, altrimenti si riapre con una pausa doppia.
+    """
+
+    CLOSED = "chiuso"
+    OPEN = "aperto"
+    HALF_OPEN = "semiaperto"
+
+    def __init__(self, host, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN, max_cooldown=BREAKER_MAX_COOLDOWN):
+        self.host = host
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.cooldown = cooldown
+        self.opened_at = 0.0
+        self.trips = 0
+        self.last_error = None
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def _retry_in(self, now):
+        return max(0.0, self.opened_at + self.cooldown - now)
+
+    def check(self):
+        """Solleva CircuitOpenError se il circuito è aperto e la pausa non è trascorsa"""
+        with self._lock:
+            if self.state == self.OPEN:
+                retry_in = self._retry_in(time.monotonic())
+                if retry_in > 0:
+                    raise CircuitOpenError(self.host, retry_in)
+
+    def before_request(self):
+        """
+        Autorizza l'invio di una richiesta: a pausa trascorsa lascia passare una
+        sola richiesta di prova (una nuova se la precedente non ha dato esito)
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                retry_in = self._retry_in(now)
+                if retry_in > 0:
+                    raise CircuitOpenError(self.host, retry_in)
+                self.state = self.HALF_OPEN
+            elif self._probe_started is not None and now - self._probe_started < self.cooldown:
+                raise CircuitOpenError(self.host, self.cooldown - (now - self._probe_started))
+            self._probe_started = now
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit breaker chiuso per {self.host}")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+            self._probe_started = None
+
+    def record_failure(self, reason):
+        with self._lock:
+            self.failures += 1
+            self.last_error = reason
+            if self.state == self.HALF_OPEN:
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+            elif self.state == self.OPEN or self.failures < self.threshold:
+                return
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.trips += 1
+            self._probe_started = None
+            cooldown = self.cooldown
+        logger.error(f"Circuit breaker aperto per {self.host} dopo {self.failures} errori consecutivi ({reason}): "
+                     f"richieste sospese per {cooldown:.0f}s")
+
+    def metrics(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'trips': self.trips,
+                'retry_in': round(self._retry_in(now), 1) if self.state == self.OPEN else 0.0,
+                'last_error': self.last_error,
+            }
+
+
+class HostScheduler:
+    """
+    Scheduler di cortesia per host, thread-safe.
+
+    Il ritmo delle richieste verso un host è dato dal suo token bucket globale
+    (vedi rate_limiter); un semaforo per host limita le richieste in corso.
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    def configure(self, max_concurrency=None):
+        """Aggiorna il limite di concorrenza; i semafori già in uso mantengono il limite precedente"""
+        with self._lock:
+            if max_concurrency is not None:
+                self.max_concurrency = max_concurrency
+                self._slots.clear()
+
+    def reserve(self, key):
+        """
+        Prenota l'avvio di una richiesta verso un host (key, vedi rate_limiter.limiter_key)
+
+        Returns:
+            float: Secondi da attendere prima di avviare la richiesta
+        """
+        return get_rate_limiter(key).reserve()
+
+    def slot(self, key):
+        """Semaforo che limita le richieste contemporanee verso un host (per uscita)"""
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.max_concurrency)
+                self._slots[key] = slot
+            return slot
+
+
+class ThrottledError(Exception):
+    """Il server ha chiesto di rallentare (429, 503 o pagina di blocco)"""
+
+    def __init__(self, url, reason, retry_after=None):
+        super().__init__(f"Richiesta rallentata da {urlsplit(url).netloc} ({reason}): {url}")
+        self.url = url
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+_host_scheduler = HostScheduler()
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_host_scheduler():
+    """Restituisce lo scheduler per host condiviso dal processo"""
+    return _host_scheduler
+
+
+def configure_host_scheduler(max_concurrency=None):
+    """Configura il numero massimo di richieste contemporanee per host"""
+    _host_scheduler.configure(max_concurrency)
+
+
+def get_circuit_breaker(key):
+    """
+    Restituisce il circuit breaker condiviso per un host e un'uscita
+    (key, vedi rate_limiter.limiter_key; il solo host per le richieste dirette)
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(key)
+            _breakers[key] = breaker
+        return breaker
+
+
+def circuit_breaker_metrics():
+    """Stato dei circuit breaker di tutti gli host contattati, per uscita"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.host: breaker.metrics() for breaker in breakers}
+
+
+class AsyncFetchEngine:
+    """
+    Esegue le GET di una sessione requests da coroutine asyncio, rispettando
+    lo scheduler per host e, se indicato, instradandole sul pool di proxy
+    """
+
+    def __init__(self, session, scheduler=None, proxy_pool=None, affinity=None, total_timeout=None):
+        """
+        Args:
+            proxy_pool: Pool di proxy da cui scegliere l'uscita di ogni richiesta
+                        (None o pool vuoto = uscita della sessione)
+            affinity: Identificativo della campagna, per preferire sempre la stessa uscita
+            total_timeout: Scadenza complessiva di ogni richiesta in secondi
+                           (None = default configurato, vedi configure_fetch_timeouts)
+        """
+        self.session = session
+        self.scheduler = scheduler or get_host_scheduler()
+        self.proxy_pool = proxy_pool
+        self.affinity = affinity
+        self.total_timeout = total_timeout
+        self.cancel_reason = None
+        self._cancelled = threading.Event()
+
+    def cancel(self, reason=None):
+        """
+        Annulla le richieste in corso e quelle future del motore (thread-safe):
+        le letture in corso si interrompono al blocco successivo
+        """
+        self.cancel_reason = reason
+        self._cancelled.set()
+
+    def reset(self):
+        """Riabilita il motore dopo cancel"""
+        self._cancelled.clear()
+        self.cancel_reason = None
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    async def fetch(self, url, stream_next_data=False, **kwargs):
+        """
+        Scarica url quando lo scheduler lo consente, senza bloccare il loop.
+        L'esito alimenta il controllo AIMD dell'host, condiviso con le altre campagne.
+        Senza timeout esplicito si usano i timeout di connessione e lettura configurati.
+        
+        Args:
+            stream_next_data: Scarica in streaming una pagina 200 fermandosi dopo lo
+                              script __NEXT_DATA__ (vedi read_body)
+
+        Returns:
+            requests.Response: La risposta (status diversi da 429/503 non verificati)
+
+        Raises:
+            ThrottledError: Se il server chiede di rallentare
+            CircuitOpenError: Se il circuit breaker dell'host per l'uscita scelta è aperto
+            FetchDeadlineError: Se la richiesta supera la scadenza complessiva
+            FetchCancelledError: Se il motore è stato annullato
+        """
+        if self._cancelled.is_set():
+            raise FetchCancelledError(url, self.cancel_reason)
+        host = urlsplit(url).netloc
+        kwargs.setdefault('timeout', (_timeouts['connect'], _timeouts['read']))
+        proxy_exit = self.proxy_pool.choose(self.affinity) if self.proxy_pool else None
+        key = limiter_key(host, proxy_exit.label if proxy_exit else None)
+        # Errori di rete e 5xx contano solo per l'uscita usata: un proxy guasto non
+        # sospende le altre uscite né le richieste dirette
+        breaker = get_circuit_breaker(key)
+        if proxy_exit is not None and proxy_exit.proxies:
+            kwargs['proxies'] = proxy_exit.proxies
+        try:
+            breaker.check()
+            delay = self.scheduler.reserve(key)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            breaker.before_request()
+            started = time.monotonic()
+            try:
+                response = await asyncio.to_thread(self._get, key, url, stream_next_data, kwargs)
+            except asyncio.CancelledError:
+                raise
+            except FetchCancelledError:
+                raise FetchCancelledError(url, self.cancel_reason) from None
+            except Exception as e:
+                breaker.record_failure(type(e).__name__)
+                observe_failure(url, e, key)
+                if proxy_exit is not None:
+                    self.proxy_pool.report(proxy_exit, error=True)
+                raise
+
+            if response.status_code >= 500:
+                breaker.record_failure(f"HTTP {response.status_code}")
+            else:
+                breaker.record_success()
+            reason = observe_response(url, response, key)
+            if proxy_exit is not None:
+                self.proxy_pool.report(proxy_exit, time.monotonic() - started, reason)
+            if reason:
+                raise ThrottledError(url, reason, parse_retry_after(response.headers.get("Retry-After")))
+            return response
+        finally:
+            if proxy_exit is not None:
+                self.proxy_pool.release(proxy_exit)
+
+    def _get(self, key, url, stream_next_data, kwargs):
+        with self.scheduler.slot(key):
+            total_timeout = self.total_timeout if self.total_timeout is not None else _timeouts['total']
+            deadline = time.monotonic() + total_timeout
+            # Il corpo viene sempre letto a blocchi per poter rispettare scadenza e annullamento
+            response = self.session.get(url, stream=True, **kwargs)
+            try:
+                # Pagine di errore o di blocco: serve il corpo intero
+                until_next_data = stream_next_data and response.status_code == 200
+                if read_body(response, until_next_data, deadline, self._cancelled):
+                    logger.debug(f"Download interrotto dopo __NEXT_DATA__ ({len(response.content)} byte): {url}")
+            except BaseException:
+                # La connessione non è riusabile a corpo letto solo in parte
+                response.close()
+                raise
+            return response
+
+
+def run_coroutine(coro):
+    """
+    Esegue una coroutine fino al completamento da codice sincrono.
+
+    Se il thread corrente ha già un loop asyncio in esecuzione, la coroutine
+    viene eseguita in un thread dedicato con un proprio loop.
+    """
+    try:
+        asyncio.get_running_loop()
+        loop_running = True
+    except RuntimeError:
+        loop_running = False
+
+    if not loop_running:
+        return asyncio.run(coro)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
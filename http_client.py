@@ -0,0 +1,93 @@
+"""
+Registro delle sessioni HTTP condivise dal processo.
+
+Ogni ricerca creava una nuova requests.Session (e quindi un nuovo pool di
+connessioni): ogni polling pagava di nuovo DNS, TCP e TLS. Le sessioni del
+registro vengono create una volta per proxy e riusate da tutti i percorsi di
+download (campagne, Ricerca di Mercato, simulazione), con connessioni
+keep-alive, pool dimensionato sulla concorrenza per host e cookie condivisi.
+
+requests non supporta HTTP/2: il multiplexing richiederebbe un client diverso
+(es. httpx con h2). Con keep-alive e un pool adeguato le richieste successive
+alla prima riusano comunque le connessioni aperte.
+"""
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger("SnipeDeal.HttpClient")
+
+# Connessioni mantenute aperte per host: almeno pari alle richieste contemporanee
+# consentite dallo scheduler per host (fetch_engine)
+DEFAULT_POOL_MAXSIZE = 10
+
+# Host distinti con un pool di connessioni (subito.it, immagini, ecc.)
+DEFAULT_POOL_CONNECTIONS = 4
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "Accept-Language": "it-IT,it;q=0.9,en-US;q=0.8,en;q=0.7",
+}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _create_session(proxy=None, pool_maxsize=DEFAULT_POOL_MAXSIZE):
+    session = requests.Session()
+    # Qui si ritenta solo la connessione (nessuna richiesta inviata): gli errori del
+    # server vengono ritentati pagina per pagina dallo scraper, con backoff e circuit
+    # breaker per host (fetch_engine); 429 e 503 li gestisce il controllo AIMD
+    retry_strategy = Retry(
+        connect=2,
+        read=0,
+        status=0,
+        backoff_factor=0.5,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize=pool_maxsize,
+        max_retries=retry_strategy,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(DEFAULT_HEADERS)
+
+    if proxy:
+        session.proxies = {
+            "http": proxy,
+            "https": proxy,
+        }
+    return session
+
+
+def get_http_session(proxy=None):
+    """
+    Restituisce la sessione condivisa per il proxy indicato (None = connessione diretta),
+    creandola al primo utilizzo.
+
+    La sessione è condivisa tra thread: i chiamanti non devono modificarne header,
+    adapter o proxy, ma passare eventuali header specifici alla singola richiesta.
+    """
+    proxy = proxy or None
+    with _sessions_lock:
+        session = _sessions.get(proxy)
+        if session is None:
+            session = _create_session(proxy)
+            _sessions[proxy] = session
+            logger.info(f"Sessione HTTP condivisa creata{' (proxy)' if proxy else ''}")
+        return session
+
+
+def close_http_sessions():
+    """Chiude tutte le sessioni condivise e le relative connessioni"""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
@@ -0,0 +1,211 @@
+"""
+Trasporti per le pagine dei risultati di Subito.it.
+
+Il trasporto HTML scarica la pagina completa ed estrae lo stato dallo script
+__NEXT_DATA__. Il trasporto JSON usa la route dati di Next.js
+(/_next/data/<buildId>/<percorso>.json?<parametri>), che restituisce lo stesso
+stato senza HTML: meno byte e nessun parsing HTML.
+
+Il buildId cambia a ogni rilascio del sito e si ricava dalle pagine HTML: finché
+non è noto, o per un periodo dopo un errore della route dati, si usa il
+trasporto HTML. Anche una pagina il cui JSON non contiene tutti i campi delle
+card passa al trasporto HTML, così i due trasporti producono gli stessi annunci.
+
+La modalità si sceglie con SNIPEDEAL_TRANSPORT: "auto" (default, JSON con
+ripiego su HTML) oppure "html".
+"""
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+from page_parser import extract_build_id, extract_listing_state_json, probe_missing_fields
+
+logger = logging.getLogger("SnipeDeal.Transport")
+
+TRANSPORT_ENV = "SNIPEDEAL_TRANSPORT"
+TRANSPORT_MODES = ("auto", "html")
+
+# Secondi per cui la route dati di un host non viene usata dopo un errore
+JSON_RETRY_AFTER = 600.0
+
+JSON_HEADERS = {
+    "Accept": "application/json",
+    "x-nextjs-data": "1",
+}
+
+
+class TransportError(Exception):
+    """Il trasporto non può fornire la pagina: si passa al trasporto successivo"""
+
+
+def next_data_url(page_url, build_id):
+    """
+    URL della route dati di Next.js per una pagina, es.
+    /annunci-italia/vendita/usato/?q=ps5 -> /_next/data/<buildId>/annunci-italia/vendita/usato.json?q=ps5
+    """
+    parts = urlsplit(page_url)
+    path = parts.path.rstrip("/") or "/index"
+    return urlunsplit((parts.scheme, parts.netloc, f"/_next/data/{build_id}{path}.json", parts.query, ""))
+
+
+class _JsonRouteState:
+    """buildId noti e pause della route dati per host, thread-safe"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.build_ids = {}
+        self.disabled_until = {}
+        self._stats = {}
+
+    def count(self, name):
+        with self._lock:
+            self._stats[name] = self._stats.get(name, 0) + 1
+
+    def learn(self, host, build_id):
+        with self._lock:
+            if build_id and self.build_ids.get(host) != build_id:
+                self.build_ids[host] = build_id
+                logger.info(f"buildId di {host}: {build_id}")
+
+    def build_id(self, host):
+        with self._lock:
+            if self.disabled_until.get(host, 0.0) > time.monotonic():
+                return None
+            return self.build_ids.get(host)
+
+    def disable(self, host, reason):
+        with self._lock:
+            self.build_ids.pop(host, None)
+            self.disabled_until[host] = time.monotonic() + JSON_RETRY_AFTER
+            self._stats["fallbacks"] = self._stats.get("fallbacks", 0) + 1
+        logger.warning(f"Route dati di {host} non disponibile ({reason}): trasporto HTML per {JSON_RETRY_AFTER:.0f}s")
+
+    def metrics(self):
+        with self._lock:
+            now = time.monotonic()
+            stats = dict(self._stats)
+            stats["build_ids"] = dict(self.build_ids)
+            stats["disabled"] = {host: round(until - now) for host, until in self.disabled_until.items() if until > now}
+        return stats
+
+
+_json_route = _JsonRouteState()
+
+
+class HtmlTransport:
+    """Pagina HTML completa, scaricata in streaming fino allo script __NEXT_DATA__"""
+
+    name = "html"
+
+    def page_url(self, url):
+        return url
+
+    async def fetch(self, fetch_engine, url, headers=None, stream=True):
+        """
+        Scarica la pagina e ne ricava il buildId per il trasporto JSON
+
+        Returns:
+            requests.Response: La risposta (status non verificato)
+        """
+        response = await fetch_engine.fetch(url, stream_next_data=stream, headers=headers or {})
+        if response.status_code == 200:
+            _json_route.learn(urlsplit(url).netloc, extract_build_id(response.content))
+        _json_route.count("html_pages")
+        return response
+
+
+class JsonTransport:
+    """Route dati di Next.js: lo stato della pagina in JSON, senza HTML"""
+
+    name = "json"
+
+    def page_url(self, url):
+        """
+        Raises:
+            TransportError: Se il buildId dell'host non è noto o la route dati è in pausa
+        """
+        build_id = _json_route.build_id(urlsplit(url).netloc)
+        if not build_id:
+            raise TransportError(f"buildId non disponibile per {urlsplit(url).netloc}")
+        return next_data_url(url, build_id)
+
+    async def fetch(self, fetch_engine, url, headers=None, stream=True):
+        """
+        Scarica lo stato della pagina url dalla route dati
+
+        Returns:
+            requests.Response: La risposta (status >= 500 non verificati)
+
+        Raises:
+            TransportError: Se la route dati non risponde con JSON (es. buildId scaduto: 404)
+        """
+        data_url = self.page_url(url)
+        response = await fetch_engine.fetch(data_url, headers={**JSON_HEADERS, **(headers or {})})
+        if response.status_code == 304 or (response.status_code == 200 and "json" in response.headers.get("Content-Type", "")):
+            _json_route.count("json_pages")
+            return response
+        if response.status_code >= 500:
+            # Errore del server, non della route: lo gestiscono retry e circuit breaker
+            return response
+        raise TransportError(f"route dati: HTTP {response.status_code} ({response.headers.get('Content-Type', 'senza Content-Type')})")
+
+    def parse_state(self, content, partial=True):
+        """
+        Stato della pagina dalla risposta della route dati
+
+        Raises:
+            TransportError: Se lo stato manca o non contiene tutti i campi delle card
+        """
+        state = extract_listing_state_json(content, partial=partial)
+        if state is None:
+            raise TransportError("stato della pagina non trovato nella route dati")
+        missing = probe_missing_fields(state)
+        if missing:
+            raise TransportError(f"campi non presenti nel JSON: {', '.join(sorted(missing))}")
+        return state
+
+
+HTML_TRANSPORT = HtmlTransport()
+JSON_TRANSPORT = JsonTransport()
+
+
+def resolve_transport_mode(mode=None):
+    """Modalità di trasporto effettiva (argomento, poi SNIPEDEAL_TRANSPORT, poi auto)"""
+    mode = (mode or os.environ.get(TRANSPORT_ENV) or "auto").strip().lower()
+    if mode not in TRANSPORT_MODES:
+        logger.warning(f"Modalità di trasporto non valida: {mode!r}, uso di 'auto'")
+        return "auto"
+    return mode
+
+
+def listing_transports(url, mode=None, json_only=True):
+    """
+    Trasporti da provare in ordine per la pagina url: il JSON solo se la route
+    dati dell'host è disponibile, l'HTML sempre per ultimo
+
+    Args:
+        json_only: False se i campi delle card servono sempre (solo HTML)
+    """
+    mode = resolve_transport_mode(mode)
+    transports = []
+    if mode != "html" and json_only and _json_route.build_id(urlsplit(url).netloc):
+        transports.append(JSON_TRANSPORT)
+    transports.append(HTML_TRANSPORT)
+    return transports
+
+
+def report_transport_failure(url, error):
+    """Registra un errore del trasporto JSON: la route dati dell'host va in pausa"""
+    _json_route.disable(urlsplit(url).netloc, error)
+
+
+def remember_build_id(url, build_id):
+    """Registra il buildId dell'host di url (es. ricavato da una pagina già scaricata)"""
+    _json_route.learn(urlsplit(url).netloc, build_id)
+
+
+def transport_metrics():
+    """Pagine per trasporto (json_pages, html_pages), ripieghi, buildId noti e route in pausa"""
+    return _json_route.metrics()
@@ -1,15 +1,20 @@
 import streamlit as st
 import pandas as pd
 import matplotlib.pyplot as plt
-import requests
-from bs4 import BeautifulSoup
 import time
 import random
 import datetime
-import json
 import traceback
 from typing import List, Dict, Tuple
 
+from fetch_engine import AsyncFetchEngine, run_coroutine
+from fetch_dedup import SharedPage, get_fetch_coalescer, normalize_url
+from search_query import SearchQuery
+from http_client import get_http_session
+from proxy_pool import get_proxy_pool
+from page_parser import extract_next_data, get_initial_state, is_ad_sold, listing_page_info, match_cards, parse_page
+from listing_transport import HTML_TRANSPORT, JSON_TRANSPORT, TransportError, listing_transports, report_transport_failure
+
 def run_market_research_page():
     """
     Funzione principale che gestisce la pagina Market Research
@@ -72,78 +77,27 @@ def perform_market_search(keyword: str, max_pages: int = 2, min_price: float = N
     Returns:
         Dict: Risultati della ricerca con statistiche
     """
-    # Parametri di ricerca
-    base_url = "https://www.subito.it/annunci-italia/vendita/usato/?q="
-    
-    # Aggiungi il parametro di ricerca specifica se richiesto
-    if ricerca_specifica:
-        base_url += f"{keyword}&qso=true"
-    else:
-        base_url += keyword
+    # Parametri di ricerca: fascia di prezzo e ricerca specifica vengono applicate dal sito.
+    # Nessun parametro di ordinamento: il campione di mercato resta quello dell'ordinamento
+    # predefinito del sito (rilevanza), non solo gli annunci più recenti
+    query = SearchQuery(keyword, min_price=min_price, max_price=max_price, title_only=ricerca_specifica, order=None)
     
     # Lista per salvare tutti i risultati
     all_results = []
     
-    # Configurazione della sessione HTTP
-    session = requests.Session()
-    session.headers.update({
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-        "Accept-Language": "it-IT,it;q=0.9,en-US;q=0.8,en;q=0.7",
-        "Connection": "keep-alive"
-    })
+    # Sessione HTTP condivisa con le campagne: connessioni già aperte vengono riusate
+    fetch_engine = AsyncFetchEngine(get_http_session(), proxy_pool=get_proxy_pool(), affinity=f"market:{keyword}")
     
     try:
         # Esegui la ricerca per ogni pagina
         for page in range(1, max_pages + 1):
-            # Costruisci l'URL della pagina con il parametro o incluso nella query di base
-            if ricerca_specifica:
-                page_url = f"{base_url}&o={page}"
-            else:
-                page_url = f"{base_url}&o={page}"
+            page_url = query.url(page)
             
             st.info(f"Analisi pagina {page}/{max_pages}: {page_url}")
             
-            # Aggiungi un ritardo random per evitare il blocco
-            time.sleep(random.uniform(1, 2))
-            
-            response = session.get(page_url)
-            response.raise_for_status()
-            
-            # Estrai i dati JSON dall'HTML
-            json_data = _extract_json_from_html(response.text)
-            
-            # Estrai i risultati dal JSON
-            page_results = _get_results_from_json(json_data)
-            
-            # Aggiungi dati da HTML per venduto
-            soup = BeautifulSoup(response.text, 'html.parser')
-            cards = soup.select('div.items__item')
-            
-            for card in cards:
-                # Estrai URL per match con risultato
-                link_el = card.select_one('a')
-                url = link_el['href'] if link_el and 'href' in link_el.attrs else None
-                
-                # Estrai stato venduto (badge o testo)
-                venduto = False
-                badge_venduto = card.find(string=lambda t: t and 'venduto' in t.lower())
-                if badge_venduto:
-                    venduto = True
-                
-                # Trova il risultato corrispondente per URL e aggiorna
-                for res in page_results:
-                    if url and res.get('url') and url in res['url']:
-                        res['venduto'] = venduto
-                        # Aggiorna anche il prezzo se visibile
-                        price_el = card.select_one('p.index-module_price__N7M2x')
-                        if price_el:
-                            try:
-                                price_text = price_el.text.strip()
-                                prezzo_html = float(''.join(c for c in price_text if c.isdigit() or c == ',').replace(',', '.'))
-                                res['prezzo'] = prezzo_html
-                            except Exception:
-                                pass
+            page_results, page_info = _load_results_page(fetch_engine, page_url, page)
+            # Copia dei risultati: la pagina può essere condivisa con altre ricerche
+            page_results = [dict(result) for result in page_results]
             
             if not page_results:
                 st.warning(f"Nessun risultato trovato nella pagina {page}")
@@ -154,8 +108,13 @@ def perform_market_search(keyword: str, max_pages: int = 2, min_price: float = N
             
             all_results.extend(page_results)
             
-            # Se ci sono meno risultati del previsto, probabilmente è l'ultima pagina
-            if len(page_results) < 20:
+            # Ultima pagina secondo la paginazione della ricerca; senza metadati si
+            # ricade sul numero di annunci della pagina (prima di qualsiasi filtro)
+            total_pages = page_info.get('total_pages')
+            if total_pages is not None:
+                if page >= total_pages:
+                    break
+            elif page_info.get('ads', 0) < 20:
                 break
         
         # Applica filtri di prezzo se specificati
@@ -180,27 +139,79 @@ def perform_market_search(keyword: str, max_pages: int = 2, min_price: float = N
         st.error(traceback.format_exc())
         return _simulate_market_results(keyword, min_price, max_price)
 
+def _load_results_page(fetch_engine, page_url, page):
+    """
+    Scarica ed elabora una pagina dei risultati, dalla route dati JSON se disponibile
+    e altrimenti in HTML (vedi listing_transport)
+
+    Returns:
+        tuple: (risultati, metadati di paginazione come in listing_page_info)
+    """
+    for transport in listing_transports(page_url):
+        try:
+            def load():
+                # Rate limiter, controllo AIMD e pool di proxy condivisi con le campagne
+                response = run_coroutine(transport.fetch(fetch_engine, page_url, stream=False))
+                response.raise_for_status()
+                return SharedPage(response.url, response.content, response.status_code, response.headers)
+            
+            # Richieste in corso o recenti per lo stesso URL vengono riusate
+            shared_page, _ = get_fetch_coalescer().get(normalize_url(transport.page_url(page_url)), load)
+            return shared_page.parsed(('market_research',), lambda content: _parse_results_page(content, page, transport))
+        except TransportError as e:
+            # Il trasporto HTML non solleva TransportError: il ciclo termina sempre
+            report_transport_failure(page_url, e)
+
+def _parse_results_page(html, page, transport=HTML_TRANSPORT):
+    """
+    Estrae i risultati da una pagina scaricata, con un solo parsing: le card HTML
+    vengono lette solo per i campi che il JSON non fornisce
+
+    Returns:
+        tuple: (risultati, metadati di paginazione come in listing_page_info)
+    """
+    if transport is JSON_TRANSPORT:
+        # Route dati: il JSON contiene già tutti i campi delle card (altrimenti TransportError)
+        json_data, cards, card_fields = JSON_TRANSPORT.parse_state(html), [], set()
+    else:
+        try:
+            json_data, cards, card_fields = parse_page(html, json_only=True)
+        except Exception as e:
+            st.error(f"Errore nell'elaborazione della pagina: {str(e)}")
+            json_data, cards, card_fields = None, [], set()
+    
+    # Estrai i risultati e la paginazione dal JSON
+    page_results = _get_results_from_json(json_data)
+    page_info = listing_page_info(json_data)
+    
+    # Aggiungi dati da HTML per venduto, abbinando card e risultati tramite indice
+    if card_fields:
+        pairs, match_stats = match_cards(page_results, cards)
+        for res, card in pairs:
+            if 'venduto' in card_fields:
+                res['venduto'] = card['venduto']
+            # Aggiorna anche il prezzo se visibile
+            if 'prezzo' in card_fields and card['prezzo'] is not None:
+                res['prezzo'] = card['prezzo']
+        
+        if match_stats['unmatched_ads']:
+            st.warning(f"Pagina {page}: {match_stats['unmatched_ads']} annunci senza card visibile (stato venduto non verificato)")
+    
+    return page_results, page_info
+
 def _extract_json_from_html(html):
     """
     Estrae i dati JSON dallo script nell'HTML della pagina
     """
     try:
-        soup = BeautifulSoup(html, 'html.parser')
-        
-        # Cerca lo script contenente i dati JSON
-        script_tag = soup.find("script", {"id": "__NEXT_DATA__"})
+        # Fast path senza BeautifulSoup, con fallback interno al parser completo
+        json_data = extract_next_data(html)
         
-        if not script_tag:
+        if not json_data:
             return None
         
-        json_text = script_tag.string
-        json_data = json.loads(json_text)
-        
         # Estrai i dati dei risultati
-        if 'props' in json_data and 'pageProps' in json_data['props'] and 'initialState' in json_data['props']['pageProps']:
-            return json_data['props']['pageProps']['initialState']
-        
-        return None
+        return get_initial_state(json_data)
         
     except Exception as e:
         st.error(f"Errore nell'estrazione dei dati JSON: {str(e)}")
@@ -239,7 +250,7 @@ def _get_results_from_json(json_data):
                     'data': data,
                     'url': url,
                     'id': item_id,
-                    'venduto': False  # Default, sarà aggiornato con i dati visibili
+                    'venduto': is_ad_sold(ad_item)  # Aggiornato con i dati visibili se il JSON non basta
                 }
                 
                 results.append(result)
@@ -45,6 +45,17 @@ def migrate_database():
         except sqlite3.OperationalError as e:
             logger.warning(f"Errore nella creazione dell'indice: {e}")
         
+        # Regioni delle campagne suddivise per regione (NULL = tutta Italia)
+        cursor.execute("PRAGMA table_info(keywords)")
+        columns = [col[1] for col in cursor.fetchall()]
+        
+        if "regioni" not in columns:
+            logger.info("Aggiunta della colonna regioni alla tabella keywords...")
+            cursor.execute("ALTER TABLE keywords ADD COLUMN regioni TEXT")
+            logger.info("Colonna regioni aggiunta con successo")
+        else:
+            logger.info("La colonna regioni esiste già nella tabella keywords")
+        
         # Commit delle modifiche
         conn.commit()
         logger.info("Migrazione completata con successo")
@@ -0,0 +1,168 @@
+"""
+Cache delle pagine dei risultati tra un polling e il successivo.
+
+Una campagna interroga la stessa pagina ogni intervallo_minuti e spesso la
+lista degli annunci non è cambiata: scaricarla, elaborarla, deduplicarla e
+aggiornare DB e statistiche è lavoro sprecato. La cache, per URL normalizzato,
+conserva un hash della lista degli ID degli annunci estratti e i validatori
+(ETag, Last-Modified) di ciascun URL effettivamente scaricato per la pagina
+(pagina HTML o route dati JSON, vedi listing_transport): i validatori di un
+trasporto non vengono mai inviati all'altro.
+
+Se il server supporta le richieste condizionali la pagina invariata non viene
+nemmeno scaricata (304 Not Modified); altrimenti la ricerca si interrompe non
+appena l'hash della prima pagina coincide con quello elaborato dalla stessa
+campagna al polling precedente.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from fetch_dedup import normalize_url
+
+# Numero massimo di URL conservati (i meno usati di recente vengono scartati)
+MAX_CACHED_PAGES = 1024
+
+
+def ids_hash(ids):
+    """Hash della lista ordinata degli ID degli annunci di una pagina"""
+    return hashlib.sha1("\n".join(str(ad_id) for ad_id in ids).encode()).hexdigest()
+
+
+class CachedPage:
+    """
+    Ultima versione nota di una pagina: hash degli ID e validatori HTTP
+    (ETag, Last-Modified) per URL scaricato
+    """
+
+    def __init__(self, ids_hash=None):
+        self.ids_hash = ids_hash
+        self.validators = {}
+        self.checked_at = time.time()
+
+
+class PageCache:
+    """
+    Versioni delle pagine per URL e hash elaborato da ciascuna campagna, thread-safe.
+
+    Il contenuto di una pagina è comune a tutte le campagne che la scaricano, ma
+    "invariata" dipende da cosa ha già elaborato la singola campagna (scope): una
+    pagina è invariata per una campagna se il suo hash coincide con quello che la
+    campagna ha registrato con commit.
+    """
+
+    def __init__(self, max_entries=MAX_CACHED_PAGES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()
+        self._processed = OrderedDict()
+        self._stats = {}
+
+    def _count(self, name):
+        self._stats[name] = self._stats.get(name, 0) + 1
+
+    def _touch(self, entries, key, value=None):
+        if value is not None:
+            entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def conditional_headers(self, url, scope, fetched_url=None):
+        """
+        Header per una richiesta condizionale, solo se la campagna ha già elaborato
+        l'ultima versione nota della pagina (un 304 significa allora "invariata")
+
+        Args:
+            fetched_url: URL che verrà scaricato per la pagina url (None = url stesso)
+
+        Returns:
+            dict: If-None-Match / If-Modified-Since, vuoto se non applicabili
+        """
+        key = normalize_url(url)
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None or page.ids_hash is None or self._processed.get((scope, key)) != page.ids_hash:
+                return {}
+            etag, last_modified = page.validators.get(normalize_url(fetched_url or url), (None, None))
+            headers = {}
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+            return headers
+
+    def store(self, url, headers, page_ids_hash, fetched_url=None):
+        """
+        Registra la versione di una pagina scaricata (risposta 200) da fetched_url
+        (None = url stesso). I validatori degli altri URL della pagina restano validi
+        solo se la lista degli ID non è cambiata
+        """
+        key = normalize_url(url)
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None or page.ids_hash != page_ids_hash:
+                page = CachedPage(page_ids_hash)
+            page.validators[normalize_url(fetched_url or url)] = (headers.get("ETag"), headers.get("Last-Modified"))
+            page.checked_at = time.time()
+            self._touch(self._pages, key, page)
+
+    def not_modified(self, url, fetched_url=None):
+        """
+        Registra una risposta 304 di fetched_url (None = url stesso) per la pagina
+
+        Returns:
+            str | None: L'hash della versione invariata, None se fetched_url non ha
+                        validatori per l'ultima versione nota
+        """
+        key = normalize_url(url)
+        with self._lock:
+            self._count("not_modified")
+            page = self._pages.get(key)
+            if page is None or normalize_url(fetched_url or url) not in page.validators:
+                return None
+            page.checked_at = time.time()
+            self._touch(self._pages, key)
+            return page.ids_hash
+
+    def is_unchanged(self, url, scope, page_ids_hash):
+        """True se la campagna ha già elaborato una pagina con lo stesso hash"""
+        key = normalize_url(url)
+        with self._lock:
+            unchanged = page_ids_hash is not None and self._processed.get((scope, key)) == page_ids_hash
+            self._count("unchanged" if unchanged else "changed")
+            return unchanged
+
+    def commit(self, url, scope, page_ids_hash):
+        """Registra l'hash della pagina elaborata dalla campagna (a ricerca conclusa)"""
+        if page_ids_hash is None:
+            return
+        key = normalize_url(url)
+        with self._lock:
+            self._touch(self._processed, (scope, key), page_ids_hash)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._processed.clear()
+
+    def metrics(self):
+        """Conteggi di pagine invariate (unchanged), cambiate (changed) e risposte 304 (not_modified)"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pages"] = len(self._pages)
+        return stats
+
+
+_page_cache = PageCache()
+
+
+def get_page_cache():
+    """Restituisce la cache delle pagine condivisa dal processo"""
+    return _page_cache
+
+
+def page_cache_metrics():
+    """Metriche della cache delle pagine condivisa"""
+    return _page_cache.metrics()
@@ -0,0 +1,675 @@
+"""
+Funzioni di parsing condivise per le pagine di ricerca di Subito.it
+
+Usate sia da SubitoScraper sia dalla pagina Market Research, in modo che
+l'estrazione dei dati dalle pagine abbia un'unica implementazione.
+"""
+import json
+import logging
+import os
+import re
+from urllib.parse import urlsplit
+
+from bs4 import BeautifulSoup
+
+# orjson è opzionale: se installato decodifica il JSON più velocemente e con meno memoria
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger("SnipeDeal.PageParser")
+
+# Marcatore dello script Next.js che contiene lo stato della pagina
+NEXT_DATA_ID = "__NEXT_DATA__"
+
+# Inizio dell'oggetto initialState.items (lista annunci e metadati di paginazione)
+# e chiavi che nello stato serializzato lo seguono
+_ITEMS_MARKER = '"items":{"list":'
+_ITEMS_END_MARKERS = (',"env":', ',"filtersConfig":')
+
+
+def _json_loads(payload):
+    """Decodifica JSON con orjson se disponibile, altrimenti con il modulo json"""
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+def _find_next_data_payload(html):
+    """
+    Individua il contenuto dello script __NEXT_DATA__ scansionando il testo grezzo.
+    Accetta sia str che bytes e restituisce una slice dello stesso tipo, oppure None.
+    """
+    if isinstance(html, (bytes, bytearray)):
+        marker, tag_end, script_end = NEXT_DATA_ID.encode(), b">", b"</script>"
+    else:
+        marker, tag_end, script_end = NEXT_DATA_ID, ">", "</script>"
+
+    idx = html.find(marker)
+    if idx == -1:
+        return None
+
+    # Inizio del contenuto: primo '>' dopo l'attributo id
+    start = html.find(tag_end, idx)
+    if start == -1:
+        return None
+    start += 1
+
+    # Il JSON serializzato non può contenere "</script>" letterale, quindi la prima
+    # occorrenza chiude lo script
+    end = html.find(script_end, start)
+    if end == -1:
+        return None
+
+    return html[start:end]
+
+
+def next_data_end(body):
+    """
+    Posizione subito dopo il </script> che chiude lo script __NEXT_DATA__, usata per
+    interrompere un download in streaming quando lo stato della pagina è completo
+
+    Args:
+        body: Contenuto scaricato finora (bytes o bytearray)
+
+    Returns:
+        int: La posizione, -1 se lo script non è ancora completo
+    """
+    idx = body.find(NEXT_DATA_ID.encode())
+    if idx == -1:
+        return -1
+    end = body.find(b"</script>", idx)
+    if end == -1:
+        return -1
+    return end + len(b"</script>")
+
+
+# Testi tipici delle pagine di blocco anti-bot (captcha, WAF) al posto dei risultati
+_BLOCK_PAGE_MARKERS = (b"captcha", b"datadome", b"access denied", b"request unsuccessful", b"incapsula", b"perimeterx")
+
+
+def is_block_page(status_code, body):
+    """
+    Riconosce una pagina di blocco anti-bot: un 403 oppure una pagina 200 senza
+    __NEXT_DATA__ che contiene i testi tipici di captcha e WAF
+
+    Args:
+        status_code: Codice HTTP della risposta
+        body: Contenuto della risposta (bytes o str)
+    """
+    if status_code == 403:
+        return True
+    if status_code != 200 or not body:
+        return False
+    if isinstance(body, str):
+        body = body.encode('utf-8', errors='ignore')
+    if NEXT_DATA_ID.encode() in body:
+        return False
+    head = body[:20000].lower()
+    return any(marker in head for marker in _BLOCK_PAGE_MARKERS)
+
+
+def decode_html(html, card_region=False):
+    """
+    Converte il contenuto della pagina in str con una decodifica UTF-8 fissa,
+    senza il rilevamento del charset di requests/BeautifulSoup.
+
+    Args:
+        html: Contenuto della pagina (bytes di response.content oppure str)
+        card_region: Se True viene decodificata solo la parte che precede lo script
+                     __NEXT_DATA__, l'unica che contiene le card visibili
+
+    Returns:
+        str: Il testo (eventualmente ridotto) della pagina
+    """
+    is_bytes = isinstance(html, (bytes, bytearray))
+    if card_region:
+        marker, script_start = (NEXT_DATA_ID.encode(), b"<script") if is_bytes else (NEXT_DATA_ID, "<script")
+        idx = html.find(marker)
+        if idx != -1:
+            cut = html.rfind(script_start, 0, idx)
+            if cut != -1:
+                html = html[:cut]
+    if is_bytes:
+        return html.decode('utf-8', errors='replace')
+    return html
+
+
+def extract_next_data_fast(html):
+    """
+    Estrae il JSON di __NEXT_DATA__ senza costruire l'albero HTML.
+    Passa al decoder JSON solo la slice dello script.
+
+    Returns:
+        dict | None: Il contenuto completo di __NEXT_DATA__, None se il fast path fallisce
+    """
+    payload = _find_next_data_payload(html)
+    if not payload:
+        return None
+
+    try:
+        return _json_loads(payload)
+    except ValueError as e:
+        logger.debug(f"Fast path __NEXT_DATA__ fallito: {str(e)}")
+        return None
+
+
+def decode_listing_state(payload):
+    """
+    Decodifica parzialmente il payload di __NEXT_DATA__, materializzando solo
+    initialState.items (lista annunci, total, totalPages) e scartando il resto
+    dello stato senza convertirlo in oggetti Python.
+
+    Con orjson viene decodificata solo la slice dell'oggetto items; senza orjson
+    il decoder incrementale di json parte dall'inizio di items e si ferma alla
+    sua chiusura.
+
+    Returns:
+        dict | None: Uno stato ridotto {'items': {...}}, None se la struttura
+                     non è quella attesa (il chiamante passa alla decodifica completa)
+    """
+    if isinstance(payload, (bytes, bytearray)):
+        marker = _ITEMS_MARKER.encode()
+        end_markers = [m.encode() for m in _ITEMS_END_MARKERS]
+    else:
+        marker, end_markers = _ITEMS_MARKER, _ITEMS_END_MARKERS
+
+    # Il marcatore deve essere unico: una chiave "items" annidata altrove renderebbe ambiguo l'inizio
+    idx = payload.find(marker)
+    if idx == -1 or payload.find(marker, idx + 1) != -1:
+        return None
+    start = idx + len('"items":')
+
+    items = None
+    if orjson is not None:
+        for end_marker in end_markers:
+            end = payload.find(end_marker, start)
+            if end == -1:
+                continue
+            try:
+                items = orjson.loads(payload[start:end])
+                break
+            except ValueError:
+                # La slice non corrisponde esattamente all'oggetto items
+                continue
+
+    if items is None:
+        if isinstance(payload, (bytes, bytearray)):
+            text = payload.decode('utf-8')
+            start = text.find(_ITEMS_MARKER) + len('"items":')
+        else:
+            text = payload
+        try:
+            items, _ = json.JSONDecoder().raw_decode(text, start)
+        except ValueError as e:
+            logger.debug(f"Decodifica parziale di items fallita: {str(e)}")
+            return None
+
+    if not isinstance(items, dict) or 'list' not in items:
+        return None
+
+    return {'items': items}
+
+
+def extract_listing_state_fast(html, partial=True):
+    """
+    Estrae lo stato della pagina (initialState) senza costruire l'albero HTML.
+
+    Args:
+        html: Contenuto della pagina (str o bytes)
+        partial: Se True decodifica solo items e i metadati di paginazione
+
+    Returns:
+        dict | None: Lo stato della pagina, None se il fast path fallisce
+    """
+    payload = _find_next_data_payload(html)
+    if not payload:
+        return None
+
+    if partial:
+        state = decode_listing_state(payload)
+        if state is not None:
+            return state
+
+    try:
+        return get_initial_state(_json_loads(payload))
+    except ValueError as e:
+        logger.debug(f"Fast path __NEXT_DATA__ fallito: {str(e)}")
+        return None
+
+
+def extract_next_data_soup(html):
+    """
+    Estrae il JSON di __NEXT_DATA__ costruendo l'albero BeautifulSoup.
+    Più lento, usato solo come fallback del fast path.
+    """
+    soup = BeautifulSoup(decode_html(html), 'html.parser')
+    script_tag = soup.find("script", {"id": NEXT_DATA_ID})
+
+    if not script_tag or not script_tag.string:
+        return None
+
+    return _json_loads(script_tag.string)
+
+
+def extract_next_data(html):
+    """
+    Estrae il JSON di __NEXT_DATA__ dalla pagina, provando prima il fast path
+    e ricorrendo a BeautifulSoup solo se questo fallisce
+
+    Returns:
+        dict | None: Il contenuto di __NEXT_DATA__ oppure None se lo script non è presente
+    """
+    json_data = extract_next_data_fast(html)
+    if json_data is not None:
+        return json_data
+
+    logger.debug("Fast path non riuscito, fallback a BeautifulSoup")
+    return extract_next_data_soup(html)
+
+
+def get_initial_state(json_data):
+    """
+    Restituisce props.pageProps.initialState dal JSON di __NEXT_DATA__, oppure None
+    """
+    if json_data and 'props' in json_data and 'pageProps' in json_data['props'] and 'initialState' in json_data['props']['pageProps']:
+        return json_data['props']['pageProps']['initialState']
+
+    return None
+
+
+# Identificativo della build Next.js nello script __NEXT_DATA__ (dopo lo stato della pagina)
+_BUILD_ID_RE = re.compile(rb'"buildId"\s*:\s*"([^"\\]+)"')
+
+
+def extract_build_id(html):
+    """
+    Restituisce il buildId di Next.js della pagina (necessario per la route dati
+    /_next/data/<buildId>/...), cercandolo dalla fine del contenuto, oppure None
+    """
+    if not isinstance(html, (bytes, bytearray)):
+        html = html.encode('utf-8')
+    idx = html.rfind(b'"buildId"')
+    if idx == -1:
+        return None
+    match = _BUILD_ID_RE.match(html, idx)
+    return match.group(1).decode('utf-8') if match else None
+
+
+def extract_listing_state_json(body, partial=True):
+    """
+    Estrae lo stato della pagina dalla risposta della route dati di Next.js,
+    un JSON {"pageProps": {..., "initialState": {...}}} senza HTML
+
+    Args:
+        body: Contenuto della risposta (str o bytes)
+        partial: Se True decodifica solo items e i metadati di paginazione
+
+    Returns:
+        dict | None: Lo stato della pagina, None se la struttura non è quella attesa
+    """
+    if partial:
+        state = decode_listing_state(body)
+        if state is not None:
+            return state
+
+    try:
+        data = _json_loads(body)
+    except ValueError as e:
+        logger.debug(f"Decodifica della route dati fallita: {str(e)}")
+        return None
+    if not isinstance(data, dict):
+        return None
+    return get_initial_state({'props': data})
+
+
+# Selettori delle card visibili nella pagina dei risultati
+CARD_SELECTOR = 'div.items__item'
+CARD_DATE_SELECTOR = 'div.AdInfo-module_date__jR3v2, span.AdInfo-module_date__jR3v2'
+CARD_TOWN_SELECTOR = 'span.AdInfo-module_location__XY6Rs, span.AdInfo-module_town__nH89d'
+CARD_PRICE_SELECTOR = 'p.index-module_price__N7M2x'
+
+# Backend di parsing HTML supportati, in ordine di preferenza per la modalità "auto"
+PARSER_BACKENDS = ("selectolax", "lxml", "html.parser")
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as SelectolaxParser
+except ImportError:
+    # Versioni di selectolax precedenti alla 0.3 hanno solo il backend Modest
+    try:
+        from selectolax.parser import HTMLParser as SelectolaxParser
+    except ImportError:
+        SelectolaxParser = None
+
+try:
+    import lxml  # noqa: F401  (usato da BeautifulSoup come tree builder)
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
+
+
+def available_parser_backends():
+    """Restituisce i backend di parsing installati nell'ambiente corrente"""
+    backends = []
+    if SelectolaxParser is not None:
+        backends.append("selectolax")
+    if LXML_AVAILABLE:
+        backends.append("lxml")
+    backends.append("html.parser")
+    return backends
+
+
+def resolve_parser_backend(preferred=None):
+    """
+    Sceglie il backend di parsing HTML a runtime.
+
+    Args:
+        preferred: Nome del backend ("selectolax", "lxml", "html.parser" o "auto").
+                   Se None viene letta la variabile d'ambiente SNIPEDEAL_HTML_PARSER.
+
+    Returns:
+        str: Il backend effettivamente utilizzabile
+    """
+    preferred = (preferred or os.environ.get("SNIPEDEAL_HTML_PARSER") or "auto").strip().lower()
+    available = available_parser_backends()
+
+    if preferred == "auto":
+        return available[0]
+
+    if preferred not in PARSER_BACKENDS:
+        logger.warning(f"Backend di parsing sconosciuto '{preferred}', uso '{available[0]}'")
+        return available[0]
+
+    if preferred not in available:
+        logger.warning(f"Backend di parsing '{preferred}' non installato, uso '{available[0]}'")
+        return available[0]
+
+    return preferred
+
+
+def parse_price_text(price_text):
+    """
+    Converte il prezzo visibile di una card (es. "1.250,50 €") in float.
+    Restituisce None se il testo non contiene un prezzo valido.
+    """
+    try:
+        return float(''.join(c for c in price_text if c.isdigit() or c == ',').replace(',', '.'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _card_extras(url, date_raw, luogo_raw, venduto, price_text):
+    """Costruisce il dizionario dei dati visibili estratti da una card"""
+    return {
+        'url': url,
+        'data_raw': date_raw,
+        'luogo_raw': luogo_raw,
+        'venduto': venduto,
+        'prezzo': parse_price_text(price_text) if price_text is not None else None,
+    }
+
+
+def _extract_cards_soup(soup):
+    """Estrae i dati visibili delle card da un albero BeautifulSoup"""
+    cards = []
+    for card in soup.select(CARD_SELECTOR):
+        link_el = card.select_one('a')
+        url = link_el['href'] if link_el and 'href' in link_el.attrs else None
+        date_el = card.select_one(CARD_DATE_SELECTOR)
+        luogo_el = card.select_one(CARD_TOWN_SELECTOR)
+        price_el = card.select_one(CARD_PRICE_SELECTOR)
+        venduto = card.find(string=lambda t: t and 'venduto' in t.lower()) is not None
+        cards.append(_card_extras(
+            url,
+            date_el.text.strip() if date_el else None,
+            luogo_el.text.strip() if luogo_el else None,
+            venduto,
+            price_el.text.strip() if price_el else None,
+        ))
+    return cards
+
+
+def _extract_cards_selectolax(tree):
+    """Estrae i dati visibili delle card da un albero selectolax"""
+    cards = []
+    for card in tree.css(CARD_SELECTOR):
+        link_el = card.css_first('a')
+        url = link_el.attributes.get('href') if link_el is not None else None
+        date_el = card.css_first(CARD_DATE_SELECTOR)
+        luogo_el = card.css_first(CARD_TOWN_SELECTOR)
+        price_el = card.css_first(CARD_PRICE_SELECTOR)
+        venduto = 'venduto' in card.text().lower()
+        cards.append(_card_extras(
+            url,
+            date_el.text().strip() if date_el is not None else None,
+            luogo_el.text().strip() if luogo_el is not None else None,
+            venduto,
+            price_el.text().strip() if price_el is not None else None,
+        ))
+    return cards
+
+
+# Campi che il passaggio sulle card HTML può fornire ai risultati
+CARD_FIELDS = ('venduto', 'prezzo', 'data', 'luogo')
+
+
+def iter_ad_items(state):
+    """
+    Restituisce gli elementi annuncio (kind == 'AdItem') della lista risultati
+    dello stato della pagina, ignorando slot pubblicitari e altri tipi
+    """
+    for decorated_item in state['items']['list']:
+        item = decorated_item.get('item') if isinstance(decorated_item, dict) else None
+        if item and item.get('kind') == 'AdItem':
+            yield item
+
+
+def listing_page_info(state):
+    """
+    Metadati di paginazione dello stato di una pagina dei risultati
+
+    Returns:
+        dict: 'ads' (annunci nella pagina, prima di qualsiasi filtro), 'total'
+              (annunci totali della ricerca) e 'total_pages' (pagine totali);
+              total e total_pages sono None se non presenti nello stato
+    """
+    if not state or 'items' not in state or 'list' not in state['items']:
+        return {'ads': 0, 'total': None, 'total_pages': None}
+
+    items = state['items']
+    total = items.get('total')
+    total_pages = items.get('totalPages')
+    return {
+        'ads': sum(1 for _ in iter_ad_items(state)),
+        'total': total if isinstance(total, int) else None,
+        'total_pages': total_pages if isinstance(total_pages, int) else None,
+    }
+
+
+def is_ad_sold(ad_item):
+    """
+    Indica se l'annuncio risulta venduto secondo il JSON: Subito.it espone la
+    feature '/transaction_status' con valore 'SOLD' solo per gli annunci venduti
+    """
+    try:
+        status = ad_item['features']['/transaction_status']
+        return any(value.get('value') == 'SOLD' for value in status.get('values', []))
+    except (KeyError, TypeError, AttributeError):
+        return False
+
+
+def probe_missing_fields(json_data):
+    """
+    Verifica quali campi delle card non sono ricavabili dal JSON della pagina.
+
+    Prezzo e stato venduto sono affidabili quando l'annuncio ha la mappa 'features'
+    (un annuncio senza '/price' non mostra il prezzo nemmeno nella card); luogo e
+    data richiedono rispettivamente 'geo' con città o comune e 'date'.
+
+    Returns:
+        set: Campi di CARD_FIELDS mancanti per almeno un annuncio della pagina
+    """
+    if not json_data or 'items' not in json_data or 'list' not in json_data['items']:
+        return set(CARD_FIELDS)
+
+    missing = set()
+    for decorated_item in json_data['items']['list']:
+        ad_item = decorated_item.get('item') or {}
+        if ad_item.get('kind') != 'AdItem':
+            continue
+
+        if not isinstance(ad_item.get('features'), dict):
+            missing.update(('venduto', 'prezzo'))
+
+        geo_data = ad_item.get('geo') or {}
+        if not (geo_data.get('city', {}).get('value') or geo_data.get('town', {}).get('value')):
+            missing.add('luogo')
+
+        if not ad_item.get('date'):
+            missing.add('data')
+
+        if len(missing) == len(CARD_FIELDS):
+            break
+
+    return missing
+
+
+def parse_page(html, parser=None, json_only=False, partial_json=True):
+    """
+    Elabora una pagina dei risultati con al massimo un parsing HTML completo.
+
+    Lo stato della pagina viene estratto con il fast path; l'albero HTML,
+    costruito una sola volta con il backend scelto, serve per le card visibili
+    e, solo se il fast path fallisce, anche per recuperare lo script JSON.
+
+    Args:
+        html: Contenuto della pagina (bytes di response.content oppure str)
+        parser: Backend di parsing (vedi resolve_parser_backend)
+        json_only: Se True l'albero HTML non viene costruito quando il JSON
+                   contiene già tutti i campi delle card
+        partial_json: Se True decodifica solo items e i metadati di paginazione
+
+    Returns:
+        tuple: (state, cards, card_fields) dove state è lo stato initialState della pagina
+               (o None), cards è la lista dei dati visibili di ogni card e card_fields
+               l'insieme dei campi da prendere dalle card
+    """
+    state = extract_listing_state_fast(html, partial=partial_json)
+
+    card_fields = set(CARD_FIELDS)
+    probed = False
+    if json_only and state is not None:
+        card_fields = probe_missing_fields(state)
+        probed = True
+        if not card_fields:
+            return state, [], card_fields
+
+    # Se lo stato è già disponibile l'albero serve solo per le card: basta
+    # decodificare la parte della pagina che precede lo script JSON
+    html = decode_html(html, card_region=state is not None)
+
+    backend = resolve_parser_backend(parser)
+    if backend == "selectolax":
+        tree = SelectolaxParser(html)
+        if state is None:
+            script_tag = tree.css_first(f"script#{NEXT_DATA_ID}")
+            if script_tag is not None and script_tag.text():
+                state = get_initial_state(_json_loads(script_tag.text()))
+        cards = _extract_cards_selectolax(tree)
+    else:
+        soup = BeautifulSoup(html, backend)
+        if state is None:
+            script_tag = soup.find("script", {"id": NEXT_DATA_ID})
+            if script_tag and script_tag.string:
+                state = get_initial_state(_json_loads(script_tag.string))
+        cards = _extract_cards_soup(soup)
+
+    if json_only and not probed and state is not None:
+        # Lo stato è stato recuperato solo dall'albero HTML: il probe va eseguito ora
+        card_fields = probe_missing_fields(state)
+
+    return state, cards, card_fields
+
+
+# ID numerico finale negli URL degli annunci (es. ".../xbox-series-s-firenze-599162306.htm")
+_AD_URL_ID_RE = re.compile(r'-(\d+)\.htm')
+
+
+def canonical_ad_url(url):
+    """
+    Normalizza l'URL di un annuncio per il confronto: host in minuscolo,
+    senza schema, query string, frammento e slash finale
+    """
+    if not url:
+        return None
+    parts = urlsplit(url.strip())
+    return f"{parts.netloc.lower()}{parts.path.rstrip('/')}"
+
+
+def ad_id_from_url(url):
+    """Estrae l'ID numerico dell'annuncio dall'URL, oppure None"""
+    if not url:
+        return None
+    match = _AD_URL_ID_RE.search(url)
+    return match.group(1) if match else None
+
+
+def match_cards(results, cards):
+    """
+    Abbina le card visibili ai risultati estratti dal JSON tramite un indice
+    per ID e, in mancanza, per URL canonico, in tempo lineare.
+
+    Args:
+        results: Risultati estratti dal JSON (con chiavi 'url' e 'id')
+        cards: Dati visibili delle card restituiti da parse_page
+
+    Returns:
+        tuple: (pairs, stats) dove pairs è la lista di coppie (risultato, card)
+               e stats contiene i conteggi di card e annunci non abbinati
+    """
+    # L'indice per ID usa solo campi già estratti; quello per URL viene costruito
+    # solo se serve, così gli URL lazy dei record Ad non vengono decodificati
+    by_id = {}
+    for res in results:
+        id_key = res.get('id')
+        if not id_key or id_key == "unknown":
+            id_key = ad_id_from_url(res.get('url'))
+        if id_key:
+            by_id.setdefault(str(id_key), res)
+    by_url = None
+
+    pairs = []
+    matched_ids = set()
+    cards_without_url = 0
+    unmatched_cards = 0
+    for card in cards:
+        url = card.get('url')
+        if not url:
+            # Slot pubblicitari e contenitori vuoti non hanno un link
+            cards_without_url += 1
+            continue
+        card_id = ad_id_from_url(url)
+        res = by_id.get(card_id) if card_id else None
+        if res is None:
+            if by_url is None:
+                by_url = {}
+                for candidate in results:
+                    url_key = canonical_ad_url(candidate.get('url'))
+                    if url_key:
+                        by_url.setdefault(url_key, candidate)
+            res = by_url.get(canonical_ad_url(url))
+        if res is None:
+            unmatched_cards += 1
+            continue
+        pairs.append((res, card))
+        matched_ids.add(id(res))
+
+    stats = {
+        'cards': len(cards) - cards_without_url,
+        'ads': len(results),
+        'matched': len(matched_ids),
+        'unmatched_cards': unmatched_cards,
+        'unmatched_ads': len(results) - len(matched_ids),
+    }
+    return pairs, stats
@@ -0,0 +1,130 @@
+"""
+Stadio di parsing opzionale su un pool di processi condiviso.
+
+Il parsing delle pagine dei risultati è CPU-bound: eseguito nel thread che fa
+le richieste HTTP compete per il GIL con l'app Streamlit e con i thread delle
+altre campagne. Con un pool di processi le pagine scaricate vengono elaborate
+nei worker, che restituiscono record Ad compatti (senza il JSON originale).
+
+Il pool è condiviso da tutti gli scraper del processo, per dimensione, e viene
+creato al primo utilizzo. Qualsiasi errore del pool va gestito dal chiamante
+ripiegando sul parsing nel processo corrente.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from ad_record import Ad
+from page_parser import iter_ad_items, listing_page_info, parse_page
+
+logger = logging.getLogger("SnipeDeal.ParsePool")
+
+# Numero di processi di default, es. "4" oppure "auto" (= numero di CPU)
+PARSE_WORKERS_ENV = "SNIPEDEAL_PARSE_WORKERS"
+
+# Tempo massimo di attesa per il parsing di una pagina in un worker (secondi)
+PARSE_TIMEOUT = 60
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def resolve_parse_workers(workers=None):
+    """
+    Determina il numero di processi del pool di parsing
+
+    Args:
+        workers: Numero di processi, "auto" per il numero di CPU, None per usare
+                 la variabile d'ambiente SNIPEDEAL_PARSE_WORKERS
+
+    Returns:
+        int: Numero di processi (0 = parsing nel processo corrente)
+    """
+    if workers is None:
+        workers = os.environ.get(PARSE_WORKERS_ENV, "0")
+    if isinstance(workers, str):
+        value = workers.strip().lower()
+        if value == "auto":
+            return os.cpu_count() or 1
+        try:
+            workers = int(value or 0)
+        except ValueError:
+            logger.warning(f"Valore non valido per {PARSE_WORKERS_ENV}: {workers!r}, parsing nel processo corrente")
+            return 0
+    return max(0, int(workers))
+
+
+def get_parse_pool(workers):
+    """Restituisce il pool condiviso con il numero di processi indicato, creandolo se necessario"""
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            _pools[workers] = pool
+            logger.info(f"Pool di parsing avviato con {workers} processi")
+        return pool
+
+
+def discard_parse_pool(workers):
+    """Chiude e rimuove un pool non più utilizzabile, così verrà ricreato al prossimo uso"""
+    with _pools_lock:
+        pool = _pools.pop(workers, None)
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def shutdown_parse_pools():
+    """Chiude tutti i pool di parsing"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_listing_page(html, html_parser=None, json_only=True, partial_json=True, debug_json_path=None):
+    """
+    Elabora una pagina dei risultati ed estrae gli annunci (eseguita nei worker).
+
+    Returns:
+        tuple: (ads, cards, card_fields, page_info) con la lista di Ad (None se il JSON
+               della pagina non è stato trovato), i dati delle card, i campi da prendere
+               dalle card e i metadati di paginazione. Le card sono restituite solo se servono.
+    """
+    json_data, cards, card_fields = parse_page(html, html_parser, json_only=json_only, partial_json=partial_json)
+
+    if debug_json_path and json_data:
+        with open(debug_json_path, "w", encoding="utf-8") as f:
+            json.dump(json_data, f, indent=2)
+
+    page_info = listing_page_info(json_data)
+    if not json_data or 'items' not in json_data or 'list' not in json_data['items']:
+        return None, [], set(), page_info
+
+    ads = [Ad.from_ad_item(ad_item) for ad_item in iter_ad_items(json_data)]
+    # Decodifica i campi lazy qui, così il processo principale riceve record compatti
+    for ad in ads:
+        ad.materialize()
+    return ads, (cards if card_fields else []), card_fields, page_info
+
+
+def parse_in_pool(workers, html, **options):
+    """
+    Esegue parse_listing_page nel pool condiviso e attende il risultato.
+
+    Solleva l'eccezione originale in caso di errore: il chiamante deve ripiegare
+    sul parsing nel processo corrente. Un pool rotto viene scartato e ricreato
+    alla richiesta successiva.
+    """
+    pool = get_parse_pool(workers)
+    try:
+        future = pool.submit(parse_listing_page, html, **options)
+        return future.result(timeout=PARSE_TIMEOUT)
+    except BrokenProcessPool:
+        discard_parse_pool(workers)
+        raise
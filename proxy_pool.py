@@ -0,0 +1,254 @@
+"""
+Pool di proxy con punteggio di salute per le richieste verso Subito.it.
+
+Con molte campagne un singolo IP di uscita è il limite di throughput: il sito
+rallenta (429) o blocca un IP indipendentemente da quante campagne lo usano.
+Il pool distribuisce le richieste su più uscite, misurando per ciascuna latenza,
+tasso di errori, di 429 e di pagine di blocco con medie che decadono nel tempo.
+
+Ogni richiesta va all'uscita sana con il punteggio migliore; ogni campagna ha
+un'uscita preferita (hash della campagna), così le campagne si distribuiscono
+sulle uscite e mantengono la stessa finché resta competitiva. Le uscite che
+falliscono ripetutamente o ricevono una pagina di blocco vanno in quarantena
+per un periodo che raddoppia a ogni ricaduta.
+
+Il pool si configura con SNIPEDEAL_PROXIES (URL separati da virgola) oppure con
+configure_proxy_pool; SNIPEDEAL_PROXY_DIRECT=1 aggiunge la connessione diretta
+tra le uscite. Senza proxy configurati il pool è inattivo.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+logger = logging.getLogger("SnipeDeal.ProxyPool")
+
+PROXIES_ENV = "SNIPEDEAL_PROXIES"
+PROXY_DIRECT_ENV = "SNIPEDEAL_PROXY_DIRECT"
+
+# Peso dell'ultima osservazione nelle medie mobili
+EWMA_ALPHA = 0.2
+# Tempo di dimezzamento dei tassi di errore senza nuove osservazioni (secondi)
+DECAY_HALF_LIFE = 600.0
+# Latenza assunta per un'uscita mai usata (secondi)
+DEFAULT_LATENCY = 1.0
+
+# Penalità dei tassi sul punteggio (latenza * (1 + somma pesata dei tassi))
+ERROR_WEIGHT = 4.0
+THROTTLE_WEIGHT = 8.0
+BLOCK_WEIGHT = 16.0
+
+# Fallimenti consecutivi che mandano un'uscita in quarantena
+QUARANTINE_FAILURES = 3
+QUARANTINE_BASE = 60.0
+QUARANTINE_MAX = 900.0
+
+# L'uscita preferita da una campagna viene abbandonata se il suo punteggio
+# è peggiore di questo fattore rispetto al migliore
+AFFINITY_TOLERANCE = 1.5
+
+DIRECT_LABEL = "diretta"
+
+
+def proxy_label(proxy_url):
+    """Nome leggibile di un'uscita, senza credenziali (host:porta)"""
+    if not proxy_url:
+        return DIRECT_LABEL
+    parts = urlsplit(proxy_url if "://" in proxy_url else f"http://{proxy_url}")
+    return f"{parts.hostname}:{parts.port}" if parts.port else (parts.hostname or proxy_url)
+
+
+class ProxyExit:
+    """Uscita del pool (un proxy o la connessione diretta) con le sue statistiche"""
+
+    def __init__(self, url=None):
+        self.url = url
+        self.label = proxy_label(url)
+        self.latency = None
+        self.error_rate = 0.0
+        self.throttle_rate = 0.0
+        self.block_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.quarantines = 0
+        self.quarantined_until = 0.0
+        self.inflight = 0
+        self.last_reason = None
+        self._updated = time.monotonic()
+
+    @property
+    def proxies(self):
+        """Argomento proxies per requests (None = connessione diretta)"""
+        if not self.url:
+            return None
+        return {"http": self.url, "https": self.url}
+
+    def _decay(self, now):
+        factor = 0.5 ** ((now - self._updated) / DECAY_HALF_LIFE)
+        self.error_rate *= factor
+        self.throttle_rate *= factor
+        self.block_rate *= factor
+        self._updated = now
+
+    def is_quarantined(self, now=None):
+        return self.quarantined_until > (now if now is not None else time.monotonic())
+
+    def score(self, now=None):
+        """Punteggio dell'uscita: più basso è migliore"""
+        self._decay(now if now is not None else time.monotonic())
+        latency = self.latency if self.latency is not None else DEFAULT_LATENCY
+        penalty = 1 + ERROR_WEIGHT * self.error_rate + THROTTLE_WEIGHT * self.throttle_rate + BLOCK_WEIGHT * self.block_rate
+        return latency * penalty * (1 + self.inflight)
+
+    def record(self, latency=None, reason=None, error=False):
+        """
+        Registra l'esito di una richiesta
+
+        Args:
+            latency: Durata della richiesta in secondi (None se fallita)
+            reason: Motivo del rallentamento (es. "HTTP 429", "pagina di blocco"), None se sana
+            error: True per un errore di rete
+
+        Returns:
+            float: Secondi di quarantena applicati (0 se nessuna)
+        """
+        now = time.monotonic()
+        self._decay(now)
+        self.requests += 1
+        if latency is not None:
+            self.latency = latency if self.latency is None else (1 - EWMA_ALPHA) * self.latency + EWMA_ALPHA * latency
+
+        blocked = reason == "pagina di blocco" or reason == "HTTP 403"
+        throttled = reason is not None and not blocked
+        self.error_rate += EWMA_ALPHA * ((1.0 if error else 0.0) - self.error_rate)
+        self.throttle_rate += EWMA_ALPHA * ((1.0 if throttled else 0.0) - self.throttle_rate)
+        self.block_rate += EWMA_ALPHA * ((1.0 if blocked else 0.0) - self.block_rate)
+
+        if not (error or reason):
+            self.failures = 0
+            self.quarantines = 0
+            return 0.0
+
+        self.failures += 1
+        self.last_reason = reason or "errore di rete"
+        if blocked or self.failures >= QUARANTINE_FAILURES:
+            self.quarantines += 1
+            duration = min(QUARANTINE_MAX, QUARANTINE_BASE * 2 ** (self.quarantines - 1))
+            self.quarantined_until = now + duration
+            self.failures = 0
+            return duration
+        return 0.0
+
+    def metrics(self):
+        now = time.monotonic()
+        return {
+            'label': self.label,
+            'score': round(self.score(now), 3),
+            'latency_ms': round(self.latency * 1000) if self.latency is not None else None,
+            'error_pct': round(self.error_rate * 100, 1),
+            'throttle_pct': round(self.throttle_rate * 100, 1),
+            'block_pct': round(self.block_rate * 100, 1),
+            'requests': self.requests,
+            'inflight': self.inflight,
+            'quarantined_for': round(max(0.0, self.quarantined_until - now), 1),
+            'last_reason': self.last_reason,
+        }
+
+
+class ProxyPool:
+    """Insieme delle uscite disponibili, thread-safe"""
+
+    def __init__(self, proxies=(), include_direct=False):
+        self._lock = threading.Lock()
+        self.exits = []
+        self.configure(proxies, include_direct)
+
+    def configure(self, proxies=(), include_direct=False):
+        """Sostituisce le uscite del pool, mantenendo le statistiche di quelle già note"""
+        urls = [url.strip() for url in proxies if url and url.strip()]
+        if include_direct:
+            urls.append(None)
+        with self._lock:
+            known = {proxy_exit.url: proxy_exit for proxy_exit in self.exits}
+            self.exits = [known.get(url) or ProxyExit(url) for url in dict.fromkeys(urls)]
+        if self.exits:
+            logger.info(f"Pool di proxy configurato con {len(self.exits)} uscite: {', '.join(proxy_exit.label for proxy_exit in self.exits)}")
+
+    def __bool__(self):
+        return bool(self.exits)
+
+    def _preferred(self, candidates, affinity):
+        # Rendezvous hashing: ogni campagna ha un'uscita preferita stabile,
+        # e le campagne si distribuiscono in modo uniforme sulle uscite
+        def weight(proxy_exit):
+            return hashlib.sha1(f"{affinity}|{proxy_exit.label}".encode()).digest()
+        return max(candidates, key=weight)
+
+    def choose(self, affinity=None):
+        """
+        Sceglie l'uscita per una richiesta e la segna come in uso
+        (va sempre seguita da release; l'esito si registra con report)
+
+        Args:
+            affinity: Identificativo della campagna, per preferire sempre la stessa uscita
+
+        Returns:
+            ProxyExit | None: L'uscita scelta, None se il pool è vuoto
+        """
+        with self._lock:
+            if not self.exits:
+                return None
+            now = time.monotonic()
+            candidates = [proxy_exit for proxy_exit in self.exits if not proxy_exit.is_quarantined(now)]
+            if not candidates:
+                # Tutte in quarantena: si usa quella che ne esce per prima
+                chosen = min(self.exits, key=lambda proxy_exit: proxy_exit.quarantined_until)
+            else:
+                chosen = min(candidates, key=lambda proxy_exit: proxy_exit.score(now))
+                if affinity is not None:
+                    preferred = self._preferred(candidates, affinity)
+                    if preferred.score(now) <= chosen.score(now) * AFFINITY_TOLERANCE:
+                        chosen = preferred
+            chosen.inflight += 1
+            return chosen
+
+    def report(self, proxy_exit, latency=None, reason=None, error=False):
+        """Registra l'esito di una richiesta sull'uscita (vedi ProxyExit.record)"""
+        with self._lock:
+            quarantine = proxy_exit.record(latency, reason, error)
+        if quarantine:
+            logger.warning(f"Proxy {proxy_exit.label} in quarantena per {quarantine:.0f}s ({proxy_exit.last_reason})")
+
+    def release(self, proxy_exit):
+        """Rilascia un'uscita scelta con choose, a richiesta conclusa o annullata"""
+        with self._lock:
+            proxy_exit.inflight = max(0, proxy_exit.inflight - 1)
+
+    def metrics(self):
+        """Statistiche di tutte le uscite"""
+        with self._lock:
+            return [proxy_exit.metrics() for proxy_exit in self.exits]
+
+
+def _proxies_from_env():
+    return [url for url in os.environ.get(PROXIES_ENV, "").split(",") if url.strip()]
+
+
+_proxy_pool = ProxyPool(_proxies_from_env(), os.environ.get(PROXY_DIRECT_ENV, "").strip().lower() in ("1", "true", "yes"))
+
+
+def get_proxy_pool():
+    """Restituisce il pool di proxy condiviso dal processo"""
+    return _proxy_pool
+
+
+def configure_proxy_pool(proxies=(), include_direct=False):
+    """Configura le uscite del pool condiviso"""
+    _proxy_pool.configure(proxies, include_direct)
+
+
+def proxy_pool_metrics():
+    """Statistiche delle uscite del pool condiviso (lista vuota se inattivo)"""
+    return _proxy_pool.metrics()
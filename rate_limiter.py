@@ -0,0 +1,546 @@
+"""
+Rate limiter a token bucket condiviso da tutte le campagne.
+
+Ogni percorso che scarica pagine da Subito.it (SubitoScraper.search,
+_get_real_urls, la simulazione dell'adapter e la Market Research) preleva un
+token prima della richiesta. Il bucket è unico per host nel processo e,
+opzionalmente, condiviso tra processi tramite un file SQLite (token, tasso
+AIMD corrente e pause da Retry-After): il tasso
+complessivo resta entro il limite configurato qualunque sia il numero di
+campagne attive, mentre una singola ricerca può sfruttare il burst.
+
+Configurazione (variabili d'ambiente o configure_rate_limiter):
+    SNIPEDEAL_RATE_LIMIT      richieste al secondo per host iniziali (default 1.0)
+    SNIPEDEAL_RATE_BURST      richieste consecutive consentite senza attesa (default 5)
+    SNIPEDEAL_RATE_MIN        tasso minimo dopo i rallentamenti (default 0.1)
+    SNIPEDEAL_RATE_MAX        tasso massimo raggiungibile (default 2.0)
+    SNIPEDEAL_RATE_LIMIT_DB   file SQLite per condividere il bucket tra processi
+
+Il tasso di ogni host è regolato da un controllo AIMD: cresce di poco a ogni
+risposta sana e viene dimezzato per tutte le campagne su 429, 503 o pagine
+di blocco, sospendendo le richieste per il tempo indicato da Retry-After.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from page_parser import is_block_page
+
+logger = logging.getLogger("SnipeDeal.RateLimiter")
+
+DEFAULT_RATE = 1.0
+DEFAULT_BURST = 5
+
+# Finestra (secondi) su cui viene calcolato il tasso effettivo
+METRICS_WINDOW = 60.0
+
+DEFAULT_HOST = "www.subito.it"
+
+# Parametri del controllo AIMD
+DEFAULT_MIN_RATE = 0.1
+DEFAULT_MAX_RATE = 2.0
+AIMD_INCREASE = 0.05          # richieste/s aggiunte per ogni risposta sana
+AIMD_DECREASE = 0.5           # fattore di riduzione su rallentamento
+DEFAULT_BACKOFF = 5.0         # pausa (secondi) se il server non invia Retry-After
+MAX_BACKOFF = 300.0           # pausa massima accettata da Retry-After
+
+# Codici HTTP con cui il server chiede di rallentare
+THROTTLE_STATUS_CODES = (429, 503)
+
+
+class TokenBucket:
+    """
+    Token bucket thread-safe nel processo corrente.
+
+    Le richieste prenotano un token e ricevono il tempo di attesa: i token
+    possono andare in negativo, così le prenotazioni concorrenti vengono
+    servite in ordine di arrivo senza busy waiting.
+    """
+
+    backend = "memory"
+
+    def __init__(self, name, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self.name = name
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        # Fine della pausa imposta dal server (es. Retry-After), in tempo monotonic
+        self._blocked_until = 0.0
+        # Istanti (monotonic) in cui sono stati concessi i token, per le metriche
+        self._grants = deque()
+        self._acquired = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def configure(self, rate=None, burst=None):
+        """Aggiorna tasso e burst mantenendo i token accumulati"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if rate is not None:
+                self.rate = float(rate)
+            if burst is not None:
+                self.burst = float(burst)
+                self._tokens = min(self._tokens, self.burst)
+
+    def _refill(self, now):
+        # Durante una pausa i token non si accumulano: alla ripresa niente burst
+        start = max(self._updated, self._blocked_until)
+        if now > start:
+            self._tokens = min(self.burst, self._tokens + (now - start) * self.rate)
+        self._updated = max(self._updated, now)
+
+    def _block_wait(self, now):
+        return max(0.0, self._blocked_until - now)
+
+    def _take(self, tokens):
+        """Preleva i token e restituisce l'attesa in secondi (da chiamare con il lock)"""
+        now = time.monotonic()
+        self._refill(now)
+        self._tokens -= tokens
+        token_wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        return self._block_wait(now) + token_wait
+
+    def pause(self, seconds):
+        """
+        Sospende le concessioni per seconds secondi (es. Retry-After del server).
+        Alla ripresa resta al massimo un token, così le richieste ripartono distanziate.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = min(self._tokens, 1.0)
+            self._blocked_until = max(self._blocked_until, now + seconds)
+
+    def paused_for(self):
+        """Secondi rimanenti della pausa in corso (0 se non in pausa)"""
+        with self._lock:
+            return self._block_wait(time.monotonic())
+
+    def reserve(self, tokens=1):
+        """
+        Prenota tokens token
+
+        Returns:
+            float: Secondi da attendere prima di usare i token
+        """
+        with self._lock:
+            wait = self._take(tokens)
+            self._record(wait)
+            return wait
+
+    def _record(self, wait):
+        now = time.monotonic()
+        self._grants.append(now + wait)
+        self._acquired += 1
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+        while self._grants and self._grants[0] < now - METRICS_WINDOW:
+            self._grants.popleft()
+
+    def acquire(self, tokens=1):
+        """Attende (bloccando il thread) la disponibilità dei token"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens=1):
+        """Attende la disponibilità dei token senza bloccare il loop asyncio"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def available_tokens(self):
+        """Token disponibili in questo momento (negativi se ci sono richieste in coda)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+    def metrics(self):
+        """
+        Metriche di utilizzo del bucket
+
+        Returns:
+            dict: tasso configurato ed effettivo (ultimo minuto), utilizzo in percentuale,
+                  token disponibili, richieste in coda e tempi di attesa
+        """
+        tokens = self.available_tokens()
+        with self._lock:
+            now = time.monotonic()
+            while self._grants and self._grants[0] < now - METRICS_WINDOW:
+                self._grants.popleft()
+            granted = sum(1 for grant in self._grants if grant <= now)
+            queued = len(self._grants) - granted
+            oldest = self._grants[0] if self._grants else now
+            window = min(METRICS_WINDOW, max(now - oldest, 1.0))
+            current_rate = granted / window
+            return {
+                'name': self.name,
+                'backend': self.backend,
+                'rate': self.rate,
+                'burst': self.burst,
+                'current_rate': round(current_rate, 3),
+                'utilization_pct': round(min(100.0, current_rate / self.rate * 100), 1) if self.rate else 0.0,
+                'available_tokens': round(tokens, 2),
+                'paused_for': round(self._block_wait(now), 1),
+                'queued': queued,
+                'acquired': self._acquired,
+                'avg_wait': round(self._total_wait / self._acquired, 3) if self._acquired else 0.0,
+                'max_wait': round(self._max_wait, 3),
+            }
+
+
+class SQLiteTokenBucket(TokenBucket):
+    """
+    Token bucket con stato su SQLite, condiviso da tutti i processi che usano
+    lo stesso file: token, tasso corrente (regolato dal controllo AIMD di
+    qualunque processo) e pausa da Retry-After. Le metriche di attesa restano
+    locali al processo.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, name, db_path, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        super().__init__(name, rate, burst)
+        self.db_path = db_path
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_buckets ("
+                "name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, "
+                "rate REAL, blocked_until REAL)"
+            )
+            # File creati prima della condivisione di tasso e pausa
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(token_buckets)")}
+            for column in ("rate", "blocked_until"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE token_buckets ADD COLUMN {column} REAL")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _shared_update(self, update):
+        """
+        Aggiorna lo stato condiviso in una transazione esclusiva
+
+        Args:
+            update: Funzione (state, now) -> risultato che modifica il dizionario
+                    state (tokens, updated, rate, blocked_until), già ricaricato
+                    fino a now con il tasso condiviso
+
+        Returns:
+            tuple: (risultato di update, stato salvato)
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Il tempo di sistema è condiviso tra processi, a differenza di monotonic
+            now = time.time()
+            row = conn.execute(
+                "SELECT tokens, updated, rate, blocked_until FROM token_buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            if row is None:
+                state = {'tokens': self.burst, 'updated': now, 'rate': self.rate, 'blocked_until': 0.0}
+            else:
+                state = {'tokens': row[0], 'updated': row[1], 'rate': row[2] or self.rate, 'blocked_until': row[3] or 0.0}
+                # Durante una pausa i token non si accumulano
+                start = max(state['updated'], state['blocked_until'])
+                if now > start:
+                    state['tokens'] = min(self.burst, state['tokens'] + (now - start) * state['rate'])
+                state['updated'] = max(state['updated'], now)
+            result = update(state, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO token_buckets (name, tokens, updated, rate, blocked_until) VALUES (?, ?, ?, ?, ?)",
+                (self.name, state['tokens'], state['updated'], state['rate'], state['blocked_until']),
+            )
+            conn.execute("COMMIT")
+            return result, state
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _adopt(self, state, now):
+        """Allinea tasso e pausa locali allo stato condiviso (da chiamare con il lock)"""
+        self.rate = state['rate']
+        remaining = state['blocked_until'] - now
+        if remaining > 0:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + remaining)
+
+    def configure(self, rate=None, burst=None):
+        super().configure(rate, burst)
+        if rate is None:
+            return
+
+        def set_rate(state, now):
+            state['rate'] = float(rate)
+        try:
+            self._shared_update(set_rate)
+        except sqlite3.Error as e:
+            logger.warning(f"Rate limiter SQLite non disponibile ({str(e)}), tasso aggiornato solo nel processo")
+
+    def pause(self, seconds):
+        super().pause(seconds)
+
+        def set_pause(state, now):
+            state['tokens'] = min(state['tokens'], 1.0)
+            state['blocked_until'] = max(state['blocked_until'], now + seconds)
+        try:
+            self._shared_update(set_pause)
+        except sqlite3.Error as e:
+            logger.warning(f"Rate limiter SQLite non disponibile ({str(e)}), pausa solo nel processo")
+
+    def reserve(self, tokens=1):
+        def take(state, now):
+            state['tokens'] -= tokens
+            return now
+        try:
+            now, state = self._shared_update(take)
+        except sqlite3.Error as e:
+            # Il limite nel processo corrente resta valido anche se il file non è utilizzabile
+            logger.warning(f"Rate limiter SQLite non disponibile ({str(e)}), uso il bucket locale")
+            return super().reserve(tokens)
+
+        available = state['tokens']
+        with self._lock:
+            self._adopt(state, now)
+            wait = -available / self.rate if available < 0 else 0.0
+            wait += self._block_wait(time.monotonic())
+            self._tokens = available
+            self._updated = max(self._updated, time.monotonic())
+            self._record(wait)
+        return wait
+
+
+class AIMDController:
+    """
+    Controllo di congestione additive-increase / multiplicative-decrease sul
+    token bucket di un host. Il bucket è condiviso da tutte le campagne, quindi
+    un rallentamento rilevato da una campagna frena anche tutte le altre.
+    """
+
+    def __init__(self, bucket, min_rate=DEFAULT_MIN_RATE, max_rate=DEFAULT_MAX_RATE,
+                 increase=AIMD_INCREASE, decrease=AIMD_DECREASE):
+        self.bucket = bucket
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, min_rate, bucket.rate)
+        self.increase = increase
+        self.decrease = decrease
+        self._lock = threading.Lock()
+        self._last_decrease = 0.0
+        self._congestion_events = 0
+        self._last_reason = None
+
+    def record_success(self):
+        """Risposta sana: aumenta il tasso di una quantità fissa"""
+        with self._lock:
+            rate = min(self.max_rate, self.bucket.rate + self.increase)
+            if rate != self.bucket.rate:
+                self.bucket.configure(rate=rate)
+
+    def record_congestion(self, retry_after=None, reason=None):
+        """
+        Il server chiede di rallentare: riduce il tasso e sospende le richieste
+
+        Args:
+            retry_after: Secondi indicati dal server (None = pausa di default)
+            reason: Descrizione del segnale (per log e metriche)
+        """
+        pause = min(MAX_BACKOFF, retry_after) if retry_after is not None else DEFAULT_BACKOFF
+        with self._lock:
+            now = time.monotonic()
+            self._congestion_events += 1
+            self._last_reason = reason
+            # Una sola riduzione per "giro": più risposte 429 della stessa raffica
+            # non devono azzerare il tasso
+            if now - self._last_decrease >= max(1.0, 1.0 / self.bucket.rate):
+                self._last_decrease = now
+                old_rate = self.bucket.rate
+                self.bucket.configure(rate=max(self.min_rate, old_rate * self.decrease))
+                logger.warning(f"Rallentamento da {self.bucket.name} ({reason}): tasso {old_rate:.2f} -> {self.bucket.rate:.2f} richieste/s, pausa {pause:.0f}s")
+        self.bucket.pause(pause)
+
+    def metrics(self):
+        """Stato del controllo: tasso corrente, limiti ed eventi di rallentamento"""
+        with self._lock:
+            return {
+                'rate': round(self.bucket.rate, 3),
+                'min_rate': self.min_rate,
+                'max_rate': self.max_rate,
+                'congestion_events': self._congestion_events,
+                'last_reason': self._last_reason,
+                'paused_for': round(self.bucket.paused_for(), 1),
+            }
+
+
+def parse_retry_after(value):
+    """
+    Interpreta l'header Retry-After (secondi oppure data HTTP)
+
+    Returns:
+        float | None: Secondi di attesa, None se l'header manca o non è valido
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def congestion_reason(response):
+    """
+    Indica se la risposta è un segnale di rallentamento del server
+
+    Returns:
+        str | None: Motivo (es. "HTTP 429", "pagina di blocco") oppure None
+    """
+    if response.status_code in THROTTLE_STATUS_CODES:
+        return f"HTTP {response.status_code}"
+    # Il testo di captcha e WAF si cerca solo nelle pagine HTML: il JSON della route
+    # dati contiene titoli e descrizioni degli annunci, che possono citarlo
+    content_type = response.headers.get("Content-Type", "").lower()
+    if response.status_code == 403 or not content_type or "html" in content_type:
+        if is_block_page(response.status_code, response.content):
+            return "pagina di blocco"
+    return None
+
+
+def limiter_key(host, exit_label=None):
+    """
+    Nome del rate limiter per le richieste verso host: il sito limita per IP,
+    quindi ogni uscita del pool di proxy ha un proprio limiter e controllo AIMD
+    """
+    host = host or DEFAULT_HOST
+    return f"{host} via {exit_label}" if exit_label else host
+
+
+def observe_response(url, response, key=None):
+    """
+    Aggiorna il controllo AIMD dell'host (o del limiter key) con l'esito di una richiesta
+
+    Returns:
+        str | None: Il motivo del rallentamento, None se la risposta è sana
+    """
+    controller = get_congestion_controller(key or urlsplit(url).netloc or DEFAULT_HOST)
+    reason = congestion_reason(response)
+    if reason:
+        controller.record_congestion(parse_retry_after(response.headers.get("Retry-After")), reason)
+    elif response.status_code < 500:
+        controller.record_success()
+    return reason
+
+
+def observe_failure(url, error, key=None):
+    """Errore di rete (timeout, connessione rifiutata): trattato come rallentamento senza Retry-After"""
+    get_congestion_controller(key or urlsplit(url).netloc or DEFAULT_HOST).record_congestion(None, type(error).__name__)
+
+
+_limiters = {}
+_controllers = {}
+_limiters_lock = threading.Lock()
+_config = {
+    'rate': float(os.environ.get("SNIPEDEAL_RATE_LIMIT", DEFAULT_RATE)),
+    'burst': float(os.environ.get("SNIPEDEAL_RATE_BURST", DEFAULT_BURST)),
+    'min_rate': float(os.environ.get("SNIPEDEAL_RATE_MIN", DEFAULT_MIN_RATE)),
+    'max_rate': float(os.environ.get("SNIPEDEAL_RATE_MAX", DEFAULT_MAX_RATE)),
+    'db_path': os.environ.get("SNIPEDEAL_RATE_LIMIT_DB") or None,
+}
+
+
+def configure_rate_limiter(rate=None, burst=None, db_path=None, min_rate=None, max_rate=None):
+    """
+    Configura tasso e burst dei rate limiter (anche di quelli già creati) e i
+    limiti del controllo AIMD. Con db_path i bucket creati da qui in avanti
+    sono condivisi tra processi.
+    """
+    with _limiters_lock:
+        if min_rate is not None:
+            _config['min_rate'] = float(min_rate)
+        if max_rate is not None:
+            _config['max_rate'] = float(max_rate)
+        for controller in _controllers.values():
+            controller.min_rate = _config['min_rate']
+            controller.max_rate = max(_config['max_rate'], _config['min_rate'])
+        if rate is not None:
+            _config['rate'] = float(rate)
+        if burst is not None:
+            _config['burst'] = float(burst)
+        if db_path is not None:
+            _config['db_path'] = db_path or None
+            _limiters.clear()
+            _controllers.clear()
+        limiters = list(_limiters.values())
+    for limiter in limiters:
+        limiter.configure(rate, burst)
+
+
+def get_rate_limiter(host=DEFAULT_HOST):
+    """Restituisce il rate limiter condiviso per l'host indicato"""
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            if _config['db_path']:
+                limiter = SQLiteTokenBucket(host, _config['db_path'], _config['rate'], _config['burst'])
+            else:
+                limiter = TokenBucket(host, _config['rate'], _config['burst'])
+            _limiters[host] = limiter
+            logger.info(f"Rate limiter per {host}: {limiter.rate} richieste/s, burst {limiter.burst:g} ({limiter.backend})")
+        return limiter
+
+
+def get_congestion_controller(host=DEFAULT_HOST):
+    """Restituisce il controllo AIMD condiviso per l'host indicato"""
+    limiter = get_rate_limiter(host)
+    with _limiters_lock:
+        controller = _controllers.get(host)
+        if controller is None or controller.bucket is not limiter:
+            controller = AIMDController(limiter, _config['min_rate'], _config['max_rate'])
+            _controllers[host] = controller
+        return controller
+
+
+def get_url_rate_limiter(url):
+    """Restituisce il rate limiter dell'host di url"""
+    return get_rate_limiter(urlsplit(url).netloc or DEFAULT_HOST)
+
+
+def acquire_for_url(url):
+    """Attende (bloccando il thread) un token per una richiesta verso url"""
+    return get_url_rate_limiter(url).acquire()
+
+
+def rate_limiter_metrics():
+    """Metriche di utilizzo di tutti i rate limiter attivi, per host (incluso il controllo AIMD)"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    metrics = {}
+    for limiter in limiters:
+        metrics[limiter.name] = limiter.metrics()
+        metrics[limiter.name]['congestion'] = get_congestion_controller(limiter.name).metrics()
+    return metrics
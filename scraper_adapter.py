@@ -7,10 +7,17 @@ import threading
 import time
 import logging
 import traceback
+import uuid
 
 # Configura il logging
 logger = logging.getLogger("SnipeDeal.Scraper")
 
+# Watchdog delle esecuzioni: una ricerca che supera la scadenza dello scraper più
+# il margine (salvataggio nel DB, notifiche) viene considerata bloccata e interrotta
+DEFAULT_RUN_DEADLINE = float(os.environ.get("SNIPEDEAL_RUN_DEADLINE", 300))
+RUN_WATCHDOG_GRACE = 60.0
+RUN_WATCHDOG_INTERVAL = 10.0
+
 # Importa il nuovo scraper dalla root
 try:
     from subito_scraper import SubitoScraper
@@ -66,6 +73,8 @@ except ImportError as e:
 
 # Importa i modelli di database
 from database_schema import Keyword, Risultato, Statistiche, SessionLocal
+from search_query import split_regions
+from ad_record import Ad
 
 # Funzione per leggere le impostazioni Telegram direttamente dal file .env
 def get_telegram_config():
@@ -111,7 +120,38 @@ class ScraperAdapter:
         self.running_tasks = {}  # Dizionario per tenere traccia dei thread in esecuzione per ogni keyword
         self.scraper_logs = []   # Lista per memorizzare i log specifici dello scraper
         self.cronjob_logs = []   # Lista per memorizzare i log dei cronjob
+        self.active_runs = {}    # Ricerche in corso per keyword, controllate dal watchdog
+        self.run_metrics = {}    # Metriche delle esecuzioni per keyword (durata, blocchi)
+        self._runs_lock = threading.Lock()
+        self._watchdog = None
+        
+    def _price_pushdown(self, keyword_record):
+        """
+        Fascia di prezzo da passare al sito per la campagna. Le campagne attive con la
+        stessa keyword usano la fascia che le copre tutte, così scaricano le stesse
+        pagine (condivise, vedi fetch_dedup); ciascuna applica poi il proprio filtro
+        prezzo sui risultati.
         
+        Returns:
+            True (fascia della campagna) o tuple (min, max) comune, con None = nessun limite
+        """
+        session = SessionLocal()
+        try:
+            keyword = " ".join(keyword_record.keyword.split()).lower()
+            campaigns = [kw for kw in session.query(Keyword).filter(Keyword.attivo == True).all()
+                         if " ".join(kw.keyword.split()).lower() == keyword]
+        finally:
+            session.close()
+        if all(kw.id == keyword_record.id for kw in campaigns):
+            return True
+        campaigns.append(keyword_record)
+        # Una campagna senza limite di prezzo non consente alcun filtro comune
+        if not all(kw.applica_limite_prezzo for kw in campaigns):
+            return (None, None)
+        min_price = min(kw.limite_prezzo_min or 0 for kw in campaigns) or None
+        max_price = None if not all(kw.limite_prezzo for kw in campaigns) else max(kw.limite_prezzo for kw in campaigns)
+        return (min_price, max_price)
+    
     def _initialize_scraper(self, keyword_record=None):
         """
         Inizializza un'istanza dello scraper con i parametri della keyword
@@ -132,12 +172,17 @@ class ScraperAdapter:
             
             # Se abbiamo un record di keyword, aggiungi i parametri specifici
             if keyword_record:
+                _, invalid_regions = split_regions(getattr(keyword_record, 'regioni', None))
+                if invalid_regions:
+                    self._add_log("WARNING", f"Campagna {keyword_record.id}: regioni non valide ignorate: {', '.join(invalid_regions)}")
                 params.update({
                     "keywords": [keyword_record.keyword],
                     "prezzo_max": keyword_record.limite_prezzo if keyword_record.applica_limite_prezzo else None,
                     "prezzo_min": keyword_record.limite_prezzo_min if keyword_record.applica_limite_prezzo else None,
                     "apply_price_limit": keyword_record.applica_limite_prezzo,
                     "max_pages": keyword_record.limite_pagine,
+                    "regions": getattr(keyword_record, 'regioni', None),
+                    "price_pushdown": self._price_pushdown(keyword_record),
                     "keyword_id": keyword_record.id,
                     "db_session": SessionLocal()  # Passa una sessione del database
                 })
@@ -245,6 +290,7 @@ class ScraperAdapter:
         Esegue una ricerca per la keyword specificata e salva i risultati nel database
         """
         session = SessionLocal()
+        run_token = None
         try:
             # Ottieni i dettagli della keyword dal database
             keyword_record = session.query(Keyword).filter(Keyword.id == keyword_id).first()
@@ -254,6 +300,8 @@ class ScraperAdapter:
             
             # Inizializza lo scraper con i parametri della keyword
             scraper_initialized = self._initialize_scraper(keyword_record)
+            scraper = self.scraper
+            run_token = self._begin_run(keyword_id, scraper if scraper_initialized else None)
             
             self._add_log("INFO", f"Avvio ricerca per keyword: {keyword_record.keyword}")
             self._add_cronjob_log("INFO", f"Avvio ricerca per keyword: {keyword_record.keyword}", keyword_id)
@@ -263,7 +311,8 @@ class ScraperAdapter:
                 "keyword": keyword_record.keyword,
                 "prezzo_max": keyword_record.limite_prezzo if keyword_record.applica_limite_prezzo else None,
                 "prezzo_min": keyword_record.limite_prezzo_min if keyword_record.applica_limite_prezzo else None,
-                "max_pages": keyword_record.limite_pagine
+                "max_pages": keyword_record.limite_pagine,
+                "regioni": getattr(keyword_record, 'regioni', None)
             }
             
             self._add_log("INFO", f"Parametri di ricerca: {json.dumps(search_params)}")
@@ -288,7 +337,30 @@ class ScraperAdapter:
                         self._add_log("INFO", f"  - apply_price_limit: {self.scraper.apply_price_limit}")
                         
                         # Esegui la ricerca
-                        ads = self.scraper.search_ads(keyword_record.keyword)
+                        ads = scraper.search_ads(keyword_record.keyword)
+                        
+                        # Ricerca interrotta (scadenza o watchdog): nessuna simulazione né salvataggio
+                        search_metrics = getattr(scraper, 'last_search_metrics', {})
+                        if 'aborted' in search_metrics or 'deadline_exceeded' in search_metrics:
+                            reason = search_metrics.get('aborted') or f"scadenza superata dopo {search_metrics['deadline_exceeded']}s"
+                            error_msg = f"Ricerca interrotta per '{keyword_record.keyword}': {reason}"
+                            self._add_log("ERROR", error_msg)
+                            self._add_cronjob_log("ERROR", error_msg, keyword_id)
+                            return {"status": "error", "message": error_msg}
+                        
+                        # Prima pagina invariata dal polling precedente: niente simulazione,
+                        # salvataggio, statistiche o notifiche
+                        if getattr(scraper, 'last_search_unchanged', False):
+                            unchanged_msg = f"Nessuna novità per '{keyword_record.keyword}': risultati invariati dal polling precedente"
+                            self._add_log("INFO", unchanged_msg)
+                            self._add_cronjob_log("INFO", unchanged_msg, keyword_id)
+                            return {
+                                "status": "success",
+                                "message": unchanged_msg,
+                                "results_count": 0,
+                                "new_results_count": 0,
+                                "unchanged": True
+                            }
                         self._add_log("INFO", f"Ricerca completata, trovati {len(ads)} annunci")
                     else:
                         # Fallback alla versione legacy
@@ -393,8 +465,115 @@ class ScraperAdapter:
             logger.error(traceback.format_exc())
             return {"status": "error", "message": error_msg}
         finally:
+            self._end_run(keyword_id, run_token)
             session.close()
     
+    def _run_budget(self, scraper):
+        """Durata massima di una ricerca per il watchdog (None = nessun limite)"""
+        deadline = getattr(scraper, 'run_deadline', DEFAULT_RUN_DEADLINE)
+        return deadline + RUN_WATCHDOG_GRACE if deadline else None
+    
+    def _begin_run(self, keyword_id, scraper):
+        """
+        Registra l'inizio di una ricerca e avvia il watchdog se necessario.
+        Una ricerca precedente della stessa keyword ancora in corso (bloccata e
+        sostituita) non viene più seguita dal watchdog
+        
+        Returns:
+            str: Il token della ricerca, da passare a _end_run
+        """
+        token = uuid.uuid4().hex
+        with self._runs_lock:
+            self.active_runs[keyword_id] = {
+                "token": token,
+                "started": time.monotonic(),
+                "scraper": scraper,
+                "budget": self._run_budget(scraper),
+                "stalled": False,
+            }
+            if self._watchdog is None or not self._watchdog.is_alive():
+                self._watchdog = threading.Thread(target=self._watchdog_loop, name="SnipeDeal-watchdog", daemon=True)
+                self._watchdog.start()
+        return token
+    
+    def _end_run(self, keyword_id, token):
+        """
+        Registra la fine di una ricerca nelle metriche della keyword. Una ricerca
+        sostituita che termina in ritardo non tocca quella in corso
+        """
+        with self._runs_lock:
+            run = self.active_runs.get(keyword_id)
+            if run is None or run["token"] != token:
+                return
+            del self.active_runs[keyword_id]
+            duration = round(time.monotonic() - run["started"], 1)
+            metrics = self.run_metrics.setdefault(keyword_id, {})
+            metrics["runs"] = metrics.get("runs", 0) + 1
+            metrics["last_duration"] = duration
+        if run["stalled"]:
+            self._add_cronjob_log("WARNING", f"Ricerca bloccata terminata dopo {duration:.0f}s", keyword_id)
+    
+    def _watchdog_loop(self):
+        while True:
+            time.sleep(RUN_WATCHDOG_INTERVAL)
+            try:
+                self.check_stalled_runs()
+            except Exception as e:
+                logger.error(f"Errore nel watchdog delle esecuzioni: {str(e)}")
+    
+    def check_stalled_runs(self) -> List[int]:
+        """
+        Watchdog: interrompe le ricerche che superano la durata massima e registra
+        il blocco nelle metriche della keyword
+        
+        Returns:
+            List[int]: ID delle keyword le cui ricerche sono state appena interrotte
+        """
+        now = time.monotonic()
+        stalled = []
+        with self._runs_lock:
+            for keyword_id, run in self.active_runs.items():
+                if run["stalled"] or run["budget"] is None or now - run["started"] <= run["budget"]:
+                    continue
+                run["stalled"] = True
+                metrics = self.run_metrics.setdefault(keyword_id, {})
+                metrics["stalls"] = metrics.get("stalls", 0) + 1
+                metrics["last_stall"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                stalled.append((keyword_id, run))
+        
+        for keyword_id, run in stalled:
+            elapsed = now - run["started"]
+            error_msg = f"Ricerca bloccata da {elapsed:.0f}s (limite {run['budget']:.0f}s): interruzione dal watchdog"
+            self._add_log("ERROR", f"Keyword {keyword_id}: {error_msg}")
+            self._add_cronjob_log("ERROR", error_msg, keyword_id)
+            logger.error(f"Keyword {keyword_id}: {error_msg}")
+            abort = getattr(run["scraper"], "abort", None)
+            if abort is not None:
+                abort(f"watchdog: ricerca oltre {run['budget']:.0f}s")
+        return [keyword_id for keyword_id, _ in stalled]
+    
+    def is_run_stalled(self, keyword_id: int) -> bool:
+        """
+        True se la ricerca in corso per la keyword è bloccata: segnalata dal watchdog
+        o oltre la durata massima. Solo lettura: l'interruzione spetta al watchdog
+        """
+        now = time.monotonic()
+        with self._runs_lock:
+            run = self.active_runs.get(keyword_id)
+            if run is None:
+                return False
+            return run["stalled"] or (run["budget"] is not None and now - run["started"] > run["budget"])
+    
+    def get_run_metrics(self, keyword_id: Optional[int] = None) -> Dict:
+        """
+        Metriche delle esecuzioni (runs, last_duration, stalls, last_stall),
+        per una keyword o per tutte
+        """
+        with self._runs_lock:
+            if keyword_id is not None:
+                return dict(self.run_metrics.get(keyword_id, {}))
+            return {kid: dict(metrics) for kid, metrics in self.run_metrics.items()}
+    
     def _simulate_search_results(self, params: Dict) -> List[Dict]:
         """
         Simula i risultati della ricerca utilizzando dati reali da Subito.it
@@ -404,8 +583,11 @@ class ScraperAdapter:
         
         # Importazioni necessarie
         import random
-        import requests
         from bs4 import BeautifulSoup
+        from fetch_engine import AsyncFetchEngine, run_coroutine
+        from http_client import get_http_session
+        from page_parser import decode_html
+        from proxy_pool import get_proxy_pool
         
         # Genera URL di ricerca per la keyword
         base_search_url = "https://www.subito.it/annunci-italia/vendita/usato/"
@@ -434,16 +616,18 @@ class ScraperAdapter:
         }
         
         try:
-            # Facciamo una richiesta HTTP per ottenere la pagina di risultati
-            response = requests.get(search_url, headers=headers, timeout=10)
+            # Facciamo una richiesta HTTP per ottenere la pagina di risultati,
+            # rispettando rate limiter e pool di proxy condivisi con le campagne
+            fetch_engine = AsyncFetchEngine(get_http_session(), proxy_pool=get_proxy_pool())
+            response = run_coroutine(fetch_engine.fetch(search_url, headers=headers, timeout=10))
             real_urls = []
             real_titles = []
             real_prices = []
             real_locations = []
             
             if response.status_code == 200:
-                # Parsing della pagina HTML
-                soup = BeautifulSoup(response.text, 'html.parser')
+                # Parsing della sola parte HTML con le card, decodificata in UTF-8 dai bytes
+                soup = BeautifulSoup(decode_html(response.content, card_region=True), 'html.parser')
                 
                 # Trova tutti gli annunci nella pagina
                 listing_items = soup.select('div.items__item')
@@ -639,8 +823,7 @@ class ScraperAdapter:
                 # Salva i dati raw come JSON
                 raw_data_json = None
                 try:
-                    import json
-                    raw_data_json = json.dumps(ad, ensure_ascii=False)
+                    raw_data_json = json.dumps(ad.to_dict() if isinstance(ad, Ad) else ad, ensure_ascii=False)
                 except Exception:
                     raw_data_json = str(ad)
                 
@@ -693,6 +876,10 @@ class ScraperAdapter:
         """
         Normalizza le chiavi del dizionario dell'annuncio per adattarle al modello del database
         """
+        # I record Ad espongono già le chiavi del modello (anche 'data_annuncio' come alias)
+        if isinstance(ad, Ad):
+            return ad
+        
         normalized = {}
         
         # Mappatura delle chiavi tra lo scraper reale e l'adapter
@@ -924,12 +1111,18 @@ class ScraperAdapter:
         """
         Avvia un job in background per una keyword specifica
         """
-        if keyword_id in self.running_tasks and self.running_tasks[keyword_id].is_alive():
+        if self.is_job_running(keyword_id):
             warning_msg = f"Task già in esecuzione per la keyword {keyword_id}"
             self._add_log("WARNING", warning_msg)
             self._add_cronjob_log("WARNING", warning_msg, keyword_id)
             return {"status": "error", "message": "Task già in esecuzione per questa keyword"}
         
+        if keyword_id in self.running_tasks and self.running_tasks[keyword_id].is_alive():
+            # Thread bloccato: viene sostituito e termina appena si sblocca
+            warning_msg = f"Il job della keyword {keyword_id} è bloccato: avvio di un nuovo job"
+            self._add_log("WARNING", warning_msg)
+            self._add_cronjob_log("WARNING", warning_msg, keyword_id)
+        
         def background_task(keyword_id):
             session = SessionLocal()
             try:
@@ -944,7 +1137,8 @@ class ScraperAdapter:
                 self._add_log("INFO", start_msg)
                 self._add_cronjob_log("INFO", start_msg, keyword_id)
                 
-                while keyword.attivo:
+                # Il ciclo termina anche se il job è stato sostituito da uno nuovo
+                while keyword.attivo and self.running_tasks.get(keyword_id) is threading.current_thread():
                     # Log dell'esecuzione pianificata
                     exec_msg = f"Esecuzione pianificata per keyword: {keyword.keyword} (ID: {keyword_id})"
                     self._add_log("INFO", exec_msg)
@@ -967,8 +1161,9 @@ class ScraperAdapter:
                         self._add_cronjob_log("INFO", success_msg, keyword_id)
                     
                     # Invia notifiche per i nuovi risultati non notificati
+                    # (nessuna query se i risultati sono invariati dal polling precedente)
                     try:
-                        nuovi_risultati = session.query(Risultato).filter(
+                        nuovi_risultati = [] if result.get("unchanged") else session.query(Risultato).filter(
                             Risultato.keyword_id == keyword_id,
                             Risultato.notificato == False
                         ).all()
@@ -1012,13 +1207,11 @@ class ScraperAdapter:
                 self._add_cronjob_log("INFO", end_msg, keyword_id)
                 session.close()
         
-        # Avvia un nuovo thread
+        # Avvia un nuovo thread, salvandone il riferimento prima dell'avvio
         thread = threading.Thread(target=background_task, args=(keyword_id,))
         thread.daemon = True  # Il thread si chiuderà quando l'applicazione principale si chiude
-        thread.start()
-        
-        # Salva il riferimento al thread
         self.running_tasks[keyword_id] = thread
+        thread.start()
         
         success_msg = f"Job in background avviato con successo per keyword ID {keyword_id}"
         self._add_log("INFO", success_msg)
@@ -1086,7 +1279,8 @@ class ScraperAdapter:
 
     def is_job_running(self, keyword_id: int) -> bool:
         """
-        Verifica se un job in background è attivo per una keyword specifica
+        Verifica se un job in background è attivo per una keyword specifica.
+        Un job la cui ricerca ha superato la durata massima è bloccato, non attivo.
         
         Args:
             keyword_id: ID della keyword da verificare
@@ -1098,7 +1292,7 @@ class ScraperAdapter:
             return False
             
         thread = self.running_tasks[keyword_id]
-        return thread.is_alive()
+        return thread.is_alive() and not self.is_run_stalled(keyword_id)
 
     # Classe di fallback per simulare i risultati dello scraper
     class FallbackScraper:
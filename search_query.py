@@ -0,0 +1,134 @@
+"""
+Costruzione degli URL di ricerca di Subito.it dalla configurazione di una ricerca.
+
+I filtri che il sito supporta (fascia di prezzo, ricerca nel solo titolo,
+categoria, ordinamento) vengono passati come parametri dell'URL, così le pagine
+scaricate contengono solo annunci pertinenti e il numero di pagine si riduce.
+Il filtro lato server non sostituisce il controllo locale: i risultati vanno
+comunque ricontrollati con SearchQuery.accepts_price.
+"""
+import logging
+import math
+from urllib.parse import quote, urlencode
+
+logger = logging.getLogger("SnipeDeal.SearchQuery")
+
+SEARCH_HOST = "https://www.subito.it"
+
+# Percorso di default: tutta Italia, tutte le categorie
+DEFAULT_REGION = "italia"
+DEFAULT_CATEGORY = "usato"
+
+# Regioni nel percorso dell'URL (/annunci-<regione>/...), per le ricerche suddivise per regione
+REGIONS = (
+    "abruzzo", "basilicata", "calabria", "campania", "emilia-romagna",
+    "friuli-venezia-giulia", "lazio", "liguria", "lombardia", "marche",
+    "molise", "piemonte", "puglia", "sardegna", "sicilia", "toscana",
+    "trentino-alto-adige", "umbria", "valle-d-aosta", "veneto",
+)
+
+# Ordinamento dei risultati: i più recenti prima (necessario per l'arresto anticipato)
+SORT_ORDER = "datedesc"
+SORT_ORDERS = ("datedesc", "relevance", "priceasc", "pricedesc")
+
+
+def split_regions(value):
+    """
+    Regioni di una ricerca da una lista o da una stringa separata da virgole
+    (es. "lombardia, piemonte"), senza duplicati e nell'ordine indicato
+
+    Returns:
+        tuple: (regioni valide, vuota per tutta Italia; valori non presenti in REGIONS)
+    """
+    if not value:
+        return [], []
+    if isinstance(value, str):
+        value = value.split(",")
+    regions = []
+    invalid = []
+    for region in value:
+        region = str(region).strip().lower().replace(" ", "-")
+        if not region or region in regions or region in invalid:
+            continue
+        (regions if region in REGIONS else invalid).append(region)
+    return regions, invalid
+
+
+def parse_regions(value):
+    """
+    Regioni valide di una ricerca (vedi split_regions): i valori non validi
+    vengono segnalati nel log e ignorati
+
+    Returns:
+        list: Le regioni, vuota per tutta Italia
+    """
+    regions, invalid = split_regions(value)
+    if invalid:
+        logger.warning(f"Regioni non valide ignorate: {', '.join(invalid)} (ammesse: {', '.join(REGIONS)})"
+                       f"{'' if regions else ': ricerca in tutta Italia'}")
+    return regions
+
+
+class SearchQuery:
+    """
+    Parametri di una ricerca su Subito.it
+
+    Args:
+        keyword: Testo da cercare
+        min_price: Prezzo minimo (None o 0 = nessun minimo)
+        max_price: Prezzo massimo (None = nessun massimo)
+        title_only: Cerca solo nel titolo degli annunci (qso)
+        category: Categoria nel percorso dell'URL, es. "videogiochi" (None = tutte)
+        region: Regione nel percorso dell'URL, es. "lombardia" (None = tutta Italia)
+        order: Ordinamento dei risultati, uno di SORT_ORDERS (None = ordinamento predefinito del sito)
+    """
+
+    def __init__(self, keyword, min_price=None, max_price=None, title_only=False, category=None, region=None, order=SORT_ORDER):
+        if order is not None and order not in SORT_ORDERS:
+            raise ValueError(f"Ordinamento non valido: {order!r} (ammessi: {', '.join(SORT_ORDERS)})")
+        self.keyword = " ".join(str(keyword).split())
+        self.min_price = min_price or None
+        self.max_price = max_price
+        self.title_only = title_only
+        self.category = (category or DEFAULT_CATEGORY).strip("/")
+        self.region = (region or DEFAULT_REGION).strip("/")
+        self.order = order
+
+    @property
+    def path(self):
+        """Percorso della pagina dei risultati, es. /annunci-italia/vendita/usato/"""
+        return f"/annunci-{self.region}/vendita/{self.category}/"
+
+    def params(self, page=1):
+        """
+        Parametri dell'URL. I limiti di prezzo vengono arrotondati verso l'esterno
+        (il sito accetta solo euro interi): il controllo locale li rende esatti.
+        """
+        params = [("q", self.keyword)]
+        if self.title_only:
+            params.append(("qso", "true"))
+        if self.min_price is not None:
+            params.append(("ps", math.floor(self.min_price)))
+        if self.max_price is not None:
+            params.append(("pe", math.ceil(self.max_price)))
+        if self.order is not None:
+            params.append(("order", self.order))
+        params.append(("o", page))
+        return params
+
+    def url(self, page=1):
+        """URL della pagina dei risultati numero page"""
+        return f"{SEARCH_HOST}{self.path}?{urlencode(self.params(page), quote_via=quote)}"
+
+    def accepts_price(self, price):
+        """Controllo locale della fascia di prezzo"""
+        if not isinstance(price, (int, float)):
+            return False
+        if self.min_price is not None and price < self.min_price:
+            return False
+        if self.max_price is not None and price > self.max_price:
+            return False
+        return True
+
+    def __repr__(self):
+        return f"SearchQuery({self.url()!r})"
@@ -4,12 +4,32 @@ import logging
 from typing import List, Dict, Optional
 import time
 import random
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 import os
 from datetime import datetime, timedelta
 import json
 import traceback
+import asyncio
+import contextvars
+import uuid
+
+from ad_record import Ad, decode_date, decode_id, decode_location, decode_price, decode_url
+from page_parser import CARD_FIELDS, decode_html, extract_next_data, get_initial_state, iter_ad_items, listing_page_info, match_cards, parse_page, resolve_parser_backend
+from parse_pool import parse_in_pool, resolve_parse_workers
+from fetch_engine import AsyncFetchEngine, CircuitOpenError, FetchCancelledError, backoff_delay, run_coroutine
+from http_client import get_http_session
+from proxy_pool import get_proxy_pool
+from fetch_dedup import SharedPage, get_fetch_coalescer, normalize_url
+from page_cache import get_page_cache, ids_hash
+from listing_transport import JSON_TRANSPORT, TransportError, listing_transports, report_transport_failure, resolve_transport_mode
+from search_query import SORT_ORDER, SearchQuery, parse_regions
+
+# Durata massima di un'esecuzione (search o run) in secondi, 0 = nessuna scadenza
+RUN_DEADLINE_ENV = "SNIPEDEAL_RUN_DEADLINE"
+DEFAULT_RUN_DEADLINE = 300.0
+
+# Metriche della keyword in elaborazione nel task corrente (run cerca le keyword
+# in task concorrenti): None fuori da run
+_keyword_metrics = contextvars.ContextVar("keyword_metrics", default=None)
 
 class SubitoScraper:
     """
@@ -31,7 +51,20 @@ class SubitoScraper:
                  max_retries=3,
                  proxy=None,
                  keyword_id=None,         # ID della campagna nel DB
-                 db_session=None):        # Sessione database
+                 db_session=None,         # Sessione database
+                 html_parser=None,        # Backend di parsing HTML (None = auto)
+                 json_only=True,          # Salta le card HTML se il JSON contiene già i dati
+                 partial_json=True,       # Decodifica solo la lista annunci dallo stato della pagina
+                 parse_workers=None,      # Processi del pool di parsing (0 = processo corrente, None = da env)
+                 early_stop=True,         # Interrompe la paginazione quando le pagine contengono solo annunci già visti
+                 seen_run_limit=10,       # Annunci già visti consecutivi oltre i quali fermarsi (None = disattivato)
+                 title_only=False,        # Cerca solo nel titolo degli annunci
+                 category=None,           # Categoria nel percorso dell'URL, es. "videogiochi" (None = tutte)
+                 price_pushdown=True,     # Fascia di prezzo passata al sito nell'URL: True = quella della campagna, (min, max) = quella indicata, False = nessuna
+                 stream_pages=True,       # Scarica le pagine in streaming fermandosi dopo __NEXT_DATA__
+                 run_deadline=None,       # Durata massima di un'esecuzione in secondi (None = da env, 0 = nessuna)
+                 transport=None,          # Trasporto delle pagine: "auto" (JSON con ripiego su HTML) o "html" (None = da env)
+                 regions=None):           # Regioni da cercare separatamente, lista o stringa separata da virgole (None = tutta Italia)
         
         # Parametri di configurazione
         self.keywords = keywords or ["ps5"]
@@ -45,6 +78,21 @@ class SubitoScraper:
         self.use_simulation = use_simulation
         self.max_retries = max_retries
         self.proxy = proxy
+        self.html_parser = resolve_parser_backend(html_parser)
+        self.json_only = json_only
+        self.partial_json = partial_json
+        self.parse_workers = resolve_parse_workers(parse_workers)
+        self.early_stop = early_stop
+        self.seen_run_limit = seen_run_limit
+        self.title_only = title_only
+        self.category = category
+        self.price_pushdown = price_pushdown
+        self.stream_pages = stream_pages
+        if run_deadline is None:
+            run_deadline = float(os.environ.get(RUN_DEADLINE_ENV, DEFAULT_RUN_DEADLINE))
+        self.run_deadline = run_deadline or None
+        self.transport_mode = resolve_transport_mode(transport)
+        self.regions = parse_regions(regions)
         
         # Parametri per la gestione DB
         self.keyword_id = keyword_id
@@ -85,34 +133,44 @@ class SubitoScraper:
             file_handler.setFormatter(file_format)
             self.logger.addHandler(file_handler)
         
-        # Configurazione della sessione HTTP
-        self.session = requests.Session()
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
+        # Sessione HTTP condivisa dal processo (per proxy): connessioni keep-alive,
+        # retry e cookie comuni a tutte le ricerche
+        self.session = get_http_session(self.proxy)
+        
+        # Download asincrono delle pagine con la sessione configurata: senza un proxy
+        # esplicito le richieste vengono distribuite sulle uscite del pool di proxy
+        self.fetch_engine = AsyncFetchEngine(
+            self.session,
+            proxy_pool=None if self.proxy else get_proxy_pool(),
+            affinity=self.keyword_id or ",".join(self.keywords)
         )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        self.session.mount("https://", adapter)
-        self.session.mount("http://", adapter)
-        
-        # User-Agent
-        self.session.headers.update({
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        })
-        
-        # Configurazione del proxy se fornito
-        if self.proxy:
-            self.session.proxies = {
-                "http": self.proxy,
-                "https": self.proxy,
-            }
         
-        # Cache degli annunci già visti
-        self.seen_items = set()
-        self.load_seen_items()
+        # Download e parsing condivisi con le altre ricerche dello stesso URL
+        self.fetch_coalescer = get_fetch_coalescer()
+        
+        # Pagine già elaborate ai polling precedenti: una prima pagina invariata chiude
+        # subito la ricerca. L'ambito comprende i filtri locali, che cambiano i risultati
+        # a parità di URL
+        self.page_cache = get_page_cache()
+        self.cache_scope = (
+            self.keyword_id if self.keyword_id is not None else uuid.uuid4().hex,
+            self.prezzo_min, self.prezzo_max, self.apply_price_limit, self.max_pages
+        )
+        
+        # Metriche dell'ultima ricerca (abbinamento card/annunci, ecc.) e, per run,
+        # di ciascuna keyword
+        self.last_search_metrics = {}
+        self.keyword_metrics = {}
+        
+        # Esecuzione in corso, per l'interruzione da un altro thread (abort)
+        self.abort_reason = None
+        self._run_loop = None
+        self._run_aborted = None
         
-        self.logger.info(f"SubitoScraper inizializzato. Keywords: {self.keywords}, Min prezzo: {self.prezzo_min}, Max prezzo: {self.prezzo_max}, Max pagine: {self.max_pages}")
+        # Cache degli annunci già visti, caricata al primo utilizzo
+        self._seen_items = None
+        
+        self.logger.info(f"SubitoScraper inizializzato. Keywords: {self.keywords}, Min prezzo: {self.prezzo_min}, Max prezzo: {self.prezzo_max}, Max pagine: {self.max_pages}, Parser HTML: {self.html_parser}, Processi di parsing: {self.parse_workers or 'nessuno'}")
     
     def calculate_statistics(self, results):
         """
@@ -194,6 +252,36 @@ class SubitoScraper:
         self.logger.info(f"Risultati salvati in {file_path}")
         return file_path
     
+    @property
+    def seen_items(self):
+        """ID degli annunci già visti: una ricerca invariata non li legge dal DB"""
+        if self._seen_items is None:
+            self._seen_items = set()
+            self.load_seen_items()
+        return self._seen_items
+    
+    @seen_items.setter
+    def seen_items(self, value):
+        self._seen_items = value
+    
+    @property
+    def last_search_metrics(self):
+        """
+        Metriche dell'ultima ricerca. Durante run ogni keyword scrive nelle proprie
+        (keyword_metrics), a fine run riassunte in last_search_metrics['keywords']
+        """
+        metrics = _keyword_metrics.get()
+        return metrics if metrics is not None else self._last_search_metrics
+    
+    @last_search_metrics.setter
+    def last_search_metrics(self, value):
+        self._last_search_metrics = value
+    
+    @property
+    def last_search_unchanged(self):
+        """True se l'ultima ricerca ha trovato la prima pagina invariata rispetto al polling precedente"""
+        return bool(self.last_search_metrics.get('unchanged'))
+    
     def load_seen_items(self):
         """
         Carica gli ID degli annunci già visti da un file cache o dal database
@@ -293,48 +381,34 @@ class SubitoScraper:
         """
         Estrae i risultati dal JSON della risposta
         """
+        return self._filter_ads(self._extract_ads(json_data))
+    
+    def _extract_ads(self, json_data):
+        """
+        Estrae gli annunci dal JSON della risposta, senza filtri
+        """
         results = []
         try:
             if not json_data or 'items' not in json_data or 'list' not in json_data['items']:
                 self.logger.error("JSON non valido o non contiene risultati")
                 return results
             
-            items_list = json_data['items']['list']
-            for decorated_item in items_list:
-                if 'item' in decorated_item and 'kind' in decorated_item['item'] and decorated_item['item']['kind'] == 'AdItem':
-                    ad_item = decorated_item['item']
-                    
-                    # Estrai i dati dell'annuncio
-                    titolo = ad_item.get('subject', 'Titolo non disponibile')
-                    prezzo_raw = self._extract_price(ad_item)
-                    luogo = self._extract_location(ad_item)
-                    data = self._extract_date(ad_item)
-                    url = self._extract_url(ad_item)
-                    item_id = self._extract_id(ad_item)
-                    
-                    # Dopo aver estratto i dati di ogni annuncio, aggiungi un log dettagliato
-                    logger = logging.getLogger("SnipeDeal.SubitoScraper")
-                    logger.info(f"Estratto annuncio: titolo={titolo}, prezzo={prezzo_raw}, url={url}, data={data}, città={luogo}, id={item_id}")
-                    
-                    # Controlla se rispetta i limiti di prezzo
-                    if self.apply_price_limit and prezzo_raw > self.prezzo_max:
-                        continue
-                    
-                    result = {
-                        'titolo': titolo,
-                        'prezzo': prezzo_raw,
-                        'luogo': luogo,
-                        'data': data,
-                        'url': url,
-                        'id': item_id
-                    }
-                    
-                    results.append(result)
+            # Estrae subito solo i campi usati da filtro prezzo e deduplicazione:
+            # data, località e URL vengono decodificati al primo accesso
+            results = [Ad.from_ad_item(ad_item) for ad_item in iter_ad_items(json_data)]
         except Exception as e:
             self.logger.error(f"Errore nell'estrazione dei risultati JSON: {str(e)}")
             traceback.print_exc()
         
-        # Dopo aver aggiornato i risultati con i dati raw, applica il filtro prezzo tra minimo e massimo
+        return results
+    
+    def _filter_ads(self, results):
+        """
+        Registra gli annunci estratti da una pagina e applica il filtro prezzo tra minimo e massimo
+        """
+        for result in results:
+            self.logger.info(f"Estratto annuncio: titolo={result.titolo}, prezzo={result.prezzo}, id={result.id}")
+        
         if self.apply_price_limit:
             min_price = getattr(self, 'prezzo_min', 0) if hasattr(self, 'prezzo_min') else 0
             max_price = self.prezzo_max
@@ -346,189 +420,157 @@ class SubitoScraper:
         """
         Estrae il prezzo dall'elemento annuncio
         """
-        try:
-            if 'features' in ad_item and '/price' in ad_item['features']:
-                price_feature = ad_item['features']['/price']
-                if 'values' in price_feature and len(price_feature['values']) > 0:
-                    return float(price_feature['values'][0]['key'].replace(',', '.'))
-        except (ValueError, KeyError, IndexError) as e:
-            self.logger.warning(f"Errore nell'estrazione del prezzo: {str(e)}")
-        
-        return 0
+        return decode_price(ad_item)
     
     def _extract_location(self, ad_item):
         """
         Estrae solo la città dall'elemento annuncio
         """
-        try:
-            if 'geo' in ad_item:
-                geo_data = ad_item['geo']
-                city = geo_data.get('city', {}).get('value', '')
-                
-                # Se non c'è la città, prova con il comune
-                if not city:
-                    city = geo_data.get('town', {}).get('value', '')
-                
-                return city if city else "Città non specificata"
-        except Exception as e:
-            self.logger.warning(f"Errore nell'estrazione della località: {str(e)}")
-        
-        return "Città non specificata"
+        return decode_location(ad_item)
     
     def _extract_date(self, ad_item):
         """
         Estrae la data dall'elemento annuncio
         """
-        try:
-            if 'date' in ad_item:
-                date_str = ad_item['date']
-                # Converti la stringa di data in un oggetto datetime
-                date_obj = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-                return date_obj.strftime('%d/%m/%Y %H:%M')
-        except Exception as e:
-            self.logger.warning(f"Errore nell'estrazione della data: {str(e)}")
-        
-        return "Data non disponibile"
+        return decode_date(ad_item)
     
     def _extract_url(self, ad_item):
         """
         Estrae l'URL dall'elemento annuncio
         """
-        try:
-            if 'urls' in ad_item and 'default' in ad_item['urls']:
-                return ad_item['urls']['default']
-        except (KeyError, IndexError) as e:
-            self.logger.warning(f"Errore nell'estrazione dell'URL: {str(e)}")
-        
-        return "#"
+        return decode_url(ad_item)
     
     def _extract_id(self, ad_item):
         """
         Estrae l'ID dell'annuncio
         """
-        try:
-            if 'urn' in ad_item:
-                # urn format: "id:ad:61451886-7fac-477b-8896-a782e83a7821:list:600534176"
-                urn_parts = ad_item['urn'].split(':')
-                if len(urn_parts) >= 5:
-                    return urn_parts[4]  # Ultimo elemento
-        except (KeyError, IndexError) as e:
-            self.logger.warning(f"Errore nell'estrazione dell'ID: {str(e)}")
-        
-        return "unknown"
+        return decode_id(ad_item)
     
     def search(self, keyword):
         """
         Esegue una ricerca su Subito.it
         """
+        self.last_search_metrics = {}
+        return run_coroutine(self._run_with_deadline(self._search_async(keyword)))
+    
+    async def _run_with_deadline(self, coro):
+        """
+        Esegue un'esecuzione entro run_deadline secondi. Se la scadenza viene superata
+        o l'esecuzione viene interrotta con abort, i download in corso vengono annullati,
+        l'evento viene registrato nelle metriche e il risultato è una lista vuota.
+        """
+        self.abort_reason = None
+        self.fetch_engine.reset()
+        self._run_loop = asyncio.get_running_loop()
+        self._run_aborted = asyncio.Event()
+        started = time.monotonic()
+        run_task = asyncio.ensure_future(coro)
+        abort_wait = asyncio.ensure_future(self._run_aborted.wait())
+        try:
+            done, _ = await asyncio.wait({run_task, abort_wait}, timeout=self.run_deadline, return_when=asyncio.FIRST_COMPLETED)
+            if run_task in done and (self.abort_reason is None or not isinstance(run_task.exception(), FetchCancelledError)):
+                return run_task.result()
+        finally:
+            self._run_loop = None
+            abort_wait.cancel()
+            run_task.cancel()
+            await asyncio.gather(run_task, abort_wait, return_exceptions=True)
+        
+        if self.abort_reason is not None:
+            self.last_search_metrics['aborted'] = self.abort_reason
+            self.logger.error(f"ESECUZIONE INTERROTTA dopo {time.monotonic() - started:.0f}s: {self.abort_reason}")
+        else:
+            self.fetch_engine.cancel("scadenza dell'esecuzione")
+            self.last_search_metrics['deadline_exceeded'] = round(time.monotonic() - started, 1)
+            self.logger.error(f"ESECUZIONE INTERROTTA: superata la scadenza di {self.run_deadline:.0f}s")
+        return []
+    
+    def abort(self, reason="interruzione richiesta"):
+        """
+        Interrompe l'esecuzione in corso da un altro thread: i download in corso
+        si fermano al blocco successivo e search/run restituiscono una lista vuota
+        
+        Returns:
+            bool: True se c'era un'esecuzione in corso
+        """
+        loop = self._run_loop
+        if loop is None:
+            return False
+        self.abort_reason = reason
+        self.fetch_engine.cancel(reason)
+        try:
+            loop.call_soon_threadsafe(self._run_aborted.set)
+        except RuntimeError:
+            # Il loop è già stato chiuso: l'esecuzione è terminata nel frattempo
+            return False
+        return True
+    
+    async def _search_async(self, keyword):
+        """
+        Ricerca asincrona: le pagine vengono scaricate in modo concorrente nei limiti
+        dello scheduler per host ed elaborate in ordine. Con regions impostato ogni
+        regione viene cercata separatamente e i risultati vengono uniti senza duplicati
+        (metriche per regione in last_search_metrics['shards'])
+        """
         self.logger.info(f"Avvio ricerca per: {keyword}")
         self.logger.info(f"Parametri di ricerca - Max pagine: {self.max_pages}, Limite prezzo: {self.prezzo_max}, Applica limite: {self.apply_price_limit}")
-        all_results = []
         
         if self.use_simulation:
             self.logger.info("Usando la modalità simulazione")
-            return self.simulate_search(keyword)
+            return await self._simulate_search_async(keyword)
         
-        # Parametri di ricerca
-        base_url = "https://www.subito.it/annunci-italia/vendita/usato/?q="
+        # Parametri di ricerca: i filtri supportati dal sito vengono applicati lato server.
+        # Con più regioni ogni regione è una ricerca separata (shard) con la propria
+        # paginazione e il proprio arresto anticipato; gli shard procedono in parallelo
+        # nei limiti dello scheduler per host, condiviso da tutte le richieste
+        if not self.regions:
+            shards = [(None, self.last_search_metrics)]
+        else:
+            shard_metrics = self.last_search_metrics.setdefault('shards', {})
+            shards = [(region, shard_metrics.setdefault(region, {})) for region in self.regions]
+            self.logger.info(f"Ricerca suddivisa in {len(shards)} regioni: {', '.join(self.regions)}")
         
-        retry_count = 0
-        while retry_count < self.max_retries:
-            try:
-                # Esegui la ricerca per ogni pagina
-                for page in range(1, self.max_pages + 1):
-                    page_url = f"{base_url}{keyword}&o={page}"
-                    
-                    self.logger.info(f"Scaricando pagina {page}/{self.max_pages}: {page_url}")
-                    
-                    # Aggiungi un ritardo random per evitare il blocco
-                    time.sleep(random.uniform(2, 5))
-                    
-                    response = self.session.get(page_url)
-                    response.raise_for_status()
-                    
-                    # Salva la pagina HTML per debug
-                    if self.debug:
-                        debug_file = os.path.join(self.debug_dir, f"page_{page}.html")
-                        with open(debug_file, "w", encoding="utf-8") as f:
-                            f.write(response.text)
-                    
-                    # Estrai i dati JSON dall'HTML
-                    json_data = self._extract_json_from_html(response.text)
-                    
-                    # Salva il JSON per debug
-                    if self.debug and json_data:
-                        debug_json = os.path.join(self.debug_dir, f"data_{page}.json")
-                        with open(debug_json, "w", encoding="utf-8") as f:
-                            json.dump(json_data, f, indent=2)
-                    
-                    # Estrai i risultati dal JSON
-                    page_results = self._get_results_from_json(json_data)
-                    
-                    # --- Estrazione RAW da HTML visibile ---
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    cards = soup.select('div.items__item')
-                    for card in cards:
-                        # Estrai URL per match con risultato
-                        link_el = card.select_one('a')
-                        url = link_el['href'] if link_el and 'href' in link_el.attrs else None
-                        # Estrai data visibile
-                        date_el = card.select_one('div.AdInfo-module_date__jR3v2, span.AdInfo-module_date__jR3v2')
-                        date_raw = date_el.text.strip() if date_el else None
-                        # Estrai luogo visibile
-                        luogo_el = card.select_one('span.AdInfo-module_location__XY6Rs, span.AdInfo-module_town__nH89d')
-                        luogo_raw = luogo_el.text.strip() if luogo_el else None
-                        # Estrai stato venduto (badge o testo)
-                        venduto = False
-                        badge_venduto = card.find(string=lambda t: t and 'venduto' in t.lower())
-                        if badge_venduto:
-                            venduto = True
-                        # Trova il risultato corrispondente per URL e aggiorna
-                        for res in page_results:
-                            if url and res.get('url') and url in res['url']:
-                                if date_raw:
-                                    res['data'] = date_raw
-                                if luogo_raw:
-                                    res['luogo'] = luogo_raw
-                                res['data_raw_html'] = date_raw
-                                res['luogo_raw_html'] = luogo_raw
-                                res['venduto_html'] = venduto
-                                res['venduto'] = venduto
-                                # Aggiorna anche il prezzo se visibile
-                                price_el = card.select_one('p.index-module_price__N7M2x')
-                                if price_el:
-                                    try:
-                                        price_text = price_el.text.strip()
-                                        prezzo_html = float(''.join(c for c in price_text if c.isdigit() or c == ',').replace(',', '.'))
-                                        res['prezzo'] = prezzo_html
-                                        res['prezzo_raw_html'] = prezzo_html
-                                    except Exception:
-                                        pass
-                                break
-                    
-                    if not page_results:
-                        self.logger.warning(f"Nessun risultato trovato nella pagina {page}")
-                        break
-                    
-                    self.logger.info(f"Trovati {len(page_results)} risultati nella pagina {page}")
-                    all_results.extend(page_results)
-                    
-                    # Se ci sono meno risultati del previsto, probabilmente è l'ultima pagina
-                    if len(page_results) < 20:  # di solito 30 risultati per pagina
-                        break
-                
-                # Se la ricerca è andata a buon fine, interrompiamo i tentativi
-                break
-                
-            except Exception as e:
-                retry_count += 1
-                self.logger.error(f"Errore durante la ricerca (tentativo {retry_count}/{self.max_retries}): {str(e)}")
-                traceback.print_exc()
-                time.sleep(5)  # Attesa prima di riprovare
+        outcomes = await asyncio.gather(
+            *(self._search_shard(self.build_query(keyword, region), metrics) for region, metrics in shards),
+            return_exceptions=True
+        )
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                # Esecuzione interrotta (abort) o errore imprevisto: nessuna simulazione
+                raise outcome
         
-        if retry_count == self.max_retries:
-            self.logger.error(f"Ricerca fallita dopo {self.max_retries} tentativi. Usando la simulazione come fallback.")
-            return self.simulate_search(keyword)
+        # Prima pagina invariata in tutti gli shard: nessun nuovo annuncio
+        if all(outcome['unchanged'] for outcome in outcomes):
+            self.last_search_metrics['unchanged'] = True
+            return []
+        
+        pages_ok = sum(outcome['pages_ok'] for outcome in outcomes)
+        for (region, metrics), outcome in zip(shards, outcomes):
+            if not outcome['failure']:
+                continue
+            failed_page, error = outcome['failure']
+            metrics['failed_page'] = failed_page
+            if not pages_ok:
+                # Nessuna pagina reale: i risultati simulati non devono passare inosservati
+                self.last_search_metrics['simulated'] = True
+                self.logger.error(f"RICERCA NON RIUSCITA per '{keyword}': nessuna pagina scaricata ({type(error).__name__}: {error}). "
+                                  f"Uso della SIMULAZIONE: i risultati restituiti NON sono annunci reali.")
+                return await self._simulate_search_async(keyword)
+            if not outcome['pages_ok']:
+                self.logger.warning(f"{self._shard_label(region)}Nessuna pagina scaricata ({type(error).__name__}: {error}): "
+                                    f"uso dei risultati delle altre regioni")
+                continue
+            self.logger.warning(f"{self._shard_label(region)}Pagina {failed_page} non scaricata ({type(error).__name__}: {error}): "
+                                f"uso dei risultati delle {outcome['pages_ok']} pagine precedenti")
+        
+        # Unione dei risultati degli shard: un annuncio compare una sola volta
+        all_results = []
+        merged_ids = set()
+        for outcome in outcomes:
+            for result in outcome['results']:
+                if result['id'] not in merged_ids:
+                    merged_ids.add(result['id'])
+                    all_results.append(result)
         
         # Filtra i risultati già visti
         new_results = []
@@ -538,32 +580,451 @@ class SubitoScraper:
                 self.seen_items.add(result['id'])
         
         self.logger.info(f"Trovati {len(new_results)} nuovi risultati su {len(all_results)} totali.")
+        if self.last_search_metrics:
+            self.logger.info(f"Metriche abbinamento card: {self.last_search_metrics}")
         
         # Salva gli ID visti
         self.save_seen_items()
         
+        # Il polling successivo potrà fermarsi alla prima pagina se resta invariata
+        # (solo per gli shard di cui sono state elaborate tutte le pagine previste)
+        for outcome in outcomes:
+            if not outcome['failure']:
+                self.page_cache.commit(outcome['first_page_url'], self.cache_scope, outcome['first_page_hash'])
+        
         return new_results
     
+    def _shard_label(self, region):
+        """Prefisso dei messaggi di log di uno shard regionale (vuoto per tutta Italia)"""
+        return f"[{region}] " if region else ""
+    
+    async def _search_shard(self, query, metrics):
+        """
+        Paginazione di una ricerca: le pagine vengono scaricate in modo concorrente
+        nei limiti dello scheduler per host ed elaborate in ordine, fino all'ultima
+        pagina prevista o all'arresto anticipato
+        
+        Args:
+            query: SearchQuery dello shard (tutta Italia o una regione)
+            metrics: Dizionario delle metriche dello shard (pagine previste, arresto anticipato)
+        
+        Returns:
+            dict: results (annunci filtrati per prezzo, inclusi quelli già visti), pages_ok,
+                  failure ((pagina, errore) o None), unchanged, first_page_url e first_page_hash
+        """
+        label = self._shard_label(query.region if self.regions else None)
+        self.logger.info(f"{label}URL di ricerca: {query.url()}")
+        
+        page_urls = [query.url(page) for page in range(1, self.max_pages + 1)]
+        fetches = []
+        outcome = {
+            'results': [],
+            'pages_ok': 0,
+            'failure': None,
+            'unchanged': False,
+            'first_page_url': page_urls[0],
+            'first_page_hash': None,
+        }
+        
+        def schedule(last_page):
+            # Avvia i download fino a last_page: concorrenza e ritmo sono regolati dallo scheduler
+            while len(fetches) < last_page:
+                fetches.append(asyncio.create_task(self._fetch_listing_page(page_urls[len(fetches)], len(fetches) + 1)))
+        
+        # Il numero di pagine da scaricare è noto solo dopo la prima
+        planned_pages = self.max_pages
+        total_pages = None
+        seen_run = 0
+        try:
+            page = 0
+            while page < planned_pages:
+                page += 1
+                schedule(page)
+                self.logger.info(f"{label}Scaricando pagina {page}/{planned_pages}: {page_urls[page - 1]}")
+                
+                # Ogni pagina viene ritentata singolarmente: un errore ferma la paginazione
+                # ma le pagine già scaricate restano valide
+                try:
+                    page_results, page_info = await fetches[page - 1]
+                except FetchCancelledError:
+                    # Esecuzione interrotta (abort): nessuna simulazione
+                    raise
+                except Exception as e:
+                    outcome['failure'] = (page, e)
+                    break
+                outcome['pages_ok'] += 1
+                
+                # Prima pagina invariata dal polling precedente (304 o stessa lista di ID):
+                # annunci ordinati per data, quindi nessun annuncio nuovo nelle successive
+                if page == 1 and (page_info['not_modified'] or self.page_cache.is_unchanged(page_urls[0], self.cache_scope, page_info['ids_hash'])):
+                    outcome['unchanged'] = True
+                    self.logger.info(f"{label}Prima pagina invariata dal polling precedente"
+                                     f"{' (304 Not Modified)' if page_info['not_modified'] else ''}: nessun nuovo annuncio")
+                    break
+                if page == 1:
+                    outcome['first_page_hash'] = page_info['ids_hash']
+                
+                # Pianifica le pagine dai metadati della prima: totale annunci e numero di pagine
+                if page == 1 and page_info['total_pages'] is not None:
+                    total_pages = page_info['total_pages']
+                    planned_pages = max(1, min(self.max_pages, total_pages))
+                    metrics['planned_pages'] = planned_pages
+                    self.logger.info(f"{label}Annunci totali: {page_info['total']}, pagine totali: {total_pages}, pagine da scaricare: {planned_pages}")
+                
+                if page_info['ads'] == 0:
+                    self.logger.warning(f"{label}Nessun annuncio trovato nella pagina {page}")
+                    break
+                
+                self.logger.info(f"{label}Trovati {len(page_results)} risultati nella pagina {page} ({page_info['ads']} annunci prima dei filtri)")
+                outcome['results'].extend(page_results)
+                
+                # Senza metadati di paginazione: una pagina non piena è probabilmente l'ultima
+                if total_pages is None and page_info['ads'] < 20:  # di solito 30 annunci per pagina
+                    break
+                
+                if page >= planned_pages:
+                    break
+                
+                # Annunci ordinati per data: le pagine successive sono più vecchie di questa
+                if self.early_stop:
+                    seen_run = self._seen_run(page_results, seen_run)
+                    stop_reason = self._early_stop_reason(page_results, seen_run)
+                    if stop_reason:
+                        self.logger.info(f"{label}Arresto anticipato dopo la pagina {page}/{planned_pages}: {stop_reason}")
+                        metrics['early_stop_page'] = page
+                        break
+                
+                # Se la pagina conteneva annunci già visti si prosegue una pagina alla volta
+                # (l'arresto anticipato è vicino), altrimenti si scaricano insieme tutte le
+                # pagine pianificate
+                if not self.early_stop or not any(result['id'] in self.seen_items for result in page_results):
+                    schedule(planned_pages)
+        finally:
+            # Le pagine oltre l'ultima utile non servono più
+            for fetch in fetches:
+                fetch.cancel()
+            await asyncio.gather(*fetches, return_exceptions=True)
+        
+        if self.regions:
+            metrics['pages'] = outcome['pages_ok']
+            metrics['results'] = len(outcome['results'])
+            metrics['unchanged'] = outcome['unchanged']
+        return outcome
+    
+    def build_query(self, keyword, region=None):
+        """
+        Traduce la configurazione dello scraper nei parametri di ricerca del sito.
+        Il filtro prezzo locale (_filter_ads) resta attivo come controllo.
+        
+        Args:
+            region: Regione dello shard (None = tutta Italia)
+        """
+        if isinstance(self.price_pushdown, tuple):
+            # Fascia comune a più campagne (es. tutte quelle della stessa keyword): stesso
+            # URL per tutte, così il download è condiviso (vedi fetch_dedup)
+            min_price, max_price = self.price_pushdown
+        elif self.apply_price_limit and self.price_pushdown:
+            min_price, max_price = self.prezzo_min, self.prezzo_max
+        else:
+            min_price = max_price = None
+        return SearchQuery(
+            keyword,
+            min_price=min_price,
+            max_price=max_price,
+            title_only=self.title_only,
+            category=self.category,
+            region=region,
+            order=SORT_ORDER
+        )
+    
+    def _seen_run(self, page_results, seen_run):
+        """
+        Aggiorna la sequenza di annunci già visti consecutivi più recente,
+        a partire da quella accumulata nelle pagine precedenti
+        """
+        for result in page_results:
+            seen_run = seen_run + 1 if result['id'] in self.seen_items else 0
+        return seen_run
+    
+    def _early_stop_reason(self, page_results, seen_run):
+        """
+        Decide se le pagine successive (più vecchie) possono essere saltate
+        
+        Returns:
+            str | None: Il motivo dell'arresto, None se occorre proseguire
+        """
+        seen_on_page = sum(1 for result in page_results if result['id'] in self.seen_items)
+        # Una pagina senza annunci già visti può precedere annunci nuovi: si prosegue
+        if seen_on_page == 0:
+            return None
+        if seen_on_page == len(page_results):
+            return "nessun annuncio nuovo nella pagina"
+        if self.seen_run_limit and seen_run >= self.seen_run_limit:
+            return f"ultimi {seen_run} annunci già visti"
+        return None
+    
+    async def _fetch_listing_page(self, url, page):
+        """
+        Scarica ed elabora una pagina dei risultati, ritentando solo questa pagina
+        in caso di errore (fino a max_retries tentativi, con backoff esponenziale e
+        jitter). Non si ritenta con il circuit breaker dell'host aperto né per gli
+        errori HTTP 4xx.
+        
+        Returns:
+            tuple: (page_results, page_info)
+        """
+        attempt = 1
+        while True:
+            try:
+                return await self._load_listing_page(url, page)
+            except (CircuitOpenError, FetchCancelledError):
+                raise
+            except Exception as e:
+                status = getattr(getattr(e, 'response', None), 'status_code', None)
+                if attempt >= self.max_retries or (status is not None and 400 <= status < 500 and status != 429):
+                    raise
+                delay = backoff_delay(attempt)
+                self.last_search_metrics['page_retries'] = self.last_search_metrics.get('page_retries', 0) + 1
+                self.logger.warning(f"Errore nella pagina {page} (tentativo {attempt}/{self.max_retries}): {str(e)}. "
+                                    f"Nuovo tentativo tra {delay:.1f}s")
+                attempt += 1
+                await asyncio.sleep(delay)
+    
+    async def _load_listing_page(self, url, page):
+        """
+        Scarica ed elabora una pagina dei risultati. Download e parsing sono condivisi
+        con le altre ricerche dello stesso URL (vedi fetch_dedup): ogni ricerca riceve
+        una copia degli annunci e applica il proprio filtro prezzo.
+        
+        La pagina viene scaricata dalla route dati JSON quando disponibile, altrimenti
+        in HTML (vedi listing_transport). La prima pagina viene richiesta in modo
+        condizionale se la campagna ne ha già elaborato l'ultima versione nota (vedi
+        page_cache): con 304 non viene scaricata.
+        
+        Returns:
+            tuple: (page_results, page_info) con l'hash degli ID in page_info['ids_hash']
+                   e page_info['not_modified'] True per una risposta 304
+        """
+        for transport in listing_transports(url, self.transport_mode, self.json_only):
+            try:
+                return await self._load_listing_page_via(transport, url, page)
+            except TransportError as e:
+                # Il trasporto HTML non solleva TransportError: il ciclo termina sempre
+                report_transport_failure(url, e)
+                self.last_search_metrics['transport_fallbacks'] = self.last_search_metrics.get('transport_fallbacks', 0) + 1
+    
+    async def _load_listing_page_via(self, transport, url, page):
+        # Validatori dell'URL scaricato da questo trasporto (pagina HTML o route dati)
+        fetched_url = transport.page_url(url)
+        headers = self.page_cache.conditional_headers(url, self.cache_scope, fetched_url) if page == 1 else {}
+        
+        async def load():
+            response = await transport.fetch(self.fetch_engine, url, headers=headers, stream=self.stream_pages)
+            response.raise_for_status()
+            return SharedPage(response.url, response.content, response.status_code, response.headers)
+        
+        # Le richieste condizionali si uniscono solo a quelle con gli stessi validatori
+        key = normalize_url(fetched_url)
+        if headers:
+            key += "#" + "|".join(headers.values())
+        shared_page, shared = await self.fetch_coalescer.get_async(key, load)
+        # Metriche della campagna: pagine e byte ricevuti, anche se scaricati da un'altra
+        # ricerca (pages_shared); i download effettivi sono in fetch_dedup_metrics
+        self.last_search_metrics['pages_fetched'] = self.last_search_metrics.get('pages_fetched', 0) + 1
+        self.last_search_metrics['bytes_downloaded'] = self.last_search_metrics.get('bytes_downloaded', 0) + len(shared_page.content)
+        if shared:
+            self.last_search_metrics['pages_shared'] = self.last_search_metrics.get('pages_shared', 0) + 1
+        
+        if shared_page.status_code == 304:
+            self.last_search_metrics['pages_not_modified'] = self.last_search_metrics.get('pages_not_modified', 0) + 1
+            return [], {'ads': None, 'total': None, 'total_pages': None,
+                        'ids_hash': self.page_cache.not_modified(url, fetched_url), 'not_modified': True}
+        
+        # Salva la pagina per debug
+        if self.debug:
+            debug_file = os.path.join(self.debug_dir, f"page_{page}.{transport.name}")
+            with open(debug_file, "wb") as f:
+                f.write(shared_page.content)
+        
+        # Si lavora sui bytes per evitare il rilevamento del charset di response.text.
+        # Il parsing è condiviso tra le ricerche con le stesse opzioni di parsing: le
+        # sue metriche vengono raccolte a parte e sommate da ciascuna ricerca
+        def parse(content):
+            parse_metrics = {}
+            if transport is JSON_TRANSPORT:
+                ads, page_info = self._parse_listing_json(content)
+            else:
+                ads, page_info = self._parse_listing(content, page, parse_metrics)
+            return ads, page_info, parse_metrics
+        
+        ads, page_info, parse_metrics = await asyncio.to_thread(
+            shared_page.parsed, ('listing', self.json_only, self.html_parser), parse
+        )
+        for key, value in parse_metrics.items():
+            self.last_search_metrics[key] = self.last_search_metrics.get(key, 0) + value
+        self.last_search_metrics[f'pages_{transport.name}'] = self.last_search_metrics.get(f'pages_{transport.name}', 0) + 1
+        page_hash = ids_hash(ad['id'] for ad in ads)
+        if page == 1:
+            self.page_cache.store(url, shared_page.headers, page_hash, fetched_url)
+        return self._filter_ads([ad.copy() for ad in ads]), dict(page_info, ids_hash=page_hash, not_modified=False)
+    
+    def _parse_listing_json(self, content):
+        """
+        Elabora una pagina scaricata dalla route dati: stesso stato e stessa estrazione
+        degli annunci della pagina HTML, senza parsing HTML
+        
+        Returns:
+            tuple: (ads, page_info) con gli annunci non filtrati
+        
+        Raises:
+            TransportError: Se il JSON non basta a ricavare gli annunci (vedi JsonTransport.parse_state)
+        """
+        state = JSON_TRANSPORT.parse_state(content, partial=self.partial_json)
+        return self._extract_ads(state), listing_page_info(state)
+    
+    def _parse_listing(self, html, page, metrics=None):
+        """
+        Elabora una pagina con un solo parsing: annunci dal JSON, arricchiti con i dati
+        visibili nell'HTML solo per i campi che il JSON non fornisce
+        
+        Args:
+            metrics: Dizionario in cui contare le metriche del parsing (None = last_search_metrics)
+        
+        Returns:
+            tuple: (ads, page_info) con gli annunci non filtrati
+        """
+        if metrics is None:
+            metrics = self.last_search_metrics
+        ads, cards, card_fields, page_info = self._process_page(html, page, metrics)
+        if card_fields:
+            self._merge_card_data(ads, cards, card_fields, metrics)
+        else:
+            metrics['html_pass_skipped'] = metrics.get('html_pass_skipped', 0) + 1
+        return ads, page_info
+    
+    def _process_page(self, html, page, metrics=None):
+        """
+        Elabora una pagina scaricata: parsing ed estrazione degli annunci (senza filtro prezzo).
+        Con parse_workers > 0 il parsing avviene nel pool di processi condiviso, con
+        ripiego sul processo corrente in caso di errore del pool.
+        
+        Args:
+            metrics: Dizionario in cui contare le metriche del parsing (None = last_search_metrics)
+        
+        Returns:
+            tuple: (page_results, cards, card_fields, page_info) con page_info i metadati
+                   di paginazione della pagina (vedi page_parser.listing_page_info)
+        """
+        if metrics is None:
+            metrics = self.last_search_metrics
+        debug_json = os.path.join(self.debug_dir, f"data_{page}.json") if self.debug else None
+        
+        if self.parse_workers:
+            try:
+                ads, cards, card_fields, page_info = parse_in_pool(
+                    self.parse_workers, html,
+                    html_parser=self.html_parser,
+                    json_only=self.json_only,
+                    partial_json=self.partial_json,
+                    debug_json_path=debug_json
+                )
+            except Exception as e:
+                self.logger.warning(f"Parsing nel pool di processi non riuscito ({type(e).__name__}: {str(e)}), elaborazione nel processo corrente")
+                metrics['parse_pool_fallbacks'] = metrics.get('parse_pool_fallbacks', 0) + 1
+            else:
+                metrics['parse_pool_pages'] = metrics.get('parse_pool_pages', 0) + 1
+                if ads is None:
+                    self.logger.error("Script JSON non trovato nella pagina o struttura JSON non valida")
+                    return [], cards, card_fields, page_info
+                return ads, cards, card_fields, page_info
+        
+        json_data, cards, card_fields = self._parse_page(html)
+        
+        # Salva il JSON per debug
+        if debug_json and json_data:
+            with open(debug_json, "w", encoding="utf-8") as f:
+                json.dump(json_data, f, indent=2)
+        
+        return self._extract_ads(json_data), cards, card_fields, listing_page_info(json_data)
+    
+    def _parse_page(self, html):
+        """
+        Elabora una pagina dei risultati con al massimo un parsing HTML
+        
+        Returns:
+            tuple: (json_data, cards, card_fields) con lo stato initialState della pagina (o None),
+                   la lista dei dati visibili delle card e i campi da prendere dalle card
+        """
+        try:
+            json_data, cards, card_fields = parse_page(html, self.html_parser, json_only=self.json_only, partial_json=self.partial_json)
+        except Exception as e:
+            self.logger.error(f"Errore nell'elaborazione della pagina: {str(e)}")
+            traceback.print_exc()
+            return None, [], set()
+        
+        if json_data is None:
+            self.logger.error("Script JSON non trovato nella pagina o struttura JSON non valida")
+        
+        return json_data, cards, card_fields
+    
+    def _merge_card_data(self, page_results, cards, card_fields=CARD_FIELDS, metrics=None):
+        """
+        Aggiorna i risultati con i dati visibili delle card (data, luogo, venduto, prezzo)
+        
+        Args:
+            page_results: Risultati estratti dal JSON della pagina
+            cards: Dati visibili delle card
+            card_fields: Campi da aggiornare con i valori delle card
+            metrics: Dizionario in cui contare gli abbinamenti (None = last_search_metrics)
+        
+        Returns:
+            dict: Conteggi di card e annunci abbinati/non abbinati
+        """
+        pairs, stats = match_cards(page_results, cards)
+        for res, card in pairs:
+            if 'data' in card_fields:
+                if card['data_raw']:
+                    res['data'] = card['data_raw']
+                res['data_raw_html'] = card['data_raw']
+            if 'luogo' in card_fields:
+                if card['luogo_raw']:
+                    res['luogo'] = card['luogo_raw']
+                res['luogo_raw_html'] = card['luogo_raw']
+            if 'venduto' in card_fields:
+                res['venduto_html'] = card['venduto']
+                res['venduto'] = card['venduto']
+            # Aggiorna anche il prezzo se visibile
+            if 'prezzo' in card_fields and card['prezzo'] is not None:
+                res['prezzo'] = card['prezzo']
+                res['prezzo_raw_html'] = card['prezzo']
+        
+        # Un numero alto di annunci senza card indica un probabile cambio dei selettori HTML
+        if stats['unmatched_ads']:
+            self.logger.warning(f"Card non abbinate: {stats['unmatched_cards']}, annunci senza card: {stats['unmatched_ads']} su {stats['ads']}")
+        
+        if metrics is None:
+            metrics = self.last_search_metrics
+        for key, value in stats.items():
+            metrics[key] = metrics.get(key, 0) + value
+        
+        return stats
+    
     def _extract_json_from_html(self, html):
         """
-        Estrae i dati JSON dallo script nell'HTML della pagina
+        Estrae i dati JSON dallo script nell'HTML della pagina.
+        Usa il fast path di page_parser e costruisce l'albero BeautifulSoup solo come fallback.
         """
         try:
-            soup = BeautifulSoup(html, 'html.parser')
+            json_data = extract_next_data(html)
             
-            # Cerca lo script contenente i dati JSON
-            script_tag = soup.find("script", {"id": "__NEXT_DATA__"})
-            
-            if not script_tag:
+            if not json_data:
                 self.logger.error("Script JSON non trovato nella pagina")
                 return None
             
-            json_text = script_tag.string
-            json_data = json.loads(json_text)
-            
             # Estrai i dati dei risultati
-            if 'props' in json_data and 'pageProps' in json_data['props'] and 'initialState' in json_data['props']['pageProps']:
-                return json_data['props']['pageProps']['initialState']
+            initial_state = get_initial_state(json_data)
+            if initial_state is not None:
+                return initial_state
             
             self.logger.error("Struttura JSON non valida")
             return None
@@ -578,6 +1039,10 @@ class SubitoScraper:
         Simula una ricerca generando risultati casuali
         Utile come fallback o per test
         """
+        return run_coroutine(self._simulate_search_async(keyword))
+    
+    async def _simulate_search_async(self, keyword):
+        """Simulazione nel loop della ricerca: nessun thread per gli URL reali"""
         self.logger.info(f"Simulazione ricerca per: {keyword}")
         
         # URL di ricerca per usarlo come base per le URL simulate
@@ -585,7 +1050,7 @@ class SubitoScraper:
         search_url = f"https://www.subito.it/annunci-italia/vendita/videogiochi/?q={keyword}"
         
         # Ottieni alcuni URL reali da Subito.it per migliorare la simulazione
-        real_urls = self._get_real_urls(search_url, keyword, 5)
+        real_urls = await self._get_real_urls(search_url, keyword, 5)
         
         # Simula un numero casuale di risultati tra 3 e 10
         num_results = random.randint(3, 10)
@@ -684,23 +1149,31 @@ class SubitoScraper:
         else:
             return 300  # Prezzo generico per altre keyword
     
-    def _get_real_urls(self, search_url, keyword, count=5):
+    async def _get_real_urls(self, search_url, keyword, count=5):
         """
         Ottiene URL reali da Subito.it per la keyword specificata
         """
         urls = []
+        hrefs = []
         try:
             self.logger.info(f"Ottenendo URL reali per {keyword}")
-            response = self.session.get(search_url)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
+            for transport in listing_transports(search_url, self.transport_mode):
+                try:
+                    response = await transport.fetch(self.fetch_engine, search_url, stream=False)
+                    response.raise_for_status()
+                    if transport is JSON_TRANSPORT:
+                        state = JSON_TRANSPORT.parse_state(response.content, partial=self.partial_json)
+                        hrefs = [decode_url(ad_item) for ad_item in iter_ad_items(state)]
+                    else:
+                        # I link agli annunci sono nelle card: basta decodificare la parte che precede il JSON
+                        soup = BeautifulSoup(decode_html(response.content, card_region=True), 'html.parser')
+                        hrefs = [link.get("href", "") for link in soup.find_all("a", href=True)]
+                    break
+                except TransportError as e:
+                    report_transport_failure(search_url, e)
             
-            # Cerca i link agli annunci
-            links = soup.find_all("a", href=True)
-            for link in links:
-                href = link.get("href", "")
-                # Filtra solo i link che sembrano annunci
+            # Filtra solo i link che sembrano annunci
+            for href in hrefs:
                 if "subito.it" in href and "/videogiochi/" in href:
                     if href not in urls:
                         urls.append(href)
@@ -720,11 +1193,20 @@ class SubitoScraper:
         """
         all_results = []
         results_by_keyword = {}
+        self.last_search_metrics = {}
+        self.keyword_metrics = {keyword: {} for keyword in self.keywords}
         
-        for keyword in self.keywords:
-            self.logger.info(f"Elaborazione keyword: {keyword}")
-            
-            results = self.search(keyword)
+        # Le keyword vengono cercate in modo concorrente: la cortesia verso il sito
+        # è garantita dallo scheduler per host invece che da pause tra le ricerche
+        keyword_results = run_coroutine(self._run_with_deadline(self._run_async()))
+        
+        # Invariata solo se lo è ogni keyword (dopo una scadenza o un'interruzione
+        # keyword_results è una lista vuota)
+        self.last_search_metrics['keywords'] = self.keyword_metrics
+        if keyword_results and all(metrics.get('unchanged') for metrics in self.keyword_metrics.values()):
+            self.last_search_metrics['unchanged'] = True
+        
+        for keyword, results in zip(self.keywords, keyword_results):
             if results:
                 all_results.extend(results)
                 results_by_keyword[keyword] = results
@@ -734,9 +1216,6 @@ class SubitoScraper:
                 self.logger.info(f"Statistiche per '{keyword}':")
                 self.logger.info(f"  Totale risultati: {stats['count']}")
                 self.logger.info(f"  Prezzo min/max/medio/mediano: €{stats['min_price']}/€{stats['max_price']}/€{stats['avg_price']}/€{stats['median_price']}")
-            
-            # Pausa tra le ricerche
-            time.sleep(random.uniform(5, 10))
         
         # Calcola statistiche complessive
         total_stats = self.calculate_statistics(all_results)
@@ -747,9 +1226,20 @@ class SubitoScraper:
         return {
             "results": all_results,
             "stats": total_stats,
-            "results_by_keyword": results_by_keyword
+            "results_by_keyword": results_by_keyword,
+            "metrics_by_keyword": self.keyword_metrics
         }
     
+    async def _run_async(self):
+        """Cerca tutte le keyword configurate in modo concorrente"""
+        async def search_keyword(keyword):
+            # Ogni keyword è un task con il proprio contesto: le metriche non si mescolano
+            _keyword_metrics.set(self.keyword_metrics.setdefault(keyword, {}))
+            self.logger.info(f"Elaborazione keyword: {keyword}")
+            return await self._search_async(keyword)
+        
+        return await asyncio.gather(*(search_keyword(keyword) for keyword in self.keywords))
+    
     def send_telegram_notification(self, data):
         """
         Invia notifiche Telegram per i nuovi risultati
@@ -822,6 +1312,11 @@ class SubitoScraper:
         # Adatta il formato dei risultati per garantire compatibilità con l'adapter
         compatible_results = []
         for item in results:
+            # I record Ad hanno già le chiavi attese dall'adapter: passano per riferimento
+            if isinstance(item, Ad):
+                compatible_results.append(item)
+                continue
+            
             # Crea una copia per non modificare l'originale
             compatible_item = item.copy()
             
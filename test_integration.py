@@ -54,12 +54,12 @@ def test_scraper_standalone():
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         debug_file = f"debug_standalone_{timestamp}.json"
         with open(debug_file, "w") as f:
-            json.dump(results[:5], f, indent=2)
+            json.dump([dict(r) for r in results[:5]], f, indent=2)
         logger.info(f"Salvati 5 risultati in {debug_file}")
     
     # Controlla che i risultati abbiano le chiavi corrette
     if results:
-        logger.info(f"Esempio di risultato: {json.dumps(results[0], indent=2)}")
+        logger.info(f"Esempio di risultato: {json.dumps(dict(results[0]), indent=2)}")
     
     return results, results_ads, response
 
@@ -103,7 +103,7 @@ def test_adapter_integration():
                 logger.info(f"Ricerca diretta con search_ads ha restituito {len(results)} risultati")
                 
                 if results:
-                    logger.info(f"Esempio di risultato: {json.dumps(results[0], indent=2)}")
+                    logger.info(f"Esempio di risultato: {json.dumps(dict(results[0]), indent=2)}")
         else:
             logger.warning("Scraper non inizializzato")
     except Exception as e:
@@ -113,6 +113,170 @@ def test_adapter_integration():
     
     return None
 
+def test_listing_transports():
+    """
+    Testa i trasporti delle pagine dei risultati con un server locale che imita
+    Subito.it: pagina HTML e route dati JSON devono produrre gli stessi annunci
+    """
+    import tempfile
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    import search_query
+    from fetch_dedup import configure_fetch_dedup, get_fetch_coalescer
+    from page_parser import extract_build_id, extract_next_data
+    
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(base_dir, "data", "debug", "page_1.html"), "rb") as f:
+        html_page = f.read()
+    next_data = extract_next_data(html_page)
+    json_page = json.dumps({"pageProps": next_data["props"]["pageProps"], "__N_SSP": True}).encode()
+    build = {"id": extract_build_id(html_page)}
+    requests_seen = []
+    
+    class StubHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+        
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            requests_seen.append(path)
+            if path == "/annunci-italia/vendita/usato/":
+                body, content_type = html_page, "text/html; charset=utf-8"
+            elif path == f"/_next/data/{build['id']}/annunci-italia/vendita/usato.json":
+                body, content_type = json_page, "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    original_host = search_query.SEARCH_HOST
+    search_query.SEARCH_HOST = f"http://127.0.0.1:{server.server_port}"
+    # Ogni ricerca deve raggiungere il server: nessuna pagina riusata tra le ricerche
+    original_ttl = get_fetch_coalescer().ttl
+    configure_fetch_dedup(0)
+    
+    def search():
+        # Nuovo scraper con dati in una directory temporanea: nessun annuncio già visto
+        scraper = SubitoScraper(keywords=["xbox series s"], max_pages=1, base_dir=tempfile.mkdtemp())
+        results = [dict(result) for result in scraper.search("xbox series s")]
+        return results, scraper.last_search_metrics
+    
+    try:
+        # Primo polling: buildId ancora sconosciuto, pagina HTML
+        html_results, html_metrics = search()
+        logger.info(f"Trasporto HTML: {len(html_results)} risultati, {html_metrics.get('bytes_downloaded')} byte")
+        assert html_metrics.get("pages_html") == 1
+        
+        # Il buildId ricavato dalla pagina HTML abilita la route dati
+        json_results, json_metrics = search()
+        logger.info(f"Trasporto JSON: {len(json_results)} risultati, {json_metrics.get('bytes_downloaded')} byte")
+        assert json_metrics.get("pages_json") == 1
+        assert json_results and json_results == html_results
+        
+        # Nuovo rilascio del sito: la route dati con il vecchio buildId risponde 404
+        # e la pagina viene scaricata in HTML
+        build["id"] = "nuovo-rilascio"
+        fallback_results, fallback_metrics = search()
+        assert fallback_metrics.get("transport_fallbacks") == 1
+        assert fallback_metrics.get("pages_html") == 1
+        assert fallback_results == html_results
+        logger.info(f"Richieste al server di prova: {requests_seen}")
+    finally:
+        search_query.SEARCH_HOST = original_host
+        configure_fetch_dedup(original_ttl)
+        server.shutdown()
+
+def test_fetch_dedup_cancelled_waiter():
+    """
+    Testa il deduplicatore dei download: un richiedente in attesa che rinuncia
+    non deve cancellare il download condiviso né far ripetere in ciclo gli altri
+    """
+    import asyncio
+    from fetch_dedup import FetchCoalescer
+    
+    coalescer = FetchCoalescer(ttl=0)
+    loads = []
+    
+    async def load():
+        loads.append(1)
+        await asyncio.sleep(0.2)
+        return "pagina"
+    
+    async def scenario():
+        owner = asyncio.create_task(coalescer.get_async("pagina", load))
+        await asyncio.sleep(0.01)
+        leaving = asyncio.create_task(coalescer.get_async("pagina", load))
+        staying = asyncio.create_task(coalescer.get_async("pagina", load))
+        await asyncio.sleep(0.05)
+        leaving.cancel()
+        results = await asyncio.gather(owner, leaving, staying, return_exceptions=True)
+        
+        # Download abbandonato da fuori (future condiviso cancellato): chi attende
+        # lo scarica di nuovo, chi scaricava completa senza errori
+        owner = asyncio.create_task(coalescer.get_async("abbandonata", load))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(coalescer.get_async("abbandonata", load))
+        await asyncio.sleep(0.01)
+        coalescer._inflight["abbandonata"].cancel()
+        return results, await asyncio.gather(owner, waiter)
+    
+    (owner, leaving, staying), (abandoned_owner, retried) = asyncio.run(scenario())
+    assert owner == ("pagina", False) and staying == ("pagina", True)
+    assert isinstance(leaving, asyncio.CancelledError)
+    assert abandoned_owner == ("pagina", False) and retried == ("pagina", False)
+    metrics = coalescer.metrics()
+    assert len(loads) == 3 and metrics["coalesced"] == 3 and metrics["inflight"] == 0
+    logger.info(f"Metriche del deduplicatore: {metrics}")
+
+def test_superseded_run_end():
+    """
+    Testa il watchdog con una ricerca bloccata e sostituita: quando la ricerca
+    vecchia termina in ritardo, quella nuova deve restare registrata
+    """
+    from scraper_adapter import ScraperAdapter
+    
+    class StubScraper:
+        run_deadline = 1
+        
+        def __init__(self):
+            self.aborted = None
+        
+        def abort(self, reason):
+            self.aborted = reason
+    
+    adapter = ScraperAdapter()
+    keyword_id = -1
+    old_scraper, new_scraper = StubScraper(), StubScraper()
+    
+    old_token = adapter._begin_run(keyword_id, old_scraper)
+    # Ricerca oltre la durata massima: bloccata, ma la consultazione non la interrompe
+    adapter.active_runs[keyword_id]["started"] -= old_scraper.run_deadline + 61
+    assert adapter.is_run_stalled(keyword_id) and old_scraper.aborted is None
+    assert "stalls" not in adapter.get_run_metrics(keyword_id)
+    # Il watchdog la interrompe
+    assert adapter.check_stalled_runs() == [keyword_id]
+    assert old_scraper.aborted and adapter.is_run_stalled(keyword_id)
+    
+    # Il job viene riavviato mentre la ricerca vecchia non è ancora terminata
+    new_token = adapter._begin_run(keyword_id, new_scraper)
+    adapter._end_run(keyword_id, old_token)
+    assert adapter.active_runs[keyword_id]["scraper"] is new_scraper
+    assert not adapter.is_run_stalled(keyword_id)
+    assert "runs" not in adapter.get_run_metrics(keyword_id)
+    
+    adapter._end_run(keyword_id, new_token)
+    assert keyword_id not in adapter.active_runs
+    metrics = adapter.get_run_metrics(keyword_id)
+    assert metrics["runs"] == 1 and metrics["stalls"] == 1 and metrics["last_duration"] < 60
+    logger.info(f"Metriche della ricerca sostituita: {metrics}")
+
 if __name__ == "__main__":
     logger.info("Inizio dei test di integrazione...")
     
@@ -122,4 +286,13 @@ if __name__ == "__main__":
     # Test dell'integrazione con l'adapter
     adapter_results = test_adapter_integration()
     
+    # Test dei trasporti HTML e JSON con un server locale
+    test_listing_transports()
+    
+    # Test del deduplicatore con un richiedente che rinuncia
+    test_fetch_dedup_cancelled_waiter()
+    
+    # Test del watchdog con una ricerca sostituita che termina in ritardo
+    test_superseded_run_end()
+    
     logger.info("Test di integrazione completati") 
\ No newline at end of file